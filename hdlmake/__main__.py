@@ -54,10 +54,11 @@ def main():
     modules_pool = ModulePool(options)
 
     # Execute the appropriated action for the freshly created modules pool
-    _action_runner(modules_pool)
+    _action_runner(modules_pool, parser)
+    modules_pool.save_manifest_cache()
 
 
-def _action_runner(modules_pool):
+def _action_runner(modules_pool, parser):
     """Funtion that decodes and executed the action selected by the user"""
     options = modules_pool.options
     if options.command == "manifest-help":
@@ -75,6 +76,10 @@ def _action_runner(modules_pool):
         modules_pool.list_files()
     elif options.command == "tree":
         modules_pool.generate_tree()
+    elif options.command == "cache":
+        modules_pool.cache()
+    elif options.command == "watch":
+        modules_pool.watch(parser)
 
 
 def _get_parser():
@@ -95,9 +100,37 @@ def _get_parser():
         help="name for the Makefile file to be created",
         default=None,
         dest="filename")
-    subparsers.add_parser(
+    makefile.add_argument(
+        "-i", "--incremental",
+        help="only parse and solve again the files affected by the changes "
+             "since the previous incremental run (the manifests are still "
+             "read and the whole Makefile is still written)",
+        default=False,
+        action="store_true",
+        dest="incremental")
+    fetch = subparsers.add_parser(
         "fetch",
         help="fetch and/or update all of the remote modules")
+    fetch.add_argument(
+        "-j", "--jobs",
+        help="number of modules fetched at the same time",
+        dest="jobs",
+        type=int,
+        default=argparse.SUPPRESS)
+    fetch.add_argument(
+        "--shallow",
+        help="fetch the git modules pinned to a branch or commit "
+        "without their history",
+        default=False,
+        action="store_true",
+        dest="shallow")
+    fetch.add_argument(
+        "--sparse",
+        help="check out only the folders of the git modules referred to "
+        "by their Manifest.py",
+        default=False,
+        action="store_true",
+        dest="sparse")
     subparsers.add_parser(
         "clean",
         help="clean all of the already fetched remote modules")
@@ -135,6 +168,14 @@ def _get_parser():
         help="print only those files required to build 'top'",
         dest="top",
         default=None)
+    listfiles.add_argument(
+        "--affected-by",
+        help="print only those files affected by a change in the file at "
+             "PATH (can be used several times)",
+        metavar="PATH",
+        dest="affected_by",
+        default=[],
+        action="append")
     tree = subparsers.add_parser(
         "tree",
         help="generate a module hierarchy tree graph")
@@ -163,6 +204,56 @@ def _get_parser():
         default=False,
         action="store_true",
         dest="solved")
+    cache = subparsers.add_parser(
+        "cache",
+        help="show statistics for or clear the HDL parse and manifest caches")
+    cache_action = cache.add_mutually_exclusive_group()
+    cache_action.add_argument(
+        "--stats",
+        help="print the parse cache statistics (default)",
+        default=False,
+        action="store_true",
+        dest="stats")
+    cache_action.add_argument(
+        "--clear",
+        help="remove every entry from the parse and manifest caches",
+        default=False,
+        action="store_true",
+        dest="clear")
+    watch = subparsers.add_parser(
+        "watch",
+        help="keep the design in memory, writing the Makefile again as soon "
+             "as its files change and answering the makefile and list-files "
+             "requests made through a Unix socket")
+    watch.add_argument(
+        "-f", "--filename",
+        help="name for the Makefile file to be written",
+        default=None,
+        dest="filename")
+    watch.add_argument(
+        "--list-files",
+        help="also write the list of files in the design to FILE",
+        metavar="FILE",
+        default=None,
+        dest="list_file")
+    watch.add_argument(
+        "--socket",
+        help="path of the socket the requests are served on "
+             "(default: .hdlmake_cache/watch.sock)",
+        default=None,
+        dest="socket")
+    watch.add_argument(
+        "--polling",
+        help="poll the folders for changes instead of using inotify",
+        default=False,
+        action="store_true",
+        dest="polling")
+    watch.add_argument(
+        "--interval",
+        help="seconds between two polls of the folders (default: 1)",
+        default=1.0,
+        type=float,
+        dest="interval")
     subparsers.add_parser(
         "manifest-help",
         help="print manifest file variables description")
@@ -179,6 +270,19 @@ def _get_parser():
         dest="log",
         default="info",
         help="logging level: debug, info, warning, error, critical")
+    parser.add_argument(
+        "-j", "--jobs",
+        dest="jobs",
+        default=1,
+        type=int,
+        help="number of processes used to parse the HDL files, "
+             "of modules fetched or of manifests read at the same time")
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        default=False,
+        action="store_true",
+        help="do not read nor write the HDL parse and manifest caches")
     parser.add_argument(
         "-p", "--prefix",
         dest="prefix_code",
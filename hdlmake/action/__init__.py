@@ -24,3 +24,4 @@
 
 from .core import ActionCore
 from .tree import ActionTree
+from .watch import ActionWatch
@@ -30,9 +30,16 @@ import sys
 
 from hdlmake.tools import load_syn_tool, load_sim_tool
 from hdlmake.util import shell
+from hdlmake.util import path as path_mod
 from hdlmake.util.termcolor import colored
 from hdlmake import new_dep_solver as dep_solver
-from hdlmake.srcfile import SourceFileSet
+from hdlmake.srcfile import SourceFileSet, report_unknown_extensions
+from hdlmake.dep_file import DepFile
+from hdlmake.parse_cache import (ParseCache, ManifestCache, GraphState,
+                                 get_cache_dir)
+from hdlmake.manifest_parser import ManifestParser, read_manifest
+from hdlmake.manifest_parser.configparser import (evaluate_manifest,
+                                                  is_impure)
 
 
 def set_logging_level(options):
@@ -58,6 +65,29 @@ def set_logging_level(options):
     logging.debug(str(options))
 
 
+def _get_spawn_executor(jobs):
+    """Get a pool of (jobs) worker processes started with the spawn method,
+    or None if it's not available (i.e. Python 2)"""
+    try:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("spawn"))
+    except (ImportError, AttributeError, TypeError, ValueError) as error:
+        logging.debug("The manifests can't be run in worker processes: %s",
+                      error)
+        return None
+
+
+def _is_changed(dep_file, changes, graph_state):
+    """Check if the file, or any of the files it included when it was last
+    solved, is in the set of changed paths. A file that wasn't solved yet
+    is taken as changed"""
+    entry = graph_state.entries.get(dep_file.path)
+    return (entry is None or dep_file.path in changes or
+            any(inc_path in changes for inc_path, _ in entry["includes"]))
+
+
 class Action(list):
 
     """This is the base class providing the common Action methods"""
@@ -68,13 +98,30 @@ class Action(list):
         self.parseable_fileset = SourceFileSet()
         self.privative_fileset = SourceFileSet()
         self._deps_solved = False
+        # index of the modules in the pool by repository
+        self._url_index = {}
+        self._manifest_cache = None
+        self._parse_cache = None
+        self._graph_state = None
+        # manifests being read in the background, by module path
+        self._manifest_reads = {}
+        self._manifest_executor = None
+        # worker processes running the manifests read in the background
+        self._manifest_evaluator = None
         self.options = options
         set_logging_level(options)
         self.new_module(parent=None,
                          url=os.getcwd(),
                          source=None,
                          fetchto=".")
+        self.stop_manifest_prefetch()
+        report_unknown_extensions()
         self.config = self._get_config_dict()
+        self.load_tool()
+
+    def load_tool(self):
+        """Load a new instance of the tool and get the top entity for the
+        action requested by the top manifest"""
         action = self.config.get("action")
         if action == None:
             self.tool = None
@@ -96,17 +143,24 @@ class Action(list):
         Thanks to it the pool can easily control its content
 
         NOTE: the first module added to the pool will become the top_module!.
+        If the repository (or local folder) is already in the pool, the
+        module already there is returned.
         """
         from hdlmake.module import Module, ModuleArgs
         self._deps_solved = False
         new_module_args = ModuleArgs()
         new_module_args.set_args(parent, url, source, fetchto)
         new_module = Module(new_module_args, self)
-        if not self.__contains(new_module):
-            self._add(new_module)
-            if not self.top_module:
-                self.top_module = new_module
-                new_module.parse_manifest()
+        pool_module = self.get_module_by_url(new_module.url,
+                                             new_module.source)
+        if pool_module is not None:
+            logging.debug("Module %s is already in the pool as %s",
+                          url, pool_module.url)
+            return pool_module
+        self._add(new_module)
+        if not self.top_module:
+            self.top_module = new_module
+            new_module.parse_manifest()
         return new_module
 
     def _check_manifest_variable_is_set(self, name):
@@ -140,17 +194,188 @@ class Action(list):
         logging.debug("End build complete file set")
         return all_manifested_files
 
+    def get_parse_cache(self):
+        """Get the parse cache stored next to the top Manifest.py"""
+        if self._parse_cache is None:
+            self._parse_cache = ParseCache(get_cache_dir(self.top_module.path))
+        return self._parse_cache
+
+    def get_graph_state(self):
+        """Get the dependency graph kept next to the top Manifest.py by the
+        incremental runs"""
+        if self._graph_state is None:
+            self._graph_state = GraphState(get_cache_dir(self.top_module.path))
+        return self._graph_state
+
+    def adopt_caches(self, pool):
+        """Take over the caches already loaded by another pool for the same
+        design, e.g. when it's built again after a manifest changed"""
+        self._manifest_cache = pool._manifest_cache
+        self._parse_cache = pool._parse_cache
+        self._graph_state = pool._graph_state
+
+    def get_manifest_cache(self):
+        """Get the manifest cache stored next to the top Manifest.py, or None
+        if the caches are disabled"""
+        if self.options.no_cache:
+            return None
+        if self._manifest_cache is None:
+            self._manifest_cache = ManifestCache(
+                get_cache_dir(self.top_module.path))
+        return self._manifest_cache
+
+    def prefetch_manifests(self, modules):
+        """Start reading the manifests of the provided modules in the
+        background if several jobs are allowed, so that they're already
+        available when the modules are parsed. A manifest whose variables
+        are not in the manifest cache is run in the background as well, by
+        a worker process with its own working directory. The modules are
+        still parsed one at a time and in the same order, taking the
+        variables from the background run if it had the same code and
+        context, so the pool doesn't depend on the number of jobs"""
+        if self.options.jobs <= 1:
+            return
+        if self._manifest_executor is None:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:
+                logging.debug("concurrent.futures is not available, the "
+                              "manifests are read one at a time")
+                return
+            self._manifest_executor = ThreadPoolExecutor(
+                max_workers=self.options.jobs)
+            # created here and not from the threads, and spawning its
+            # processes, as forking a process running threads may deadlock
+            self._manifest_evaluator = _get_spawn_executor(self.options.jobs)
+        cache = self.get_manifest_cache()
+        if cache is not None:
+            # the entries are read on first use, not from the threads
+            cache.entries
+        for module in modules:
+            # the worker threads only get absolute paths, as the working
+            # directory changes while a manifest runs
+            path = os.path.abspath(module.path)
+            if (module.isfetched and module.manifest_dict is None and
+                    path not in self._manifest_reads):
+                self._manifest_reads[path] = self._manifest_executor.submit(
+                    self._prefetch_manifest, path,
+                    module.get_manifest_context())
+
+    def _prefetch_manifest(self, path, extra_context):
+        """Read the manifest of the module at path and, unless its variables
+        for the extra_context are in the manifest cache, run it in a worker
+        process. Get the (file name, content) read and the (run key,
+        result) of the run, None if it wasn't run. The manifests that may
+        declare themselves impure, and those whose variables couldn't be
+        cached when last run, are left to the main process so that their
+        side effects only happen there. This runs in the threads reading
+        the manifests"""
+        prefetched = read_manifest(path)
+        if prefetched[0] is None or self._manifest_evaluator is None:
+            return prefetched, None
+        manifest_parser = ManifestParser()
+        manifest_parser.add_prefix_code(self.options.prefix_code)
+        manifest_parser.add_sufix_code(self.options.sufix_code)
+        manifest_parser.add_manifest(path, prefetched)
+        manifest_parser.purge_context(extra_context)
+        sources = manifest_parser.get_sources()
+        if is_impure(sources):
+            return prefetched, None
+        run_key = manifest_parser.get_run_key(sources, extra_context)
+        cache = self._manifest_cache
+        if cache is not None and (
+                cache.is_cached(manifest_parser.config_file, run_key) or
+                cache.is_uncacheable(manifest_parser.config_file, run_key)):
+            return prefetched, None
+        try:
+            result = self._manifest_evaluator.submit(
+                evaluate_manifest, manifest_parser.config_file, sources,
+                extra_context).result()
+        except Exception as error:
+            logging.warning("Unable to run %s in a worker process, it's run "
+                            "again by hdlmake: %s",
+                            manifest_parser.config_file, error)
+            result = None
+        return prefetched, (run_key, result)
+
+    def get_prefetched_manifest(self, path):
+        """Get the (file name, content) of the manifest of the module at
+        path if it was read in the background, along with the (run key,
+        result) of running it in the background if it was, or None"""
+        future = self._manifest_reads.pop(os.path.abspath(path), None)
+        if future is None:
+            return None, None
+        return future.result()
+
+    def stop_manifest_prefetch(self):
+        """Wait for the manifest reads and runs started in the background
+        and stop their threads and worker processes"""
+        self._manifest_reads = {}
+        if self._manifest_executor is not None:
+            self._manifest_executor.shutdown()
+            self._manifest_executor = None
+        if self._manifest_evaluator is not None:
+            self._manifest_evaluator.shutdown()
+            self._manifest_evaluator = None
+
+    def save_manifest_cache(self):
+        """Write the manifest cache to disk, if it's in use"""
+        if self._manifest_cache is not None:
+            self._manifest_cache.save()
+
     def solve_file_set(self):
         """Build file set with only those files required by the top entity"""
         if not self._deps_solved:
-            dep_solver.solve(self.parseable_fileset,
-                             self.tool.get_standard_libs())
+            if self.options.no_cache:
+                parse_cache = None
+            else:
+                parse_cache = self.get_parse_cache()
+            if parse_cache is not None and getattr(self.options,
+                                                   "incremental", False):
+                dep_solver.solve_incremental(
+                    self.parseable_fileset,
+                    self.get_graph_state(),
+                    self.tool.get_standard_libs(),
+                    parse_cache=parse_cache,
+                    jobs=self.options.jobs)
+            else:
+                dep_solver.solve(self.parseable_fileset,
+                                 self.tool.get_standard_libs(),
+                                 parse_cache=parse_cache,
+                                 jobs=self.options.jobs)
             self._deps_solved = True
         solved_files = SourceFileSet()
         solved_files.add(dep_solver.make_dependency_set(
             self.parseable_fileset, self.top_entity))
         self.parseable_fileset = solved_files
 
+    def reset_file_set(self, solved=True, changes=None):
+        """Forget the file sets built by the previous action, so that the
+        pool can run another one. Unless solved is set, the relations and
+        dependencies found for the files are forgotten as well, e.g. because
+        some of the files changed, and they will be solved again. If the
+        set of changed paths is provided and the files are solved
+        incrementally, only the files at those paths, or including any of
+        them, are forgotten: the incremental solve takes care of the rest"""
+        self.parseable_fileset = SourceFileSet()
+        self.privative_fileset = SourceFileSet()
+        if solved:
+            return
+        self._deps_solved = False
+        graph_state = None
+        if (changes is not None and not self.options.no_cache and
+                getattr(self.options, "incremental", False)):
+            graph_state = self.get_graph_state()
+        for module in self:
+            if module.files is not None:
+                for file_aux in module.files.filter(DepFile):
+                    if (graph_state is None or
+                            _is_changed(file_aux, changes, graph_state)):
+                        file_aux.reset()
+                    else:
+                        # the levels depend on the whole graph
+                        file_aux.dep_level = None
+
     def build_file_set(self):
         """Initialize the parseable and privative fileset contents"""
         total_files = self.build_complete_file_set()
@@ -194,20 +419,29 @@ class Action(list):
         from hdlmake.module import Module
         if not isinstance(new_module, Module):
             raise RuntimeError("Expecting a Module instance")
-        if self.__contains(new_module):
+        url_key = self._get_url_key(new_module.url, new_module.source)
+        if url_key in self._url_index:
             return False
+        self._url_index[url_key] = new_module
         if new_module.isfetched:
             for mod in new_module.submodules():
                 self._add(mod)
         self.append(new_module)
         return True
 
-    def __contains(self, module):
-        """Check if the pool contains the given module by checking the URL"""
-        for mod in self:
-            if mod.url == module.url:
-                return True
-        return False
+    @staticmethod
+    def _get_url_key(url, source):
+        """Get the key identifying the repository (or local folder) at url
+        in the pool indexes"""
+        from hdlmake.fetch import LOCAL
+        if source == LOCAL:
+            return os.path.normcase(os.path.abspath(url))
+        return path_mod.normalize_url(url)
+
+    def get_module_by_url(self, url, source):
+        """Get the module in the pool for the repository (or local folder,
+        if the source is LOCAL) at url, or None if it's not in the pool"""
+        return self._url_index.get(self._get_url_key(url, source))
 
     def __str__(self):
         """Cast the module list as a list of strings"""
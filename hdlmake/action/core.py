@@ -31,8 +31,12 @@ import os.path
 import hdlmake.fetch as fetch
 import hdlmake.new_dep_solver as dep_solver
 from hdlmake.util import path as path_mod
+from hdlmake.util import shell
+from hdlmake.util import stat_cache
 from hdlmake.fetch import Svn, Git, Local
 from hdlmake.fetch import SVN, GIT, LOCAL
+from hdlmake.parse_cache import ManifestCache, GraphState
+from hdlmake.srcfile import report_unknown_extensions
 from .action import Action
 
 
@@ -59,7 +63,8 @@ class ActionCore(Action):
             quit()
 
     def makefile(self):
-        """Write the Makefile for the current design"""
+        """Write the Makefile for the current design, returning False if it
+        didn't change"""
         self._check_all_fetched_or_quit()
         self.build_file_set()
         self.solve_file_set()
@@ -68,47 +73,133 @@ class ActionCore(Action):
         self.tool.write_makefile(self.config,
                                  combined_fileset,
                                  filename=self.options.filename)
+        return self.tool.close()
 
-    def _fetch_all(self):
-        """Fetch all the modules declared in the design"""
-
-        def _fetch_module(module):
-            """Fetch the given module from the remote origin"""
-            new_modules = []
-            logging.debug("Fetching module: %s", str(module))
-            if module.source is SVN:
-                result = self.svn_backend.fetch(module)
-            elif module.source is GIT:
-                result = self.git_backend.fetch(module)
-            elif module.source is LOCAL:
-                result = self.local_backend.fetch(module)
-            if result is False:
-                logging.error("Unable to fetch module %s", str(module.url))
-                sys.exit("Exiting")
-            module.parse_manifest()
-            new_modules.extend(module.local)
-            new_modules.extend(module.svn)
-            new_modules.extend(module.git)
-            return new_modules
+    def _fetch_module(self, module):
+        """Fetch the given module from the remote origin, returning False
+        if it couldn't be fetched"""
+        logging.debug("Fetching module: %s", str(module))
+        if module.source is SVN:
+            return self.svn_backend.fetch(module)
+        elif module.source is GIT:
+            return self.git_backend.fetch(module)
+        elif module.source is LOCAL:
+            return self.local_backend.fetch(module)
+
+    def _queue_modules(self, new_modules, queued_urls):
+        """Add to the pool the provided modules that are not fetched yet, and
+        return those that were not queued before (a module can be required
+        by several others), so that they're fetched only once"""
+        queued = []
+        for mod in new_modules:
+            if not mod.isfetched and mod.url not in queued_urls:
+                logging.debug("Appended to fetch queue: "
+                              + str(mod.url))
+                self._add(mod)
+                queued_urls.add(mod.url)
+                queued.append(mod)
+            else:
+                logging.debug("NOT appended to fetch queue: "
+                              + str(mod.url))
+        return queued
 
+    def _fetched_submodules(self, module, result):
+        """Check the result of fetching the module, quitting if it failed,
+        and get its submodules from its Manifest.py"""
+        if result is False:
+            logging.error("Unable to fetch module %s", str(module.url))
+            sys.exit("Exiting")
+        if module.source is GIT:
+            self.git_backend.narrow(module)
+        # the fetched files weren't there when the file system was queried
+        stat_cache.clear()
+        module.parse_manifest()
+        return module.local + module.svn + module.git
+
+    def _fetch_all(self):
+        """Fetch all the modules declared in the design, running up to
+        (jobs) fetch processes at the same time"""
         fetch_queue = [m for m in self]
+        queued_urls = set(m.url for m in fetch_queue)
+        jobs = self.options.jobs
+        if jobs > 1:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:
+                logging.warning("concurrent.futures is not available, "
+                                "fetching the modules one at a time")
+                jobs = 1
+        if jobs <= 1:
+            while len(fetch_queue) > 0:
+                cur_mod = fetch_queue.pop()
+                if cur_mod.isfetched:
+                    new_modules = cur_mod.submodules()
+                else:
+                    new_modules = self._fetched_submodules(
+                        cur_mod, self._fetch_module(cur_mod))
+                fetch_queue.extend(self._queue_modules(new_modules,
+                                                       queued_urls))
+            return
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            self._fetch_concurrently(executor, fetch_queue, queued_urls)
+
+    def _fetch_captured(self, module):
+        """Fetch the given module keeping the output of the fetch, to be
+        printed at once along with the result"""
+        shell.capture_output()
+        try:
+            result = self._fetch_module(module)
+        finally:
+            output = shell.captured_output()
+        return result, output
 
-        while len(fetch_queue) > 0:
-            cur_mod = fetch_queue.pop()
-            new_modules = []
-            if cur_mod.isfetched:
-                new_modules = cur_mod.submodules()
+    def _fetch_concurrently(self, executor, fetch_queue, queued_urls):
+        """Fetch the queued modules and their submodules using the provided
+        executor. The fetches are handled in the order they were queued: the
+        output of every fetch is printed at once and the module manifest is
+        parsed in this thread, queueing its submodules, as soon as the
+        fetches queued before have been handled, so that the log doesn't
+        depend on which fetch finishes first. The remaining fetches are
+        cancelled as soon as one of them fails"""
+        from concurrent.futures import wait, FIRST_COMPLETED
+        running = []
+        while fetch_queue or running:
+            while fetch_queue:
+                cur_mod = fetch_queue.pop()
+                if cur_mod.isfetched:
+                    fetch_queue.extend(self._queue_modules(
+                        cur_mod.submodules(), queued_urls))
+                    continue
+                # The module paths are relative to the working directory,
+                # that changes while a manifest is parsed
+                cur_mod.path = os.path.abspath(cur_mod.path)
+                running.append((executor.submit(self._fetch_captured,
+                                                cur_mod), cur_mod))
+            if not running:
+                break
+            done = wait([future for future, _ in running],
+                        return_when=FIRST_COMPLETED)[0]
+            if any(future.result()[0] is False for future in done):
+                # handle the fetches up to the failed one, waiting for those
+                # already running
+                for future, _ in running:
+                    future.cancel()
+                ready = len(running)
             else:
-                new_modules = _fetch_module(cur_mod)
-            for mod in new_modules:
-                if not mod.isfetched:
-                    logging.debug("Appended to fetch queue: "
-                                  + str(mod.url))
-                    self._add(mod)
-                    fetch_queue.append(mod)
-                else:
-                    logging.debug("NOT appended to fetch queue: "
-                                  + str(mod.url))
+                ready = 0
+                while ready < len(running) and running[ready][0].done():
+                    ready += 1
+            handled, running = running[:ready], running[ready:]
+            for future, cur_mod in handled:
+                if future.cancelled():
+                    continue
+                result, output = future.result()
+                shell.print_output(output)
+                cur_mod.path = path_mod.relpath(cur_mod.path)
+                if result is not False:
+                    logging.info("Fetched module %s", cur_mod.url)
+                fetch_queue.extend(self._queue_modules(
+                    self._fetched_submodules(cur_mod, result), queued_urls))
 
     def fetch(self):
         """Fetch the missing required modules from their remote origin"""
@@ -116,12 +207,14 @@ class ActionCore(Action):
         for mod in self:
             if mod.isfetched:
                 if 'fetch_pre_cmd' in mod.manifest_dict:
-                    os.system(mod.manifest_dict.get("fetch_pre_cmd", ''))
+                    shell.system(mod.manifest_dict.get("fetch_pre_cmd", ''))
         self._fetch_all()
+        self.stop_manifest_prefetch()
+        report_unknown_extensions()
         for mod in self:
             if mod.isfetched:
                 if 'fetch_post_cmd' in mod.manifest_dict:
-                    os.system(mod.manifest_dict.get("fetch_post_cmd", ''))
+                    shell.system(mod.manifest_dict.get("fetch_post_cmd", ''))
         logging.info("All modules fetched.")
 
     def clean(self):
@@ -140,6 +233,26 @@ class ActionCore(Action):
             logging.info("There are no modules to be removed")
         logging.info("Modules cleaned.")
 
+    def cache(self):
+        """Print the parse cache statistics or clear the caches"""
+        parse_cache = self.get_parse_cache()
+        manifest_cache = ManifestCache(parse_cache.cache_dir)
+        graph_state = GraphState(parse_cache.cache_dir)
+        if self.options.clear:
+            parse_cache.clear()
+            manifest_cache.clear()
+            graph_state.clear()
+            self._manifest_cache = None
+            logging.info("Parse cache cleared: %s", parse_cache.cache_file)
+            return
+        stats = parse_cache.stats()
+        print("Location:\t%s" % stats["location"])
+        print("Entries:\t%d" % stats["entries"])
+        print("Stale entries:\t%d" % stats["stale"])
+        print("Size (bytes):\t%d" % stats["size"])
+        print("Manifest entries:\t%d" % len(manifest_cache.entries))
+        print("Graph entries:\t%d" % len(graph_state.entries))
+
     def list_files(self):
         """List the files added to the design across the pool hierarchy"""
         unfetched_modules = [mod_aux for mod_aux in self
@@ -150,8 +263,10 @@ class ActionCore(Action):
         self.top_entity = self.options.top
         self.build_file_set()
         self.solve_file_set()
-        file_list = dep_solver.make_dependency_sorted_list(
-            self.parseable_fileset)
+        fileset = self.parseable_fileset
+        if self.options.affected_by:
+            fileset = self._get_affected_files(self.options.affected_by)
+        file_list = dep_solver.make_dependency_sorted_list(fileset)
         files_str = [file_aux.path for file_aux in file_list]
         if self.options.reverse is True:
             files_str.reverse()
@@ -161,6 +276,20 @@ class ActionCore(Action):
             delimiter = self.options.delimiter
         print(delimiter.join(files_str))
 
+    def _get_affected_files(self, paths):
+        """Get the solved files affected by a change in the provided paths,
+        logging the top files among them"""
+        graph = dep_solver.DepGraph(self.parseable_fileset)
+        paths = [os.path.abspath(path_aux) for path_aux in paths]
+        for path_aux in paths:
+            if (path_aux not in graph.dependents and
+                    not any(f.path == path_aux for f in graph.files)):
+                logging.warning("%s is not part of the design", path_aux)
+        affected = graph.get_affected(paths)
+        logging.info("%d files affected, top files: %s", len(affected),
+                     ", ".join(f.path for f in graph.get_tops(affected)))
+        return affected
+
     def _print_comment(self, message):
         """Private method that prints a message to stdout if not terse"""
         if not self.options.terse:
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module providing the watch action, which keeps the design in memory and
+updates it as soon as its files change"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import copy
+import time
+import errno
+import shlex
+import select
+import socket
+import logging
+
+import six
+
+from hdlmake.util import stat_cache
+from hdlmake.util import path as path_mod
+from hdlmake.util.watcher import get_watcher
+from hdlmake.dep_file import DepFile
+from hdlmake.srcfile import is_source_file
+from hdlmake.vlog_parser import clear_include_cache
+from hdlmake.parse_cache import get_cache_dir
+from .action import Action
+
+# Name of the socket the requests are served on, in the cache directory
+SOCKET_FILE = "watch.sock"
+# Commands that can be requested through the socket
+REQUEST_COMMANDS = ["makefile", "list-files"]
+# Seconds without new changes before the design is updated, as saving a
+# file (or checking out a branch) usually changes it several times
+_SETTLE_TIME = 0.2
+_MANIFEST_NAMES = ["manifest.py", "Manifest.py"]
+# Maximum length of a request line
+_MAX_REQUEST = 65536
+
+
+class ActionWatch(Action):
+
+    """Class providing the watch action"""
+
+    def __init__(self, *args):
+        super(ActionWatch, self).__init__(*args)
+
+    def watch(self, parser):
+        """Keep the design in memory until interrupted, writing the Makefile
+        again as soon as any of its files change, and answer the requests
+        made through a Unix socket. The parser of the command line is used
+        to decode the requests"""
+        WatchServer(self, parser).run()
+
+
+class WatchServer(object):
+
+    """Class keeping a pool resident in memory along with its parsed and
+    solved files. When only the content of some files changes, the pool is
+    kept and only the files affected by the changes are parsed and solved
+    again. The pool is built again if a manifest changes or a file is added
+    or removed, keeping the caches it had already loaded"""
+
+    def __init__(self, pool, parser):
+        self.pool = pool
+        self.options = pool.options
+        self.options.incremental = True
+        self._parser = parser
+        self._watcher = None
+        self._server = None
+        self._socket_file = None
+        # paths of the files in the design (including the included ones),
+        # and of the folders holding them
+        self._paths = set()
+        self._folders = set()
+        # relevant changes that were not applied yet
+        self._pending = set()
+        self._last_change = 0
+
+    def run(self):
+        """Update the design, then wait for changes and requests"""
+        self._update()
+        self._watcher = get_watcher(self._folders,
+                                    polling=self.options.polling,
+                                    interval=self.options.interval)
+        self._open_socket()
+        logging.info("Watching the design for changes, press Ctrl+C to stop")
+        try:
+            while True:
+                self._wait()
+        except KeyboardInterrupt:
+            logging.info("Stopped watching the design")
+        finally:
+            self._watcher.close()
+            if self._server is not None:
+                self._server.close()
+                os.remove(self._socket_file)
+
+    def _open_socket(self):
+        """Start listening on the Unix socket for the requests, unless it's
+        not supported by the platform or another server is already there"""
+        if not hasattr(socket, "AF_UNIX"):
+            logging.warning("Unix sockets are not supported, the requests "
+                            "will not be served")
+            return
+        socket_file = self.options.socket
+        if socket_file is None:
+            cache_dir = get_cache_dir(self.pool.top_module.path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            socket_file = os.path.join(cache_dir, SOCKET_FILE)
+        socket_file = os.path.abspath(socket_file)
+        if os.path.exists(socket_file):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(socket_file)
+                logging.error("The design is already being watched by the "
+                              "server at %s", socket_file)
+                quit()
+            except socket.error:
+                # left behind by a server that didn't stop cleanly
+                os.remove(socket_file)
+            finally:
+                client.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(socket_file)
+            server.listen(5)
+        except socket.error as error:
+            server.close()
+            logging.warning("Unable to serve the requests at %s: %s",
+                            socket_file, error)
+            return
+        self._server = server
+        self._socket_file = socket_file
+        logging.info("Serving the %s requests at %s",
+                     " and ".join(REQUEST_COMMANDS), socket_file)
+
+    def _wait(self):
+        """Wait for changes or requests and handle them. The changes are
+        applied once no new ones are made for a while"""
+        waitables = [self._server] if self._server is not None else []
+        if self._watcher.fileno() is not None:
+            waitables.append(self._watcher)
+        if self._pending:
+            timeout = _SETTLE_TIME
+        elif self._watcher.fileno() is None:
+            timeout = self._watcher.interval
+        else:
+            timeout = None
+        try:
+            readable = select.select(waitables, [], [], timeout)[0]
+        except (select.error, OSError) as error:
+            if error.args[0] == errno.EINTR:
+                return
+            raise
+        self._collect_changes()
+        if self._server is not None and self._server in readable:
+            self._serve()
+        elif (self._pending and
+              time.time() - self._last_change >= _SETTLE_TIME):
+            self._apply_changes()
+
+    def _is_relevant(self, path):
+        """Check if a change of the file (or folder) at path may change the
+        design: e.g. the Makefile written or the files of the simulator
+        are not relevant"""
+        return (path in self._paths or path in self._folders or
+                os.path.basename(path) in _MANIFEST_NAMES or
+                is_source_file(path))
+
+    def _collect_changes(self):
+        """Add the relevant changes reported by the watcher to the pending
+        ones"""
+        changes = [path for path in self._watcher.read_changes()
+                   if self._is_relevant(path)]
+        if changes:
+            logging.debug("Changed: %s", ", ".join(sorted(changes)))
+            self._pending.update(changes)
+            self._last_change = time.time()
+
+    def _apply_changes(self):
+        """Update the design after the pending changes. The pool is only
+        built again if a manifest changed or a file was added or removed"""
+        changes, self._pending = self._pending, set()
+        stat_cache.clear()
+        clear_include_cache()
+        rebuild = any(os.path.basename(path) in _MANIFEST_NAMES or
+                      path not in self._paths or
+                      not stat_cache.exists(path)
+                      for path in changes)
+        logging.info("%d files changed, updating the design", len(changes))
+        folders = self._folders
+        self._update(rebuild, changes)
+        if self._folders - folders:
+            self._watcher.add_folders(self._folders - folders)
+
+    def _update(self, rebuild=False, changes=None):
+        """Solve again the design, building the pool again if required,
+        and write the Makefile and the list of files. Unless the pool is
+        built again, only the files at the changed paths, or including any
+        of them, are parsed again"""
+        start = time.time()
+        if rebuild:
+            from hdlmake.module_pool import ModulePool
+            try:
+                pool = ModulePool(self.options)
+            except (SystemExit, Exception) as error:
+                logging.error("Unable to load the design, keeping the "
+                              "previous one: %s", error)
+                return
+            pool.adopt_caches(self.pool)
+            self.pool = pool
+        else:
+            self.pool.reset_file_set(solved=False, changes=changes)
+        if self.pool.tool is not None:
+            makefile_args = ["makefile"]
+            if self.options.filename:
+                makefile_args += ["-f", self.options.filename]
+            output = self._run(makefile_args)
+            if output.startswith("error:"):
+                logging.error(output.strip())
+        if self.options.list_file is not None:
+            output = self._run(["list-files"])
+            if output.startswith("error:"):
+                logging.error(output.strip())
+            elif path_mod.write_if_changed(self.options.list_file, output):
+                logging.info("File list written: %s",
+                             self.options.list_file)
+        self.pool.save_manifest_cache()
+        self._get_design_paths()
+        logging.info("Design updated in %.3f seconds", time.time() - start)
+
+    def _get_design_paths(self):
+        """Get the paths of the files in the design, and of the folders
+        holding them, that must be watched"""
+        paths = set()
+        folders = set()
+        for module in self.pool:
+            if module.files is None:
+                continue
+            folders.add(os.path.abspath(module.path))
+            for file_aux in module.files:
+                paths.add(file_aux.path)
+                if isinstance(file_aux, DepFile):
+                    paths.update(dep.path for dep in file_aux.depends_on)
+        folders.update(os.path.dirname(path) for path in paths)
+        self._paths = paths
+        self._folders = folders
+
+    def _run(self, args):
+        """Run the command line args (makefile or list-files) on the pool,
+        getting what it printed. The files are only solved again if the
+        pool was reset since the previous command. The tools update the
+        configuration while writing the Makefile, so a copy is used"""
+        options = copy.copy(self.options)
+        try:
+            options = self._parser.parse_args(args, namespace=options)
+        except SystemExit:
+            return "error: invalid request: %s\n" % " ".join(args)
+        options.incremental = True
+        output = six.StringIO()
+        pool = self.pool
+        stdout = sys.stdout
+        config = pool.config
+        pool.options = options
+        pool.config = copy.deepcopy(config)
+        sys.stdout = output
+        try:
+            pool.reset_file_set()
+            pool.load_tool()
+            if options.command == "makefile":
+                if pool.makefile():
+                    logging.info("Makefile written")
+                print(options.filename or "Makefile")
+            else:
+                pool.list_files()
+        except SystemExit as error:
+            output.write("error: %s\n" % (error.code or "unable to run "
+                                          "%s" % options.command))
+        except Exception as error:
+            logging.debug("Unable to run %s", options.command, exc_info=True)
+            output.write("error: %s: %s\n" % (type(error).__name__, error))
+        finally:
+            sys.stdout = stdout
+            pool.options = self.options
+            pool.config = config
+        return output.getvalue()
+
+    def _serve(self):
+        """Answer a request: a line with the makefile or list-files command
+        line, answered with what the command prints. A request that can't
+        be answered gets the error, and the next ones are still served"""
+        connection = self._server.accept()[0]
+        try:
+            connection.settimeout(5)
+            data = b""
+            while b"\n" not in data and len(data) < _MAX_REQUEST:
+                chunk = connection.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            request = data.split(b"\n")[0].decode("utf-8").strip()
+            logging.debug("Request: %s", request)
+            try:
+                reply = self._answer(request)
+            except Exception as error:
+                logging.error("Unable to answer the request '%s': %s",
+                              request, error)
+                reply = "error: %s: %s\n" % (type(error).__name__, error)
+            connection.sendall(reply.encode("utf-8"))
+        except (socket.error, ValueError) as error:
+            logging.warning("Unable to answer a request: %s", error)
+        finally:
+            connection.close()
+
+    def _answer(self, request):
+        """Get the reply to the request line"""
+        args = shlex.split(request)
+        if not args or args[0] not in REQUEST_COMMANDS:
+            return "error: the request must be one of: %s\n" % (
+                ", ".join(REQUEST_COMMANDS))
+        if self._pending:
+            # answer with the latest version of the design
+            self._apply_changes()
+        return self._run(args)
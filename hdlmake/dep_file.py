@@ -25,6 +25,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import logging
+import weakref
 
 from .util import path as path_mod
 import six
@@ -32,7 +33,11 @@ import six
 
 class DepRelation(object):
 
-    """Class used to create instances representing HDL dependency relations"""
+    """Class used to create instances representing HDL dependency relations.
+    The relations are immutable and interned: creating a relation equal to an
+    existing one returns the same object"""
+
+    __slots__ = ("obj_name", "direction", "rel_type", "_hash", "__weakref__")
 
     # direction
     PROVIDE = 1
@@ -45,7 +50,16 @@ class DepRelation(object):
     ARCHITECTURE = 4
     MODULE = ARCHITECTURE
 
-    def __init__(self, obj_name, direction, rel_type):
+    # Existing relations, indexed by their (obj_name, direction, rel_type).
+    # The relations no file holds anymore (e.g. those of a renamed module in
+    # a process watching the design) are dropped from it
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, obj_name, direction, rel_type):
+        key = (obj_name.lower(), direction, rel_type)
+        rel = cls._interned.get(key)
+        if rel is not None:
+            return rel
         assert direction in [DepRelation.PROVIDE, DepRelation.USE]
         assert rel_type in [
             DepRelation.ENTITY,
@@ -53,9 +67,21 @@ class DepRelation(object):
             DepRelation.INCLUDE,
             DepRelation.ARCHITECTURE,
             DepRelation.MODULE]
-        self.direction = direction
-        self.rel_type = rel_type
-        self.obj_name = obj_name.lower()
+        rel = object.__new__(cls)
+        object.__setattr__(rel, "obj_name", key[0])
+        object.__setattr__(rel, "direction", direction)
+        object.__setattr__(rel, "rel_type", rel_type)
+        object.__setattr__(rel, "_hash", hash(key))
+        return cls._interned.setdefault(key, rel)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DepRelation objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("DepRelation objects are immutable")
+
+    def __reduce__(self):
+        return (DepRelation, (self.obj_name, self.direction, self.rel_type))
 
     def satisfies(self, rel_b):
         """Check if the current dependency relation matches the provided one"""
@@ -66,6 +92,10 @@ class DepRelation(object):
             return True
         return False
 
+    def sort_key(self):
+        """Get a key that can be used to sort relations in a stable way"""
+        return (self.obj_name, self.direction, self.rel_type)
+
     def library(self):
         """If the current relation type is PACKAGE, it returns the base name of
         the library, e.g. for work.counter it returns work."""
@@ -91,11 +121,13 @@ class DepRelation(object):
                                self.obj_name)
 
     def __hash__(self):
-        return hash(self.__repr__())
+        return self._hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         return (isinstance(other, self.__class__)
-                and self.__dict__ == other.__dict__)
+                and self.sort_key() == other.sort_key())
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -103,30 +135,27 @@ class DepRelation(object):
 
 class File(object):
 
-    """This is the base class for all of the different files in HDLMake"""
+    """This is the base class for all of the different files in HDLMake.
+    The parts of the path are computed once, as the Makefile writers use
+    them several times for every file and dependency:
+    - name: the basename of the file path, i.e. the full file name
+    - purename: the file name without the extension
+    - dirname: the directory in which the file is stored"""
+
+    __slots__ = ("path", "module", "name", "purename", "dirname",
+                 "_extension")
+
+    # (directory, origin) -> relative path of directory from origin, shared
+    # by the files in the same directory
+    _rel_dirs = {}
 
     def __init__(self, path, module=None):
         self.path = path
         assert not isinstance(module, six.string_types)
         self.module = module
-
-    @property
-    def name(self):
-        """Property defined as a method that gets the basename of the file
-        path, i.e. it strips the path and takes the full file name"""
-        return os.path.basename(self.path)
-
-    @property
-    def purename(self):
-        """Property defined as a method that gets the name of the file
-        and strips put the extension from the file"""
-        return os.path.splitext(self.name)[0]
-
-    @property
-    def dirname(self):
-        """Property defined as a method that gets the name of the directory
-        in which the file is stored"""
-        return os.path.dirname(self.path)
+        self.dirname, self.name = os.path.split(path)
+        self.purename, extension = os.path.splitext(self.name)
+        self._extension = extension[1:]
 
     def rel_path(self, directory=None):
         """Returns the relative path for the file calculated with (directory)
@@ -134,7 +163,14 @@ class File(object):
         folder from which we are launching the program"""
         if directory is None:
             directory = os.getcwd()
-        return path_mod.relpath(self.path, directory)
+        key = (self.dirname, directory)
+        rel_dir = File._rel_dirs.get(key)
+        if rel_dir is None:
+            rel_dir = File._rel_dirs[key] = path_mod.relpath(self.dirname,
+                                                             directory)
+        if rel_dir == ".":
+            return self.name
+        return os.path.join(rel_dir, self.name)
 
     def __str__(self):
         return self.path
@@ -173,9 +209,7 @@ class File(object):
 
     def extension(self):
         """Method that gets the extension for the file instance"""
-        tmp = self.path.rsplit('.')
-        ext = tmp[len(tmp) - 1]
-        return ext
+        return self._extension
 
 
 class DepFile(File):
@@ -183,6 +217,9 @@ class DepFile(File):
     """Class that serves as base to all those HDL files that can be
     parsed and solved (Verilog, SystemVerilog, VHDL)"""
 
+    __slots__ = ("file_path", "rels", "depends_on", "dep_level",
+                 "is_parsed", "include_paths")
+
     def __init__(self, file_path, module):
         assert isinstance(file_path, six.string_types)
         File.__init__(self, path=file_path, module=module)
@@ -194,6 +231,14 @@ class DepFile(File):
         self.file_path = file_path
         self.include_paths = []
 
+    def reset(self):
+        """Forget the relations and dependencies found by parsing and
+        solving the file, so that it can be parsed again"""
+        self.rels = set()
+        self.depends_on = set()
+        self.dep_level = None
+        self.is_parsed = False
+
     def add_relation(self, rel):
         """Add a new relation to the set provided by the file"""
         self.rels.add(rel)
@@ -215,26 +260,87 @@ class DepFile(File):
     def filename(self):
         """Property defined as a method that checks the basename of the file
         path in the host, i.e. the name of the last directory on the path"""
-        return os.path.basename(self.file_path)
+        return self.name
 
     def get_dep_level(self):
         """Get the dependency level for the file instance, so we can order
         later the full fileset"""
         if self.dep_level is None:
-            if len(self.depends_on) == 0:
-                self.dep_level = 0
-            else:
-                # set dep_level to a negative value so we can detect
-                # if the recusion below brings us back to
-                # this file in a circular reference, that would otherwise
-                # result in an infinite loop.
-                self.dep_level = -1
-                # recurse, to find the largest number of levels below.
-                self.dep_level = 1 + \
-                    max([dep.get_dep_level() for dep in self.depends_on])
-        elif self.dep_level < 0:
-            logging.warning("Probably run into a circular reference of file "
-                            "dependencies. It appears %s depends on itself, "
-                            "indirectly via atleast one other file.",
-                            self.file_path)
+            compute_dep_levels([self])
         return self.dep_level
+
+
+def compute_dep_levels(dep_files):
+    """Set the dependency level of the provided files and of every file they
+    depend on: 0 for the files with no dependencies, and one more than the
+    highest level among its dependencies for the rest. The files in a
+    circular dependency all get the same level, computed from the files
+    they depend on outside the cycle. The dependency graph is walked in
+    O(V+E) with an iterative version of Tarjan's algorithm, so it can be
+    arbitrarily deep. Every cycle found is reported and returned as the
+    sorted list of the paths of the files involved"""
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    cycles = []
+    for root in dep_files:
+        if root.dep_level is not None or id(root) in index:
+            continue
+        index[id(root)] = lowlink[id(root)] = len(index)
+        stack.append(root)
+        on_stack.add(id(root))
+        work = [(root, iter(root.depends_on))]
+        while work:
+            node, deps = work[-1]
+            for dep in deps:
+                if dep.dep_level is not None:
+                    continue
+                if id(dep) not in index:
+                    index[id(dep)] = lowlink[id(dep)] = len(index)
+                    stack.append(dep)
+                    on_stack.add(id(dep))
+                    work.append((dep, iter(dep.depends_on)))
+                    break
+                elif id(dep) in on_stack:
+                    lowlink[id(node)] = min(lowlink[id(node)], index[id(dep)])
+            else:
+                work.pop()
+                if work:
+                    parent = id(work[-1][0])
+                    lowlink[parent] = min(lowlink[parent], lowlink[id(node)])
+                if lowlink[id(node)] == index[id(node)]:
+                    cycle = _solve_component(stack, on_stack, node)
+                    if cycle:
+                        cycles.append(cycle)
+    return cycles
+
+
+def _solve_component(stack, on_stack, root):
+    """Pop from the Tarjan's stack the strongly connected component whose
+    root is provided and set the level of its files. If they make up a
+    circular dependency, it's reported and the list of paths is returned"""
+    component = []
+    while True:
+        member = stack.pop()
+        on_stack.discard(id(member))
+        component.append(member)
+        if member is root:
+            break
+    members = set(id(member) for member in component)
+    level = 0
+    circular = len(component) > 1
+    for member in component:
+        for dep in member.depends_on:
+            if id(dep) in members:
+                circular = True
+            else:
+                level = max(level, dep.dep_level + 1)
+    for member in component:
+        member.dep_level = level
+    if not circular:
+        return None
+    paths = sorted(member.file_path for member in component)
+    logging.warning("Circular dependency between %d files: %s",
+                    len(paths), ", ".join(paths))
+    return paths
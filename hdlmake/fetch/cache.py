@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module providing the shared cache of remote repositories used by the
+fetchers: when the HDLMAKE_FETCH_CACHE variable points to a folder, the
+Git repositories are kept there as bare mirrors and the SVN ones as
+checked out copies, so that every design using them doesn't need to
+download them again"""
+
+from __future__ import absolute_import
+import os
+import re
+import shutil
+import hashlib
+import logging
+import threading
+
+from six.moves import shlex_quote
+
+from hdlmake.util import shell
+
+FETCH_CACHE_VAR = "HDLMAKE_FETCH_CACHE"
+
+# Every cache entry is created or updated at most once per run, and never by
+# two threads at the same time
+_LOCK = threading.Lock()
+_ENTRY_LOCKS = {}
+_UPDATED_ENTRIES = set()
+
+
+def get_entry_path(kind, key):
+    """Get the path of the entry of the (kind) cache for the repository
+    identified by key (usually its URL), or None if the cache is disabled"""
+    cache_dir = os.environ.get(FETCH_CACHE_VAR)
+    if not cache_dir:
+        return None
+    name = re.sub(r"[^\w.-]+", "_", key.rstrip("/").split("/")[-1])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.path.abspath(os.path.expanduser(cache_dir)),
+                        kind, "%s-%s" % (name, digest))
+
+
+def entry_lock(path):
+    """Get the lock to be held while the cache entry at path is used"""
+    with _LOCK:
+        return _ENTRY_LOCKS.setdefault(path, threading.Lock())
+
+
+def needs_update(path):
+    """Check if the cache entry at path was not updated yet in this run, and
+    consider it updated from now on"""
+    with _LOCK:
+        if path in _UPDATED_ENTRIES:
+            return False
+        _UPDATED_ENTRIES.add(path)
+        return True
+
+
+def create_entry(path, command, *args):
+    """Create the cache entry at path by running the command, formatted with
+    a temporary path the entry is moved from once it's complete (as {0})
+    followed by the provided args, all of them quoted: other runs sharing
+    the cache may be creating the same entry. Return False if the command
+    failed"""
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    if shell.system(command.format(
+            *[shlex_quote(arg) for arg in (tmp_path,) + args])) != 0:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        return False
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # somebody else created it meanwhile
+        logging.debug("Cache entry %s already created", path)
+        shutil.rmtree(tmp_path)
+    return True
@@ -23,6 +23,7 @@
 
 from __future__ import absolute_import
 import os
+import shutil
 from hdlmake.util import shell
 
 
@@ -34,12 +35,28 @@ class Fetcher(object):
         """Stub method, this must be implemented by the code fetcher"""
         pass
 
+    @staticmethod
+    def get_work_path(mod_path):
+        """Get the temporary folder where the module at mod_path is fetched
+        before being moved into place, so that the module folder only shows
+        up once it's complete (other modules may be parsed meanwhile). Any
+        leftover from an interrupted fetch is removed"""
+        work_path = os.path.join(os.path.dirname(mod_path),
+                                 "." + os.path.basename(mod_path) +
+                                 ".fetching")
+        if os.path.exists(work_path):
+            shutil.rmtree(work_path)
+        return work_path
+
+    @staticmethod
+    def move_work_path(work_path, mod_path):
+        """Move the fetched module from its temporary folder into place"""
+        if os.path.isdir(mod_path) and not os.listdir(mod_path):
+            os.rmdir(mod_path)
+        os.rename(work_path, mod_path)
+
     @staticmethod
     def check_id(path, command):
         """Use the provided command to get the specific ID from
         the repository at path"""
-        cur_dir = os.getcwd()
-        os.chdir(path)
-        identifier = shell.run(command)
-        os.chdir(cur_dir)
-        return identifier
+        return shell.run(command, cwd=path)
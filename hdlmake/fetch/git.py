@@ -23,10 +23,14 @@
 
 from __future__ import absolute_import
 import os
+from subprocess import Popen, PIPE
+from six.moves import shlex_quote
 from hdlmake.util import path as path_utils
 from hdlmake.util import shell
+from hdlmake.util.pattern import is_pattern
 import logging
 from .fetcher import Fetcher
+from . import cache
 
 
 class Git(Fetcher):
@@ -44,14 +48,36 @@ class Git(Fetcher):
 
     @staticmethod
     def get_submodule_commit(submodule_dir):
-        """Get the commit for a repository if defined in Git submodules"""
-        status_line = shell.run("git submodule status %s" % submodule_dir)
+        """Get the commit for a repository if defined in Git submodules of
+        the repository containing it"""
+        status_line = shell.run("git submodule status %s" %
+                                shlex_quote(submodule_dir),
+                                cwd=os.path.dirname(submodule_dir))
+        if status_line is None:
+            return None
         status_line = status_line.split()
         if len(status_line) == 2:
             return status_line[0][1:]
         else:
             return None
 
+    @staticmethod
+    def get_fetch_modes(module):
+        """Get whether the module must be fetched as a shallow clone and
+        whether as a sparse checkout, as requested in the command line or
+        by the fetch_shallow and fetch_sparse variables of the manifest
+        requiring the module (or else of the top manifest)"""
+        modes = []
+        for mode in ["shallow", "sparse"]:
+            enabled = getattr(module.pool.options, mode, False)
+            for manifest_dict in [module.parent.manifest_dict,
+                                  module.top_module.manifest_dict]:
+                if manifest_dict and "fetch_" + mode in manifest_dict:
+                    enabled = enabled or bool(manifest_dict["fetch_" + mode])
+                    break
+            modes.append(enabled)
+        return tuple(modes)
+
     def fetch(self, module):
         """Get the code from the remote Git repository"""
         fetchto = module.fetchto()
@@ -61,14 +87,6 @@ class Git(Fetcher):
         mod_path = os.path.join(fetchto, basename)
         if basename.endswith(".git"):
             basename = basename[:-4]  # remove trailing .git
-        if not module.isfetched:
-            logging.info("Fetching git module %s", mod_path)
-            cmd = "(cd {0} && git clone {1})"
-            cmd = cmd.format(fetchto, module.url)
-            if os.system(cmd) != 0:
-                return False
-        else:
-            logging.info("Updating git module %s", mod_path)
         checkout_id = None
         if module.branch is not None:
             checkout_id = module.branch
@@ -79,16 +97,174 @@ class Git(Fetcher):
         else:
             checkout_id = self.get_submodule_commit(module.path)
             logging.debug("Git submodule commit: %s", checkout_id)
+        sparse = False
+        if not module.isfetched:
+            logging.info("Fetching git module %s", mod_path)
+            work_path = self.get_work_path(mod_path)
+            shallow, sparse = self.get_fetch_modes(module)
+            if not self._clone(module, work_path, checkout_id,
+                               shallow, sparse):
+                return False
+        else:
+            logging.info("Updating git module %s", mod_path)
+            work_path = mod_path
         if checkout_id is not None:
             logging.info("Checking out version %s", checkout_id)
             cmd = "(cd {0} && git checkout {1})"
-            cmd = cmd.format(mod_path, checkout_id)
-            if os.system(cmd) != 0:
+            cmd = cmd.format(shlex_quote(work_path), shlex_quote(checkout_id))
+            if shell.system(cmd) != 0:
                 return False
+        elif sparse:
+            # the clone was made without checking out the files
+            cmd = "(cd {0} && git checkout)".format(shlex_quote(work_path))
+            if shell.system(cmd) != 0:
+                return False
+        if work_path != mod_path:
+            self.move_work_path(work_path, mod_path)
         module.isfetched = True
         module.path = mod_path
         return True
 
+    def _clone(self, module, work_path, checkout_id, shallow, sparse):
+        """Clone the module repository into work_path. A shallow clone only
+        gets the checkout_id version (if the module is pinned to one), and
+        the files of a sparse clone are not checked out yet, as only the
+        top folder of the repository is initially selected. Every value
+        put in the commands is quoted, as paths and URLs may hold spaces or
+        shell metacharacters"""
+        fetchto, work_dir = os.path.split(work_path)
+        mirror = self.update_mirror(module.url)
+        source = module.url
+        clone_opts = ""
+        if mirror is not None:
+            source = "file://" + mirror
+        elif sparse:
+            # blobs outside the sparse checkout are never downloaded
+            clone_opts += " --filter=blob:none"
+        if sparse:
+            clone_opts += " --no-checkout"
+        if shallow and checkout_id is None:
+            logging.debug("Git module %s is not pinned to a version, "
+                          "cloning all of its history", module.url)
+        if shallow and module.branch is not None:
+            cmd = "(cd {0} && git clone --depth 1 --branch {1}{2} {3} {4})"
+            cmd = cmd.format(shlex_quote(fetchto), shlex_quote(checkout_id),
+                             clone_opts, shlex_quote(source),
+                             shlex_quote(work_dir))
+        elif shallow and checkout_id is not None:
+            # fetch the commit by its id, or everything if the server (or
+            # an abbreviated id) doesn't allow it
+            cmd = ("(cd {0} && git init --quiet {1} && cd {1} && "
+                   "git remote add origin {2} && "
+                   "(git fetch --depth 1{3} origin {4} || git fetch origin))")
+            cmd = cmd.format(shlex_quote(fetchto), shlex_quote(work_dir),
+                             shlex_quote(source),
+                             clone_opts.replace(" --no-checkout", ""),
+                             shlex_quote(checkout_id))
+        elif mirror is not None:
+            source = module.url
+            cmd = ("(cd {0} && git clone --reference {1} --dissociate{2} "
+                   "{3} {4})")
+            cmd = cmd.format(shlex_quote(fetchto), shlex_quote(mirror),
+                             clone_opts, shlex_quote(source),
+                             shlex_quote(work_dir))
+        else:
+            cmd = "(cd {0} && git clone{1} {2} {3})"
+            cmd = cmd.format(shlex_quote(fetchto), clone_opts,
+                             shlex_quote(source), shlex_quote(work_dir))
+        logging.debug(cmd)
+        if shell.system(cmd) != 0:
+            return False
+        if source != module.url:
+            cmd = "(cd {0} && git remote set-url origin {1})"
+            if shell.system(cmd.format(shlex_quote(work_path),
+                                       shlex_quote(module.url))) != 0:
+                return False
+        if sparse:
+            cmd = "(cd {0} && git sparse-checkout init --cone)"
+            if shell.system(cmd.format(shlex_quote(work_path))) != 0:
+                logging.warning("Sparse checkout not supported by git, "
+                                "checking out all the files of %s",
+                                module.url)
+        return True
+
+    @staticmethod
+    def get_sparse_folders(module):
+        """Get the folders of the sparsely checked out module that its
+        Manifest.py refers to, that are the ones to be checked out along
+        with the top folder files"""
+        listing = Popen("git ls-tree -r -d --name-only HEAD", stdout=PIPE,
+                        shell=True, cwd=module.path,
+                        universal_newlines=True).communicate()[0]
+        tree_folders = set(listing.splitlines())
+        folders = set()
+        for path in module.get_manifest_paths():
+            path = path.replace(os.sep, "/")
+            if is_pattern(os.path.dirname(path)):
+                # the folders matching the pattern are somewhere below its
+                # leading literal folders, or anywhere in the module
+                parts = path.split("/")
+                prefix = []
+                while not is_pattern(parts[len(prefix)]):
+                    prefix.append(parts[len(prefix)])
+                if prefix:
+                    folders.add("/".join(prefix))
+                else:
+                    folders.update(folder for folder in tree_folders
+                                   if "/" not in folder)
+                continue
+            if path not in tree_folders:
+                path = os.path.dirname(path)
+            if path and path != ".":
+                folders.add(path)
+        return sorted(folders)
+
+    def narrow(self, module):
+        """Restrict the checkout of a module just fetched as a sparse clone
+        to the folders its Manifest.py refers to. This runs the manifest, so
+        it must be called from the main thread"""
+        if not os.path.exists(os.path.join(module.path, ".git", "info",
+                                           "sparse-checkout")):
+            return
+        if (os.path.exists(os.path.join(module.path, "Manifest.py")) or
+                os.path.exists(os.path.join(module.path, "manifest.py"))):
+            folders = self.get_sparse_folders(module)
+            logging.info("Sparse checkout of %s: %s", module.path,
+                         " ".join(folders) or "top folder only")
+            cmd = "(cd {0} && git sparse-checkout set -- {1})"
+            cmd = cmd.format(shlex_quote(module.path),
+                             " ".join(shlex_quote(f) for f in folders))
+            if shell.system(cmd) == 0:
+                return
+        logging.warning("Checking out all the files of %s", module.path)
+        shell.system("(cd {0} && git sparse-checkout disable)".format(
+            shlex_quote(module.path)))
+
+    @staticmethod
+    def update_mirror(url):
+        """Create or update the bare mirror of the repository at url kept in
+        the fetch cache, and get its path (None if the cache is disabled or
+        the mirror is not usable)"""
+        mirror = cache.get_entry_path("git", url)
+        if mirror is None:
+            return None
+        with cache.entry_lock(mirror):
+            if not cache.needs_update(mirror):
+                success = os.path.isdir(mirror)
+            elif not os.path.isdir(mirror):
+                logging.info("Mirroring git repository %s in %s", url, mirror)
+                success = cache.create_entry(
+                    mirror, "git clone --mirror --quiet {1} {0}", url)
+            else:
+                logging.info("Updating git mirror %s", mirror)
+                cmd = "git --git-dir {0} fetch --prune --quiet"
+                success = shell.system(cmd.format(shlex_quote(mirror))) == 0
+        if not success:
+            logging.warning("Git mirror of %s not usable, cloning it "
+                            "directly", url)
+            return None
+        return mirror
+
     @staticmethod
     def check_git_commit(path):
         """Get the revision number for the Git repository at path"""
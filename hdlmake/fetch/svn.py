@@ -23,9 +23,13 @@
 
 from __future__ import absolute_import
 import os
+import shutil
 import logging
+from six.moves import shlex_quote
 from hdlmake.util import path as path_utils
+from hdlmake.util import shell
 from .fetcher import Fetcher
+from . import cache
 
 
 class Svn(Fetcher):
@@ -41,25 +45,58 @@ class Svn(Fetcher):
         fetchto = module.fetchto()
         if not os.path.exists(fetchto):
             os.mkdir(fetchto)
-        cur_dir = module.pool.top_module.path
-        os.chdir(fetchto)
         basename = path_utils.svn_basename(module.url)
         mod_path = os.path.join(fetchto, basename)
-        cmd = "svn checkout {0} " + module.basename
+        work_path = self.get_work_path(mod_path)
+        url = module.url
         if module.revision:
-            cmd = cmd.format(module.url + '@' + module.revision)
-        else:
-            cmd = cmd.format(module.url)
+            url += '@' + module.revision
         success = True
         logging.info("Checking out module %s", mod_path)
-        logging.debug(cmd)
-        if os.system(cmd) != 0:
-            success = False
-        os.chdir(cur_dir)
+        entry = self.update_cache_entry(url, module.revision)
+        if entry is not None:
+            shutil.copytree(entry, work_path, symlinks=True)
+        else:
+            cmd = "(cd {0} && svn checkout {1} {2})"
+            cmd = cmd.format(shlex_quote(fetchto), shlex_quote(url),
+                             shlex_quote(os.path.relpath(work_path, fetchto)))
+            logging.debug(cmd)
+            if shell.system(cmd) != 0:
+                success = False
+        if success:
+            self.move_work_path(work_path, mod_path)
         module.isfetched = True
-        module.path = os.path.join(fetchto, module.basename)
+        module.path = mod_path
         return success
 
+    @staticmethod
+    def update_cache_entry(url, revision):
+        """Create or update the copy of the repository at url kept in the
+        fetch cache, and get its path (None if the cache is disabled or the
+        copy is not usable). A copy of a given revision never changes, so it
+        is only checked out once"""
+        entry = cache.get_entry_path("svn", url)
+        if entry is None:
+            return None
+        with cache.entry_lock(entry):
+            if not cache.needs_update(entry):
+                success = os.path.isdir(entry)
+            elif not os.path.isdir(entry):
+                logging.info("Caching svn repository %s in %s", url, entry)
+                success = cache.create_entry(
+                    entry, "svn checkout --quiet {1} {0}", url)
+            elif revision:
+                success = True
+            else:
+                logging.info("Updating svn cache %s", entry)
+                cmd = "svn update --quiet {0}"
+                success = shell.system(cmd.format(shlex_quote(entry))) == 0
+        if not success:
+            logging.warning("Svn cache of %s not usable, checking it out "
+                            "directly", url)
+            return None
+        return entry
+
     @staticmethod
     def check_svn_revision(path):
         """Get the revision number for the SVN repository at path"""
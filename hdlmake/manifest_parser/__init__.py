@@ -1,3 +1,3 @@
 """Python Package providing the Manifest.py parser for HDLMake"""
 
-from .variables import ManifestParser
+from .variables import ManifestParser, read_manifest
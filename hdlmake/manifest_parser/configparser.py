@@ -23,15 +23,27 @@
 
 from __future__ import print_function
 from __future__ import absolute_import
+import __future__
 import logging
 import os
 import sys
+import types
+import pickle
+import importlib
+import traceback
 if not sys.version[0] is "2":
     from io import StringIO
 else:
     from StringIO import StringIO
 import contextlib
 
+from hdlmake.util import stat_cache
+
+# The manifests are compiled with the future features of this module, the
+# same that an exec() from here would use
+_COMPILE_FLAGS = (__future__.print_function.compiler_flag |
+                  __future__.absolute_import.compiler_flag)
+
 
 @contextlib.contextmanager
 def stdout_io(stdout=None):
@@ -41,8 +53,75 @@ def stdout_io(stdout=None):
     if stdout is None:
         stdout = StringIO()
     sys.stdout = stdout
-    yield stdout
-    sys.stdout = old
+    try:
+        yield stdout
+    finally:
+        sys.stdout = old
+
+
+def run_code(codes, extra_context, exec_path):
+    """Run the compiled code objects one after the other from the exec_path
+    folder, with extra_context as the global variables, and get the
+    variables they define along with what they printed. The working
+    directory is process-wide, so this must not run in several threads of
+    the same process at once"""
+    options = {}
+    root_path = os.getcwd()
+    with stdout_io() as stdout_aux:
+        os.chdir(exec_path)
+        try:
+            for code in codes:
+                exec(code, extra_context, options)
+        finally:
+            os.chdir(root_path)
+    return options, stdout_aux.getvalue()
+
+
+class _ModuleRef(object):
+
+    """Reference to a module imported by a manifest run in a worker
+    process, sent back in place of the module"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def evaluate_manifest(config_file, sources, extra_context):
+    """Run the manifest config_file, given as (code, file name) sources, in
+    a worker process, which can change its own working directory to the
+    manifest folder without affecting the rest of HDLMake. Get the defined
+    variables and what was printed. If the run fails or its variables can't
+    be sent back, the error is raised to the main process, which runs the
+    manifest again to report it or to get the variables"""
+    codes = [compile(source, filename, "exec", _COMPILE_FLAGS, True)
+             for source, filename in sources if source]
+    try:
+        options, printed = run_code(codes, extra_context,
+                                    os.path.dirname(config_file))
+    except SystemExit as error_exit:
+        # not to be taken as the exit of the worker process
+        raise RuntimeError("exit requested: %s" % error_exit)
+    for name, value in list(options.items()):
+        if isinstance(value, types.ModuleType):
+            options[name] = _ModuleRef(value.__name__)
+    pickle.dumps(options)
+    return options, printed
+
+
+def is_impure(sources):
+    """Check if the manifest given as (code, file name) sources may declare
+    itself impure, in which case it must only be run by the main process"""
+    return any("__impure" in source for source, _ in sources if source)
+
+
+def _load_evaluated(result):
+    """Get the variables and the printed text from the result of
+    evaluate_manifest, importing again the modules the manifest imported"""
+    options, printed = result
+    for name, value in list(options.items()):
+        if isinstance(value, _ModuleRef):
+            options[name] = importlib.import_module(value.name)
+    return options, printed
 
 
 class ConfigParser(object):
@@ -196,6 +275,7 @@ types:[<type 'int'>]
         self.prefix_code = ""
         self.sufix_code = ""
         self.config_file = None
+        self.config_content = None
 
     def __setitem__(self, name, value):
         if name in self.__names():
@@ -267,13 +347,15 @@ types:[<type 'int'>]
 
         self[name].add_key(key)
 
-    def add_config_file(self, config_file):
-        """Add the Manifest to be processed by the parser"""
+    def add_config_file(self, config_file, content=None):
+        """Add the Manifest to be processed by the parser, providing its
+        content if it has already been read"""
         if self.config_file is not None:
             raise RuntimeError("Config file should be added only once")
-        if not os.path.exists(config_file):
+        if content is None and not stat_cache.exists(config_file):
             raise RuntimeError("Config file doesn't exists: " + config_file)
         self.config_file = config_file
+        self.config_content = content
         return
 
     def add_prefix_code(self, code):
@@ -282,53 +364,71 @@ types:[<type 'int'>]
 
     def add_sufix_code(self, code):
         """Add the arbitrary Python to be executed just after the Manifest"""
-        self.prefix_code += code + '\n'
+        self.sufix_code += code + '\n'
 
     def __names(self):
         """A method that returns a list containing the name for every non
         empty object in the parser's option instance list"""
         return [o.name for o in self.options if o is not None]
 
-    def __parser_runner(self, content, extra_context):
-        """method that acts as an 'exec' wraper to run the Python code"""
-        options = {}
+    def __parser_runner(self, sources, extra_context, cache=None):
+        """method that acts as an 'exec' wraper to run the Python code,
+        provided as a list of (code, file name) sources that are compiled
+        (or taken from the cache) and run one after the other, so that the
+        errors refer to the actual line in the file they come from"""
         try:
-            with stdout_io() as stdout_aux:
-                root_path = os.getcwd()
-                exec_path = os.path.dirname(self.config_file)
-                os.chdir(exec_path)
-                exec(content, extra_context, options)
-                os.chdir(root_path)
-            printed = stdout_aux.getvalue()
-            if len(printed) > 0:
-                logging.info(
-                    "The manifest inside " +
-                    self.config_file +
-                    " tried to print something:")
-                for line in printed.split('\n'):
-                    print("> " + line)
+            codes = []
+            for source, filename in sources:
+                if not source:
+                    continue
+                if cache is not None:
+                    codes.append(cache.get_code(source, filename,
+                                                _COMPILE_FLAGS))
+                else:
+                    codes.append(compile(source, filename, "exec",
+                                         _COMPILE_FLAGS, True))
+            options, printed = run_code(codes, extra_context,
+                                        os.path.dirname(self.config_file))
         except SyntaxError as error_syntax:
             logging.error("Invalid syntax in the manifest file " +
                           self.config_file + ":\n" + str(error_syntax))
-            logging.error(content)
+            logging.error(error_syntax.text)
             quit()
         except SystemExit as error_exit:
             logging.error("Exit requested by the manifest file " +
                           self.config_file + ":\n" + str(error_exit))
-            logging.error(content)
             quit()
         except:
-            logging.error("Encountered unexpected error while parsing " +
-                          self.config_file)
-            logging.error(content)
+            lines = [frame[1] for frame in
+                     traceback.extract_tb(sys.exc_info()[2])
+                     if frame[0] == self.config_file]
+            if lines:
+                logging.error("Encountered unexpected error while parsing "
+                              "%s at line %d", self.config_file, lines[-1])
+            else:
+                logging.error("Encountered unexpected error while parsing " +
+                              self.config_file)
             print(str(sys.exc_info()[0]) + ':' + str(sys.exc_info()[1]))
             raise
+        self.__report_printed(printed)
         return options
 
+    def __report_printed(self, printed):
+        """Show what the manifest code printed while it was run"""
+        if len(printed) > 0:
+            logging.info(
+                "The manifest inside " +
+                self.config_file +
+                " tried to print something:")
+            for line in printed.split('\n'):
+                print("> " + line)
+
     def __read_config_content(self):
         """Load the Manifest.py file content in a local variable and return
         the obtained value as a string"""
-        if self.config_file is not None:
+        if self.config_content is not None:
+            content = self.config_content
+        elif self.config_file is not None:
             with open(self.config_file, "r") as config_file:
                 content = config_file.readlines()
                 content = ''.join(content)
@@ -336,22 +436,59 @@ types:[<type 'int'>]
             content = ''
         return content
 
-    def parse(self, extra_context=None):
-        """Parse the stored manifest plus arbitrary code"""
-        assert isinstance(extra_context, dict) or extra_context is None
-
-        # These HDLMake keys must not be inherited from parent module
+    @staticmethod
+    def purge_context(extra_context):
+        """Remove from the extra_context the HDLMake keys that must not be
+        inherited from the parent module"""
         key_purge_list = ["modules", "files", "include_dirs",
                           "inc_makefiles", "library"]
         for key_to_be_deleted in key_purge_list:
             extra_context.pop(key_to_be_deleted, None)
+
+    def get_sources(self):
+        """Get the (code, file name) sources run for the stored manifest:
+        the arbitrary prefix code, the Manifest.py and the sufix code"""
         # Load the Manifest.py file content in a local variable
         content = self.__read_config_content()
+        return [(self.prefix_code, "<prefix code>"),
+                (content, self.config_file),
+                (self.sufix_code, "<sufix code>")]
+
+    @staticmethod
+    def get_run_key(sources, extra_context):
+        """Get the key identifying a run of the sources with the (purged)
+        extra_context, the same used by the ManifestCache"""
+        from hdlmake.parse_cache import ManifestCache
+        return ManifestCache.get_key(
+            '\n'.join(source for source, _ in sources), extra_context)
+
+    def parse(self, extra_context=None, cache=None, evaluated=None):
+        """Parse the stored manifest plus arbitrary code. If a ManifestCache
+        is provided, the code is only run if its variables for the same code
+        and extra_context are not in the cache. The (run key, result) pair
+        given by evaluate_manifest somewhere else can be provided as
+        evaluated, whose result is used if the key matches this run"""
+        assert isinstance(extra_context, dict) or extra_context is None
+
+        self.purge_context(extra_context)
         # Now, grab the options coming from Manifest.py plus arbitrary_code:
         # - extra_context as global variables.
         # - options as local variables.
-        content = self.prefix_code + '\n' + content + '\n' + self.sufix_code
-        options = self.__parser_runner(content, extra_context)
+        sources = self.get_sources()
+        options = None
+        if cache is not None or evaluated is not None:
+            run_key = self.get_run_key(sources, extra_context)
+        if cache is not None:
+            options = cache.load(self.config_file, run_key)
+        if options is None:
+            if (evaluated is not None and evaluated[1] is not None and
+                    evaluated[0] == run_key):
+                options, printed = _load_evaluated(evaluated[1])
+                self.__report_printed(printed)
+            else:
+                options = self.__parser_runner(sources, extra_context, cache)
+            if cache is not None:
+                cache.store(self.config_file, run_key, options)
         # Checkheck the options that were defined in the local context
         ret = {}
         for opt_name, val in list(options.items()):
@@ -26,6 +26,7 @@ from __future__ import absolute_import
 import os
 import logging
 
+from hdlmake.util import stat_cache
 from .configparser import ConfigParser
 
 
@@ -45,6 +46,11 @@ class ManifestParser(ConfigParser):
              'default': None,
              'help': "Include dirs for Verilog sources",
              'type': []},
+            {'name': 'vlog_defines',
+             'default': None,
+             'help': "Verilog macros (NAME or NAME=VALUE) defined when "
+             "parsing the Verilog sources",
+             'type': []},
             {'name': 'action',
              'default': '',
              'help': "What is the action that should be taken if "
@@ -60,8 +66,19 @@ class ManifestParser(ConfigParser):
              'type': []},
             {'name': 'files',
              'default': [],
-             'help': "List of files from the current module",
+             'help': "List of files, folders or glob patterns (e.g. "
+                     "\"rtl/**/*.vhd\") from the current module",
              'type': ''},
+            {'name': 'exclude_files',
+             'default': [],
+             'help': "List of glob patterns of the files or folders left "
+                     "out of the module files",
+             'type': []},
+            {'name': 'file_types',
+             'default': {},
+             'help': "Extra file extensions, mapped to the already known "
+                     "extension of the same file type (top manifest only)",
+             'type': {}},
             {'name': 'modules',
              'default': {},
              'help': "List of local modules",
@@ -69,8 +86,10 @@ class ManifestParser(ConfigParser):
         self.add_option_list(general_options)
         self.add_delimiter()
         self.add_type('include_dirs', type_new="")
+        self.add_type('vlog_defines', type_new="")
         self.add_type('incl_makefiles', type_new='')
         self.add_type('files', type_new=[])
+        self.add_type('exclude_files', type_new='')
         self.add_allowed_key('modules', key="svn")
         self.add_allowed_key('modules', key="git")
         self.add_allowed_key('modules', key="local")
@@ -79,6 +98,16 @@ class ManifestParser(ConfigParser):
              'default': None,
              'help': "Destination for fetched modules",
              'type': ''},
+            {'name': 'fetch_shallow',
+             'default': False,
+             'help': "Fetch the Git modules pinned to a branch or commit "
+             "without their history",
+             'type': False},
+            {'name': 'fetch_sparse',
+             'default': False,
+             'help': "Check out only the folders of the Git modules "
+             "referred to by their Manifest.py",
+             'type': False},
             {'name': 'fetch_pre_cmd',
              'default': '',
                         'help': "Command to be executed before fetch",
@@ -254,41 +283,56 @@ class ManifestParser(ConfigParser):
                             help=option["help"],
                             type=option["type"])
 
-    def add_manifest(self, path):
-        """Add to configuration the Manifest at directory (path) if exists"""
-        def _search_for_manifest(path):
-            """
-            Look for manifest in the given folder and create a Manifest object
-            """
-            logging.debug("Looking for manifest in " + path)
-            dir_files = os.listdir(path)
-            if "manifest.py" in dir_files and "Manifest.py" in dir_files:
-                logging.error(
-                    "Both manifest.py and Manifest.py" +
-                    "found in the module directory: %s",
-                    path)
-                quit()
-            for filename in dir_files:
-                if filename == "manifest.py" or filename == "Manifest.py":
-                    if not os.path.isdir(filename):
-                        logging.debug("Found manifest for module %s: %s",
-                                      path, filename)
-                        path_aux = os.path.join(path, filename)
-                        if not isinstance(path_aux, str):
-                            raise ValueError("Path must be an instance of str")
-                        #if not path_mod.is_abs_path(path_aux):
-                        #    raise ValueError(
-                        #        "Manifest path must be absolute path")
-                        return path_aux
-            return None
-        manifest = _search_for_manifest(path)
+    def add_manifest(self, path, prefetched=None):
+        """Add to configuration the Manifest at directory (path) if exists.
+        The (file name, content) pair obtained from read_manifest(path) can
+        be provided if the Manifest was already read"""
+        if prefetched is None:
+            manifest = find_manifest(path)
+            content = None
+        else:
+            manifest, content = prefetched
+            if manifest is not None:
+                manifest = os.path.join(path, manifest)
         if manifest is None:
             logging.error("No manifest found in path: %s", path)
             quit()
         else:
             logging.debug("Parse manifest in: %s", manifest)
-            return self.add_config_file(manifest)
+            return self.add_config_file(manifest, content)
 
     def print_help(self):
         """Print the help for the Manifest parser object"""
         self.help()
+
+
+def find_manifest(path):
+    """
+    Look for manifest in the given folder and get its path, or None if
+    there is no manifest
+    """
+    logging.debug("Looking for manifest in " + path)
+    dir_files = dict(stat_cache.scan_dir(path))
+    if "manifest.py" in dir_files and "Manifest.py" in dir_files:
+        logging.error(
+            "Both manifest.py and Manifest.py" +
+            "found in the module directory: %s",
+            path)
+        quit()
+    for filename in ["manifest.py", "Manifest.py"]:
+        if filename in dir_files and dir_files[filename] != stat_cache.DIR:
+            logging.debug("Found manifest for module %s: %s",
+                          path, filename)
+            return os.path.join(path, filename)
+    return None
+
+
+def read_manifest(path):
+    """Look for manifest in the given folder and read it, getting its file
+    name and its content (both None if there is no manifest). This can be
+    run from any thread, provided that path is absolute"""
+    manifest = find_manifest(path)
+    if manifest is None:
+        return None, None
+    with open(manifest, "r") as manifest_file:
+        return os.path.basename(manifest), manifest_file.read()
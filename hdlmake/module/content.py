@@ -5,6 +5,8 @@ from __future__ import absolute_import
 import logging
 from hdlmake import fetch
 from hdlmake.util import path as path_mod
+from hdlmake.util import stat_cache
+from hdlmake.util.pattern import PatternWalker, is_pattern
 from .core import ModuleCore
 import six
 import os
@@ -58,7 +60,9 @@ class ModuleContent(ModuleCore):
 
     def _process_manifest_files(self):
         """Process the files instantiated by the HDLMake module"""
-        from hdlmake.srcfile import SourceFileSet
+        from hdlmake.srcfile import SourceFileSet, is_source_file
+        if self.parent is None:
+            self._register_file_types()
         # HDL files provided by the module
         if "files" not in self.manifest_dict:
             self.files = SourceFileSet()
@@ -72,8 +76,50 @@ class ModuleContent(ModuleCore):
                 self.manifest_dict["files"])
             logging.debug("Files in %s: %s",
                           self.path, str(self.manifest_dict["files"]))
-            paths = self._make_list_of_paths(self.manifest_dict["files"])
-            self.files = self._create_file_list_from_paths(paths=paths)
+            walker = PatternWalker(
+                self.path,
+                excludes=path_mod.flatten_list(
+                    self.manifest_dict.get("exclude_files")),
+                accept=is_source_file)
+            paths = self._make_list_of_paths(
+                [filepath for filepath in self.manifest_dict["files"]
+                 if not is_pattern(filepath)])
+            for pattern in self.manifest_dict["files"]:
+                if is_pattern(pattern):
+                    paths.extend(self._resolve_pattern(walker, pattern))
+            self.files = self._create_file_list_from_paths(
+                paths=paths, exclude=walker.is_excluded)
+
+    def _register_file_types(self):
+        """Register the extra file extensions of the top manifest"""
+        from hdlmake.srcfile import register_file_type, get_file_type
+        file_types = self.manifest_dict.get("file_types") or {}
+        for extension, known_extension in sorted(file_types.items()):
+            file_class = get_file_type(known_extension)
+            if file_class is None:
+                logging.error("Unknown file type %s for extension %s",
+                              known_extension, extension)
+                quit()
+            register_file_type(extension, file_class)
+
+    def _resolve_pattern(self, walker, pattern):
+        """Get the paths of the source files matching a pattern in the
+        files of the manifest"""
+        if path_mod.is_abs_path(pattern):
+            logging.warning(
+                "Specified pattern seems to be an absolute path: " +
+                pattern + "\nOmitting.")
+            return []
+        visited = walker.visited
+        paths = walker.glob(pattern)
+        logging.debug("Pattern %s in %s matched %d files, %d entries visited",
+                      pattern, self.path, len(paths),
+                      walker.visited - visited)
+        if not paths:
+            logging.warning(
+                "Pattern specified in manifest %s doesn't match any file: %s",
+                self.path, pattern)
+        return paths
 
     def _get_fetchto(self):
         """Calculate the fetchto folder"""
@@ -149,12 +195,12 @@ class ModuleContent(ModuleCore):
         makefiles_paths = self._make_list_of_paths(included_makefiles_aux)
         self.incl_makefiles.extend(makefiles_paths)
 
-    def _create_file_list_from_paths(self, paths):
+    def _create_file_list_from_paths(self, paths, exclude=None):
         """
         Build a Source File Set containing the files indicated by the
-        provided list of paths
+        provided list of paths, but those for which exclude returns True
         """
-        from hdlmake.srcfile import create_source_file, SourceFileSet
+        from hdlmake.srcfile import create_source_files, SourceFileSet
         srcs = SourceFileSet()
         # Check if this is the top module and grab the include_dirs
         if self.parent is None:
@@ -167,19 +213,39 @@ class ModuleContent(ModuleCore):
                 include_dirs = self.top_module.manifest_dict['include_dirs']
             else:
                 include_dirs = []
+        vlog_defines = self._get_vlog_defines()
+        if exclude is not None:
+            paths = [path_aux for path_aux in paths if not exclude(path_aux)]
+        file_paths = []
         for path_aux in paths:
-            if os.path.isdir(path_aux):
-                dir_ = os.listdir(path_aux)
-                for f_dir in dir_:
+            if stat_cache.isdir(path_aux):
+                for f_dir, kind in stat_cache.scan_dir(path_aux):
                     f_dir = os.path.join(self.path, path_aux, f_dir)
-                    if not os.path.isdir(f_dir):
-                        srcs.add(create_source_file(path=f_dir,
-                                                    module=self,
-                                                    library=self.library,
-                                                    include_dirs=include_dirs))
+                    if kind != stat_cache.DIR and not (
+                            exclude is not None and exclude(f_dir)):
+                        file_paths.append(f_dir)
             else:
-                srcs.add(create_source_file(path=path_aux,
-                                            module=self,
-                                            library=self.library,
-                                            include_dirs=include_dirs))
+                file_paths.append(path_aux)
+        srcs.add(create_source_files(paths=file_paths,
+                                     module=self,
+                                     library=self.library,
+                                     include_dirs=include_dirs,
+                                     vlog_defines=vlog_defines))
         return srcs
+
+    def _get_vlog_defines(self):
+        """Get the list of (name, expansion) Verilog macros defined by the
+        +define+ arguments in the top module vlog_opt, followed by the ones
+        in the top module and in this module vlog_defines (the later
+        definition of a macro takes precedence)"""
+        from hdlmake.vlog_parser import get_vlog_opt_defines, split_define
+        manifests = [self.manifest_dict]
+        if self.parent is not None:
+            manifests.insert(0, self.top_module.manifest_dict)
+        defines = get_vlog_opt_defines(manifests[0].get("vlog_opt") or "")
+        for manifest in manifests:
+            vlog_defines = manifest.get("vlog_defines") or []
+            if isinstance(vlog_defines, six.string_types):
+                vlog_defines = [vlog_defines]
+            defines.extend(split_define(define) for define in vlog_defines)
+        return defines
@@ -4,9 +4,11 @@ from __future__ import absolute_import
 import os
 import sys
 import logging
+import collections
 
 from hdlmake import fetch
 from hdlmake.util import path as path_mod
+from hdlmake.util import stat_cache
 
 
 class ModuleConfig(object):
@@ -69,7 +71,7 @@ class ModuleConfig(object):
         else:
             self.url, self.branch, self.revision = url, None, None
 
-            if not os.path.exists(url):
+            if not stat_cache.exists(url):
                 logging.error(
                     "Path to the local module doesn't exist:\n" + url
                     + "\nThis module was instantiated in: " + str(self.parent))
@@ -86,14 +88,14 @@ class ModuleConfig(object):
                     filepath + "\nOmitting.")
                 return False
             filepath = os.path.join(self.path, filepath)
-            if not os.path.exists(filepath):
+            if not stat_cache.exists(filepath):
                 logging.error(
                     "Path specified in manifest in %s doesn't exist: %s",
                     self.path, filepath)
                 sys.exit("Exiting")
 
             filepath = path_mod.rel2abs(filepath, self.path)
-            if os.path.isdir(filepath):
+            if stat_cache.isdir(filepath):
                 logging.warning(
                     "Path specified in manifest %s is a directory: %s",
                     self.path, filepath)
@@ -101,6 +103,14 @@ class ModuleConfig(object):
 
     def _make_list_of_paths(self, list_of_paths):
         """Get a list with only the valid absolute paths from the provided"""
+        # list at once the folders holding several of the paths, instead
+        # of querying the paths one at a time
+        folders = collections.Counter(
+            os.path.dirname(os.path.join(self.path, filepath))
+            for filepath in list_of_paths if filepath)
+        for folder, count in folders.items():
+            if count > 1 and stat_cache.isdir(folder):
+                stat_cache.scan_dir(folder)
         paths = []
         for filepath in list_of_paths:
             if self._check_filepath(filepath):
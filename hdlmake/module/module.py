@@ -34,6 +34,7 @@ import logging
 
 from hdlmake.util import path as path_mod
 from hdlmake.util import shell
+from hdlmake.util import stat_cache
 from hdlmake.manifest_parser import ManifestParser
 from .content import ModuleContent, ModuleArgs
 import six
@@ -110,12 +111,72 @@ class Module(ModuleContent):
                 if path_mod.is_abs_path(dir_):
                     logging.warning("%s contains absolute path to an include "
                                     "directory: %s", self.path, dir_)
-                if not os.path.exists(dir_):
+                if not stat_cache.exists(dir_):
                     logging.warning(self.path +
                                     " has an unexisting include directory: " +
                                     dir_)
         return include_dirs
 
+    def get_manifest_context(self):
+        """Get the variables the module Manifest.py is run with: those of
+        the top manifest, for any module but the top one"""
+        if self.parent is None:
+            extra_context = {}
+        else:
+            extra_context = dict(self.top_module.manifest_dict)
+        extra_context["__manifest"] = self.path
+        return extra_context
+
+    def _run_manifest(self):
+        """Run the module Manifest.py, with the prefix and sufix code and the
+        context inherited from the top module, and get the dictionary with
+        the variables it defines"""
+        manifest_parser = ManifestParser()
+
+        manifest_parser.add_prefix_code(
+            self.pool.options.prefix_code)
+        manifest_parser.add_sufix_code(
+            self.pool.options.sufix_code)
+
+        prefetched, evaluated = self.pool.get_prefetched_manifest(self.path)
+        manifest_parser.add_manifest(self.path, prefetched)
+
+        # The parse method is where the most of the parser action takes place!
+        opt_map = None
+        try:
+            opt_map = manifest_parser.parse(
+                extra_context=self.get_manifest_context(),
+                cache=self.pool.get_manifest_cache(),
+                evaluated=evaluated)
+        except NameError as name_error:
+            logging.error(
+                "Error while parsing {0}:\n{1}: {2}.".format(
+                    self.path, type(name_error), name_error))
+            quit()
+        return opt_map
+
+    def get_manifest_paths(self):
+        """Get the normalized paths, relative to the module folder, of the
+        files and folders the module Manifest.py refers to: files, local
+        modules, include dirs and makefiles. Paths outside the module folder
+        are left out"""
+        opt_map = self._run_manifest()
+        paths = list(path_mod.flatten_list(opt_map.get("files")))
+        paths += path_mod.flatten_list(
+            opt_map.get("modules", {}).get("local", []))
+        for key in ["include_dirs", "incl_makefiles"]:
+            if isinstance(opt_map.get(key), six.string_types):
+                paths.append(opt_map[key])
+            else:
+                paths += opt_map.get(key) or []
+        norm_paths = []
+        for path in paths:
+            path = os.path.normpath(path)
+            if path_mod.is_abs_path(path) or path.split(os.sep)[0] == "..":
+                continue
+            norm_paths.append(path)
+        return norm_paths
+
     def parse_manifest(self):
         """
         Create a dictionary from the module Manifest.py and assign it
@@ -144,34 +205,11 @@ class Module(ModuleContent):
 PARSE START: %s
 ***********************************************************""", self.path)
 
-        manifest_parser = ManifestParser()
-
-        manifest_parser.add_prefix_code(
-            self.pool.options.prefix_code)
-        manifest_parser.add_sufix_code(
-            self.pool.options.sufix_code)
-
-        manifest_parser.add_manifest(self.path)
-
-        if self.parent is None:
-            extra_context = {}
-        else:
-            extra_context = dict(self.top_module.manifest_dict)
-        extra_context["__manifest"] = self.path
-
-        # The parse method is where the most of the parser action takes place!
-        opt_map = None
-        try:
-            opt_map = manifest_parser.parse(extra_context=extra_context)
-        except NameError as name_error:
-            logging.error(
-                "Error while parsing {0}:\n{1}: {2}.".format(
-                    self.path, type(name_error), name_error))
-            quit()
-        self.manifest_dict = opt_map
+        self.manifest_dict = self._run_manifest()
 
         # Process the parsed manifest_dict to assign the module properties
         self.process_manifest()
+        self.pool.prefetch_manifests(self.submodules())
 
         # Parse every detected submodule
         for module_aux in self.submodules():
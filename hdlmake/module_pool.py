@@ -23,10 +23,10 @@
 
 """This is the Python module providing the container for the HDL Modules"""
 
-from .action import ActionCore, ActionTree
+from .action import ActionCore, ActionTree, ActionWatch
 
 
-class ModulePool(ActionCore, ActionTree):
+class ModulePool(ActionCore, ActionTree, ActionWatch):
 
     """
     The ModulePool class acts as the container for the HDLMake modules that
@@ -34,5 +34,5 @@ class ModulePool(ActionCore, ActionTree):
     """
 
     def __init__(self, *args):
-        ActionCore.__init__(self, *args)
-        ActionTree.__init__(self, *args)
+        # the Action classes initialize cooperatively, building the pool once
+        super(ModulePool, self).__init__(*args)
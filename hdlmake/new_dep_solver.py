@@ -27,7 +27,9 @@ from __future__ import print_function
 from __future__ import absolute_import
 import logging
 
-from .dep_file import DepFile
+import six
+
+from .dep_file import DepFile, compute_dep_levels
 
 
 class DepParser(object):
@@ -41,12 +43,180 @@ class DepParser(object):
         """Base dummy interface method for the HDL parse execution"""
         pass
 
+    def get_cache_context(self, dep_file):
+        """Get the list of settings, besides the file contents, that the
+        parse results depend on -- used to validate cached results"""
+        return [dep_file.library]
+
+
+def _build_provider_index(fileset):
+    """Build a dictionary mapping every (rel_type, obj_name) key provided
+    by the files in the fileset to the set of files providing it, so that
+    a USE relation can be solved with a single lookup"""
+    from .dep_file import DepRelation
+    provider_index = {}
+    for dep_file in fileset:
+        for rel in dep_file.rels:
+            if rel.direction == DepRelation.PROVIDE:
+                provider_index.setdefault(
+                    (rel.rel_type, rel.obj_name), set()).add(dep_file)
+    return provider_index
+
+
+def apply_parse_results(dep_file, rels, includes):
+    """Load into dep_file the results of parsing it somewhere else, as a
+    list of (obj_name, direction, rel_type) tuples plus the list of paths
+    of the files it includes"""
+    from .dep_file import DepRelation
+    from .srcfile import create_source_file
+    for obj_name, direction, rel_type in rels:
+        dep_file.add_relation(DepRelation(obj_name, direction, rel_type))
+    for inc_path in includes:
+        inc_file = create_source_file(path=inc_path, module=dep_file.module)
+        if inc_file is not None:
+            dep_file.depends_on.add(inc_file)
+    dep_file.is_parsed = True
+
+
+def _parse_worker(file_class, path, library, include_dirs, vlog_defines):
+    """Parse the HDL file at path in a worker process and return the
+    results in a serializable form: note that at parse time the only
+    dependencies of a file are its includes"""
+    dep_file = file_class(path=path, module=None, library=library)
+    if include_dirs is not None:
+        dep_file.include_dirs = include_dirs
+    if vlog_defines is not None:
+        dep_file.vlog_defines = vlog_defines
+    dep_file.parser.parse(dep_file)
+    rels = [(rel.obj_name, rel.direction, rel.rel_type)
+            for rel in dep_file.rels]
+    includes = sorted(inc.path for inc in dep_file.depends_on)
+    return rels, includes
+
+
+def _parse_files(dep_files, jobs=1):
+    """Parse the provided list of files, distributing them across a pool
+    of (jobs) worker processes if more than one job is requested"""
+    if jobs > 1 and len(dep_files) > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            logging.warning("concurrent.futures is not available, "
+                            "parsing the files in a single process")
+            jobs = 1
+    if jobs <= 1 or len(dep_files) <= 1:
+        for dep_file in dep_files:
+            dep_file.parser.parse(dep_file)
+        return
+    logging.debug("Parsing %d files using %d jobs", len(dep_files), jobs)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_parse_worker, type(dep_file),
+                                   dep_file.path, dep_file.library,
+                                   getattr(dep_file, "include_dirs", None),
+                                   getattr(dep_file, "vlog_defines", None))
+                   for dep_file in dep_files]
+        # Results are applied in submission order, so that the outcome
+        # doesn't depend on which worker finishes first
+        for dep_file, future in zip(dep_files, futures):
+            rels, includes = future.result()
+            apply_parse_results(dep_file, rels, includes)
+
+
+def _parse_fileset(files, parse_cache=None, jobs=1):
+    """Parse the provided files that are not parsed yet. If a parse_cache
+    is provided, the files that didn't change since the previous run will
+    take their relations from it instead of being parsed again. The
+    remaining files are parsed by (jobs) processes"""
+    from .vlog_parser import clear_include_cache
+    # the included files may have changed since the previous parse, and the
+    # worker processes inherit the cache when they're forked
+    clear_include_cache()
+    pending_files = []
+    contexts = {}
+    for investigated_file in files:
+        logging.debug("INVESTIGATED FILE: %s", investigated_file)
+        if not investigated_file.is_parsed:
+            if parse_cache is not None:
+                # the context must be taken before parsing the file
+                contexts[investigated_file] = \
+                    investigated_file.parser.get_cache_context(
+                        investigated_file)
+                if parse_cache.load(investigated_file,
+                                    contexts[investigated_file]):
+                    continue
+            logging.debug("Not parsed yet, let's go!")
+            pending_files.append(investigated_file)
+    _parse_files(pending_files, jobs)
+    if parse_cache is not None:
+        for investigated_file in pending_files:
+            parse_cache.store(investigated_file,
+                              contexts[investigated_file])
+        parse_cache.save()
+
+
+def _solve_file(investigated_file, provider_index, standard_libs=None):
+    """Add to the files the investigated file depends on those providing
+    the relations it uses, and get the number of relations that are not
+    satisfied by any file"""
+    from .dep_file import DepRelation
+    not_satisfied = 0
+    # logging.info("INVESTIGATED FILE: %s" % investigated_file)
+    # print(investigated_file.rels)
+    for rel in sorted(investigated_file.rels, key=DepRelation.sort_key):
+        # logging.info("- relation: %s" % rel)
+        # logging.info("- direction: %s" % rel.direction)
+        # Only analyze USE relations, we are looking for dependencies
+        if rel.direction == DepRelation.USE:
+            satisfied_by = provider_index.get(
+                (rel.rel_type, rel.obj_name), set())
+            for dep_file in satisfied_by:
+                if dep_file is not investigated_file:
+                    investigated_file.depends_on.add(dep_file)
+            if len(satisfied_by) > 1:
+                logging.warning(
+                    "Relation %s satisfied by multpiple (%d) files: %s",
+                    str(rel),
+                    len(satisfied_by),
+                    '\n'.join([file_aux.path for
+                               file_aux in list(satisfied_by)]))
+            elif len(satisfied_by) == 0:
+                # if relation is a USE PACKAGE, check against
+                # the standard libs provided by the tool HDL compiler
+                required_lib = rel.obj_name.split('.')[0]
+                if (not standard_libs is None and
+                    required_lib in standard_libs and
+                    rel.direction is DepRelation.USE and
+                        rel.rel_type is DepRelation.PACKAGE):
+                    logging.debug("Not satisfied relation %s in %s will "
+                                  "be covered by the target compiler "
+                                  "standard libs.",
+                                  str(rel), investigated_file.name)
+                else:
+                    logging.warning("Relation %s in %s not satisfied by "
+                                    "any source file",
+                                    str(rel), investigated_file.name)
+                    not_satisfied += 1
+    return not_satisfied
+
+
+def _report_not_satisfied(not_satisfied):
+    """Log the outcome of solving a fileset"""
+    if not_satisfied != 0:
+        logging.warning(
+            "Dependencies solved, but %d relations were not satisfied",
+            not_satisfied)
+    else:
+        logging.info(
+            "Dependencies solved, all of the relations were satisfied!")
+
 
-def solve(fileset, standard_libs=None):
+def solve(fileset, standard_libs=None, parse_cache=None, jobs=1):
     """Function that Parses and Solves the provided HDL fileset. Note
-       that it doesn't return a new fileset, but modifies the original one"""
+       that it doesn't return a new fileset, but modifies the original one.
+       If a parse_cache is provided, the files that didn't change since the
+       previous run will take their relations from it instead of being
+       parsed again. The remaining files are parsed by (jobs) processes"""
     from .srcfile import SourceFileSet
-    from .dep_file import DepRelation
     assert isinstance(fileset, SourceFileSet)
     fset = fileset.filter(DepFile)
     # print(fileset)
@@ -54,59 +224,135 @@ def solve(fileset, standard_libs=None):
     not_satisfied = 0
     logging.debug("PARSE BEGIN: Here, we will parse all the files in the "
                   "fileset: no parsing should be done beyond this point")
-    for investigated_file in fset:
-        logging.debug("INVESTIGATED FILE: %s", investigated_file)
-        if not investigated_file.is_parsed:
-            logging.debug("Not parsed yet, let's go!")
-            investigated_file.parser.parse(investigated_file)
+    _parse_fileset(fset, parse_cache, jobs)
     logging.debug("PARSE END: now the parsing is done")
     logging.debug("SOLVE BEGIN")
+    provider_index = _build_provider_index(fset)
     for investigated_file in fset:
-        # logging.info("INVESTIGATED FILE: %s" % investigated_file)
-        # print(investigated_file.rels)
-        for rel in investigated_file.rels:
-            # logging.info("- relation: %s" % rel)
-            # logging.info("- direction: %s" % rel.direction)
-            # Only analyze USE relations, we are looking for dependencies
-            if rel.direction == DepRelation.USE:
-                satisfied_by = set()
-                for dep_file in fset:
-                    if dep_file.satisfies(rel):
-                        if dep_file is not investigated_file:
-                            investigated_file.depends_on.add(dep_file)
-                        satisfied_by.add(dep_file)
-                if len(satisfied_by) > 1:
-                    logging.warning(
-                        "Relation %s satisfied by multpiple (%d) files: %s",
-                        str(rel),
-                        len(satisfied_by),
-                        '\n'.join([file_aux.path for
-                                   file_aux in list(satisfied_by)]))
-                elif len(satisfied_by) == 0:
-                    # if relation is a USE PACKAGE, check against
-                    # the standard libs provided by the tool HDL compiler
-                    required_lib = rel.obj_name.split('.')[0]
-                    if (not standard_libs is None and
-                        required_lib in standard_libs and
-                        rel.direction is DepRelation.USE and
-                            rel.rel_type is DepRelation.PACKAGE):
-                        logging.debug("Not satisfied relation %s in %s will "
-                                      "be covered by the target compiler "
-                                      "standard libs.",
-                                      str(rel), investigated_file.name)
-                    else:
-                        logging.warning("Relation %s in %s not satisfied by "
-                                        "any source file",
-                                        str(rel), investigated_file.name)
-                        not_satisfied += 1
+        not_satisfied += _solve_file(investigated_file, provider_index,
+                                     standard_libs)
     logging.debug("SOLVE END")
-    if not_satisfied != 0:
-        logging.warning(
-            "Dependencies solved, but %d relations were not satisfied",
-            not_satisfied)
-    else:
-        logging.info(
-            "Dependencies solved, all of the relations were satisfied!")
+    _report_not_satisfied(not_satisfied)
+
+
+def _get_keys(rels, direction):
+    """Get the set of (rel_type, obj_name) keys of the relations with the
+    given direction, provided as (obj_name, direction, rel_type) lists"""
+    return set((rel_type, obj_name) for obj_name, rel_direction, rel_type
+               in rels if rel_direction == direction)
+
+
+def solve_incremental(fileset, state, standard_libs=None, parse_cache=None,
+                      jobs=1):
+    """Function that solves the provided HDL fileset as solve does, but
+       starting from the graph solved by the previous run, as stored in the
+       provided GraphState. The files that didn't change take the files
+       they depend on from it without being parsed, and only those that
+       changed, along with the files using a design unit whose providers
+       changed, are parsed and solved again. The not satisfied relations
+       are only reported for the latter, although all of them are counted.
+       The state is updated and written to disk"""
+    from .srcfile import SourceFileSet, create_source_file
+    from .dep_file import DepRelation
+    assert isinstance(fileset, SourceFileSet)
+    fset = fileset.filter(DepFile)
+    files_by_path = dict((f.path, f) for f in fset)
+    standard_context = sorted(standard_libs or [])
+    contexts = {}
+    entries = {}
+    changed = []
+    for dep_file in fset:
+        contexts[dep_file] = [dep_file.parser.get_cache_context(dep_file),
+                              standard_context]
+        entry = state.load(dep_file, contexts[dep_file])
+        if entry is None:
+            changed.append(dep_file)
+        else:
+            entries[dep_file.path] = entry
+    # the design units whose set of providing files changed
+    dirty_keys = set()
+    for path in [path for path in state.entries if path not in files_by_path]:
+        dirty_keys.update(_get_keys(state.entries[path]["rels"],
+                                    DepRelation.PROVIDE))
+        state.discard(path)
+    old_keys = {}
+    for dep_file in changed:
+        if dep_file.is_parsed:
+            # parsed by a previous call, e.g. from the watch command
+            dep_file.reset()
+        old_entry = state.entries.get(dep_file.path)
+        if old_entry is not None:
+            old_keys[dep_file] = _get_keys(old_entry["rels"],
+                                           DepRelation.PROVIDE)
+    logging.debug("PARSE BEGIN: %d of %d files changed since the previous "
+                  "run", len(changed), len(fset))
+    _parse_fileset(changed, parse_cache, jobs)
+    logging.debug("PARSE END: now the parsing is done")
+    includes = {}
+    for dep_file in changed:
+        # at parse time the only dependencies of a file are its includes
+        includes[dep_file] = sorted(inc.path for inc in dep_file.depends_on)
+        new_keys = set((rel.rel_type, rel.obj_name) for rel in dep_file.rels
+                       if rel.direction == DepRelation.PROVIDE)
+        dirty_keys.update(new_keys.symmetric_difference(
+            old_keys.get(dep_file, set())))
+    unsolved = list(changed)
+    if dirty_keys:
+        for path, entry in six.iteritems(entries):
+            if _get_keys(entry["rels"], DepRelation.USE) & dirty_keys:
+                unsolved.append(files_by_path[path])
+    logging.debug("SOLVE BEGIN: %d files must be solved again",
+                  len(unsolved))
+    not_satisfied = 0
+    if unsolved:
+        provider_index = {}
+        for dep_file in fset:
+            entry = entries.get(dep_file.path)
+            if entry is None:
+                keys = [(rel.rel_type, rel.obj_name) for rel in dep_file.rels
+                        if rel.direction == DepRelation.PROVIDE]
+            else:
+                keys = _get_keys(entry["rels"], DepRelation.PROVIDE)
+            for key in keys:
+                provider_index.setdefault(key, set()).add(dep_file)
+        for dep_file in unsolved:
+            entry = entries.pop(dep_file.path, None)
+            if entry is not None:
+                # it may hold the dependencies found by a previous call
+                dep_file.reset()
+                includes[dep_file] = [inc_path for inc_path, _
+                                      in entry["includes"]]
+                apply_parse_results(dep_file, entry["rels"],
+                                    includes[dep_file])
+            unsatisfied = _solve_file(dep_file, provider_index,
+                                      standard_libs)
+            state.store(dep_file, contexts[dep_file], includes[dep_file],
+                        unsatisfied)
+            not_satisfied += unsatisfied
+    # the included files are not part of the fileset, a single object is
+    # enough for every file including them
+    included_files = {}
+    for path, entry in six.iteritems(entries):
+        dep_file = files_by_path[path]
+        for obj_name, direction, rel_type in entry["rels"]:
+            dep_file.add_relation(DepRelation(obj_name, direction, rel_type))
+        dep_file.is_parsed = True
+        inc_paths = set(inc_path for inc_path, _ in entry["includes"])
+        for dep_path in entry["deps"]:
+            if dep_path in inc_paths:
+                dep = included_files.get(dep_path)
+                if dep is None:
+                    dep = included_files[dep_path] = create_source_file(
+                        path=dep_path, module=dep_file.module)
+                if dep is None:
+                    continue
+            else:
+                dep = files_by_path[dep_path]
+            dep_file.depends_on.add(dep)
+        not_satisfied += entry["unsatisfied"]
+    logging.debug("SOLVE END")
+    state.save()
+    _report_not_satisfied(not_satisfied)
 
 
 def make_dependency_sorted_list(fileset, reverse=False):
@@ -115,38 +361,101 @@ def make_dependency_sorted_list(fileset, reverse=False):
     All files that another depends on will be earlier in the list."""
     dependable = [f for f in fileset if isinstance(f, DepFile)]
     non_dependable = [f for f in fileset if not isinstance(f, DepFile)]
-    dependable.sort(key=lambda f: f.file_path.lower())
-    # Not necessary, but will tend to group files more nicely
-    # in the output.
-    dependable.sort(key=DepFile.get_dep_level)
+    compute_dep_levels(dependable)
+    # Sorting by path within a level is not necessary, but will tend to
+    # group files more nicely in the output.
+    dependable.sort(key=lambda f: (f.dep_level, f.file_path.lower(),
+                                   f.file_path))
     sorted_list = non_dependable + dependable
     if reverse:
         sorted_list = list(reversed(sorted_list))
     return sorted_list
 
 
+class DepGraph(object):
+
+    """Dependency graph of a solved fileset: besides the files each file
+    depends on (its depends_on set), it keeps the reverse adjacency lists and
+    the index of the design units provided by the files, so that both the
+    files required by a top and the files affected by a change can be found
+    by walking only the reachable part of the graph"""
+
+    def __init__(self, fileset):
+        self.files = [f for f in fileset if isinstance(f, DepFile)]
+        self.provider_index = _build_provider_index(self.files)
+        # Files depending on each file, indexed by the file path
+        self.dependents = {}
+        for dep_file in self.files:
+            for dep in dep_file.depends_on:
+                self.dependents.setdefault(dep.path, []).append(dep_file)
+
+    def get_providers(self, rel):
+        """Get the files providing the provided relation, sorted by path"""
+        return sorted(self.provider_index.get((rel.rel_type, rel.obj_name),
+                                              set()),
+                      key=lambda f: f.path)
+
+    def get_top_file(self, top_level_entity):
+        """Get the file providing the named top level entity or module, or
+        None if there isn't any"""
+        from .dep_file import DepRelation
+        name = "%s.%s" % ("work", top_level_entity)
+        providers = (
+            self.get_providers(DepRelation(name, DepRelation.PROVIDE,
+                                           DepRelation.ENTITY)) +
+            self.get_providers(DepRelation(name, DepRelation.PROVIDE,
+                                           DepRelation.MODULE)))
+        if not providers:
+            return None
+        return providers[0]
+
+    @staticmethod
+    def get_dependencies(top_file):
+        """Get the set of files required to build the provided one, i.e.
+        the file itself along with every file it depends on"""
+        dep_file_set = set([top_file])
+        pending = [top_file]
+        while pending:
+            chk_file = pending.pop()
+            for dep in chk_file.depends_on:
+                if dep not in dep_file_set:
+                    dep_file_set.add(dep)
+                    pending.append(dep)
+        return dep_file_set
+
+    def get_affected(self, paths):
+        """Get the set of files affected by a change in the files at the
+        provided paths, i.e. the files themselves (if they're part of the
+        graph) along with every file depending on them"""
+        files_by_path = dict((f.path, f) for f in self.files)
+        affected = set()
+        visited = set(paths)
+        pending = list(paths)
+        while pending:
+            path = pending.pop()
+            if path in files_by_path:
+                affected.add(files_by_path[path])
+            for dep_file in self.dependents.get(path, []):
+                if dep_file.path not in visited:
+                    visited.add(dep_file.path)
+                    pending.append(dep_file.path)
+        return affected
+
+    def get_tops(self, files):
+        """Get the provided files no other file in the graph depends on,
+        e.g. the testbenches, sorted by path"""
+        return sorted([f for f in files if f.path not in self.dependents],
+                      key=lambda f: f.path)
+
+
 def make_dependency_set(fileset, top_level_entity):
     """Create the set of all files required to build the named
      top_level_entity."""
     from hdlmake.srcfile import SourceFileSet
-    from hdlmake.dep_file import DepRelation
     assert isinstance(fileset, SourceFileSet)
-    fset = fileset.filter(DepFile)
+    graph = DepGraph(fileset)
     # Find the file that provides the named top level entity
-    top_rel_vhdl = DepRelation(
-        "%s.%s" %
-        ("work", top_level_entity), DepRelation.PROVIDE, DepRelation.ENTITY)
-    top_rel_vlog = DepRelation(
-        "%s.%s" %
-        ("work", top_level_entity), DepRelation.PROVIDE, DepRelation.MODULE)
-    top_file = None
-    for chk_file in fset:
-        for rel in chk_file.rels:
-            if (rel == top_rel_vhdl) or (rel == top_rel_vlog):
-                top_file = chk_file
-                break
-        if top_file:
-            break
+    top_file = graph.get_top_file(top_level_entity)
     if top_file is None:
         logging.critical('Could not find a top level file that provides the '
                          'top_module="%s". Continuing with the full file set.',
@@ -154,16 +463,7 @@ def make_dependency_set(fileset, top_level_entity):
         return fileset
     # Collect only the files that the top level entity is dependant on, by
     # walking the dependancy tree.
-    try:
-        dep_file_set = set()
-        file_set = set([top_file])
-        while True:
-            chk_file = file_set.pop()
-            dep_file_set.add(chk_file)
-            file_set.update(chk_file.depends_on - dep_file_set)
-    except KeyError:
-        # no files left
-        pass
+    dep_file_set = graph.get_dependencies(top_file)
     logging.info("Found %d files as dependancies of %s.",
                  len(dep_file_set), top_level_entity)
     # for dep_file in dep_file_set:
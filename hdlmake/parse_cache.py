@@ -0,0 +1,381 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module providing the persistent on-disk caches for the HDL parse results,
+for the variables defined by the manifests and for the solved dependency
+graph of the incremental Makefile runs"""
+
+from __future__ import absolute_import
+import os
+import copy
+import json
+import shutil
+import marshal
+import hashlib
+import logging
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    from imp import get_magic
+    MAGIC_NUMBER = get_magic()
+
+from ._version import __version__
+from .util import stat_cache
+
+CACHE_DIR = ".hdlmake_cache"
+CACHE_FILE = "parse.json"
+MANIFEST_CACHE_FILE = "manifest.json"
+MANIFEST_CODE_DIR = "manifest_code"
+GRAPH_STATE_FILE = "graph.json"
+# Bump this if the format of the stored entries changes
+CACHE_FORMAT = 2
+
+
+def get_cache_dir(top_path):
+    """Get the cache directory associated to the top module at top_path"""
+    return os.path.join(top_path, CACHE_DIR)
+
+
+def _file_hash(path):
+    """Get the SHA1 hex digest for the contents of the file at path"""
+    with open(path, "rb") as file_aux:
+        return hashlib.sha1(file_aux.read()).hexdigest()
+
+
+def _file_stamp(path):
+    """Get a [mtime, size, hash] stamp for the file at path"""
+    stat = stat_cache.get_stat(path)
+    return [stat.st_mtime, stat.st_size, _file_hash(path)]
+
+
+class JsonCache(object):
+
+    """Base class for the caches stored as a JSON file in the cache
+    directory, that are discarded when written by a different hdlmake
+    version. The file is only read when the entries are first needed"""
+
+    def __init__(self, cache_dir, cache_file):
+        self.cache_dir = cache_dir
+        self.cache_file = os.path.join(cache_dir, cache_file)
+        self._entries = None
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+    @property
+    def entries(self):
+        """Dictionary with the cache entries"""
+        if self._entries is None:
+            self._entries = {}
+            self._read()
+        return self._entries
+
+    @entries.setter
+    def entries(self, entries):
+        self._entries = entries
+
+    def _read(self):
+        """Load the cache entries from disk, discarding them if the cache
+        file is unreadable or was written by a different hdlmake version"""
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as file_aux:
+                content = json.load(file_aux)
+        except (IOError, ValueError):
+            logging.warning("Discarding unreadable cache: %s",
+                            self.cache_file)
+            return
+        if (content.get("format") != CACHE_FORMAT or
+                content.get("version") != __version__):
+            logging.debug("Discarding outdated cache: %s",
+                          self.cache_file)
+            self._dirty = True
+            return
+        self.entries = content.get("entries", {})
+
+    def save(self):
+        """Write the cache entries to disk if anything changed"""
+        logging.debug("%s: %d hits, %d misses", self.cache_file,
+                      self.hits, self.misses)
+        if not self._dirty:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, "w") as file_aux:
+                json.dump({"format": CACHE_FORMAT,
+                           "version": __version__,
+                           "entries": self.entries}, file_aux)
+            if os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+            os.rename(tmp_file, self.cache_file)
+        except (IOError, OSError) as error_io:
+            logging.warning("Unable to write the cache %s: %s",
+                            self.cache_file, error_io)
+        self._dirty = False
+
+    def _stamp_is_valid(self, path, stamp):
+        """Check if the file at path still matches the provided stamp.
+        A file whose mtime and size are unchanged is trusted without reading
+        it, otherwise the content hash decides (e.g. a file that was touched)"""
+        stat = stat_cache.get_stat(path)
+        if stat is None:
+            return False
+        if stat.st_mtime == stamp[0] and stat.st_size == stamp[1]:
+            return True
+        if stat.st_size != stamp[1] or _file_hash(path) != stamp[2]:
+            return False
+        stamp[0] = stat.st_mtime
+        self._dirty = True
+        return True
+
+    def _entry_is_valid(self, path, entry):
+        """Check if neither the file nor any of its includes have changed"""
+        return (self._stamp_is_valid(path, entry["stamp"]) and
+                all(self._stamp_is_valid(inc_path, inc_stamp)
+                    for inc_path, inc_stamp in entry["includes"]))
+
+    def clear(self):
+        """Drop every cache entry and remove the cache file from disk"""
+        self.entries = {}
+        self._dirty = False
+        if os.path.isfile(self.cache_file):
+            os.remove(self.cache_file)
+
+
+class ParseCache(JsonCache):
+
+    """Class providing the persistent cache for the DepRelation sets and
+    include lists obtained by the VHDL and Verilog parsers"""
+
+    def __init__(self, cache_dir):
+        super(ParseCache, self).__init__(cache_dir, CACHE_FILE)
+
+    def load(self, dep_file, context):
+        """Restore the parse results for dep_file from the cache, provided
+        that they were obtained with the same parser context. Returns
+        True if a valid entry was found, False if the file must be parsed"""
+        from .new_dep_solver import apply_parse_results
+        entry = self.entries.get(dep_file.path)
+        if (entry is None or
+                entry["context"] != context or
+                not self._entry_is_valid(dep_file.path, entry)):
+            self.misses += 1
+            return False
+        apply_parse_results(dep_file, entry["rels"],
+                            [inc_path for inc_path, _ in entry["includes"]])
+        self.hits += 1
+        logging.debug("Parse cache hit: %s", dep_file.path)
+        return True
+
+    def store(self, dep_file, context):
+        """Store the parse results of the freshly parsed dep_file. Note that
+        at parse time the only dependencies of a file are its includes"""
+        self.entries[dep_file.path] = {
+            "stamp": _file_stamp(dep_file.path),
+            "context": context,
+            "rels": [[rel.obj_name, rel.direction, rel.rel_type]
+                     for rel in dep_file.rels],
+            "includes": [[inc.path, _file_stamp(inc.path)]
+                         for inc in sorted(dep_file.depends_on,
+                                           key=lambda f: f.path)]}
+        self._dirty = True
+
+    def stats(self):
+        """Get a dictionary with statistics about the cache contents"""
+        stale = 0
+        for path, entry in self.entries.items():
+            if not self._entry_is_valid(path, entry):
+                stale += 1
+        if os.path.isfile(self.cache_file):
+            size = os.path.getsize(self.cache_file)
+        else:
+            size = 0
+        return {"location": self.cache_file,
+                "entries": len(self.entries),
+                "stale": stale,
+                "size": size}
+
+
+class GraphState(JsonCache):
+
+    """Class providing the persistent state of the incremental Makefile
+    runs: for every file of the design, its relations along with the files
+    it depended on once solved, so that only the files affected by a change
+    need to be solved again"""
+
+    def __init__(self, cache_dir):
+        super(GraphState, self).__init__(cache_dir, GRAPH_STATE_FILE)
+        # path -> stamp, as the same files are included by many others
+        self._stamps = {}
+
+    def _get_stamp(self, path):
+        """Get the stamp of the file at path, whose content is only hashed
+        again if its modification time or size changed"""
+        stamp = self._stamps.get(path)
+        stat = stat_cache.get_stat(path)
+        if (stamp is None or stat.st_mtime != stamp[0] or
+                stat.st_size != stamp[1]):
+            stamp = self._stamps[path] = _file_stamp(path)
+        return stamp
+
+    def load(self, dep_file, context):
+        """Get the entry for dep_file solved in the given context, or None
+        if the file or any of the files it includes changed since then"""
+        entry = self.entries.get(dep_file.path)
+        if (entry is None or
+                entry["context"] != context or
+                not self._entry_is_valid(dep_file.path, entry)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def store(self, dep_file, context, includes, unsatisfied):
+        """Store the solved dep_file, along with the list of paths of the
+        files it includes and the number of its relations that were not
+        satisfied by any file"""
+        self.entries[dep_file.path] = {
+            "stamp": self._get_stamp(dep_file.path),
+            "context": context,
+            "rels": [[rel.obj_name, rel.direction, rel.rel_type]
+                     for rel in dep_file.rels],
+            "includes": [[inc_path, self._get_stamp(inc_path)]
+                         for inc_path in includes],
+            "deps": sorted(dep.path for dep in dep_file.depends_on),
+            "unsatisfied": unsatisfied}
+        self._dirty = True
+
+    def discard(self, path):
+        """Forget the entry of the file at path, e.g. if it was removed
+        from the design"""
+        if self.entries.pop(path, None) is not None:
+            self._dirty = True
+
+
+class ManifestCache(JsonCache):
+
+    """Class providing the persistent cache for the variables defined by
+    the manifests, so that they don't need to be run again as long as
+    neither their code nor the context they inherit change"""
+
+    def __init__(self, cache_dir):
+        super(ManifestCache, self).__init__(cache_dir, MANIFEST_CACHE_FILE)
+        self.code_dir = os.path.join(cache_dir, MANIFEST_CODE_DIR)
+        self._codes = {}
+
+    @staticmethod
+    def get_key(content, extra_context):
+        """Get the key identifying a run of the manifest code in content
+        with the inherited extra_context. Values that can't be stored as
+        JSON take part through their representation, which for functions
+        and the like changes on every run, so they never match"""
+        context = json.dumps(extra_context, sort_keys=True, default=repr)
+        return hashlib.sha1(
+            (content + "\0" + context).encode("utf-8")).hexdigest()
+
+    def load(self, manifest, key):
+        """Get the variables defined by the manifest file when run with
+        the given key, or None if they must be obtained by running it"""
+        entry = self.entries.get(os.path.abspath(manifest))
+        if entry is None or entry["key"] != key or entry["options"] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logging.debug("Manifest cache hit: %s", manifest)
+        return copy.deepcopy(entry["options"])
+
+    def is_cached(self, manifest, key):
+        """Check if the variables defined by the manifest file when run
+        with the given key are in the cache, without loading them"""
+        entry = self.entries.get(os.path.abspath(manifest))
+        return (entry is not None and entry["key"] == key and
+                entry["options"] is not None)
+
+    def is_uncacheable(self, manifest, key):
+        """Check if the manifest file, when last run with the given key,
+        defined variables that couldn't be stored in the cache"""
+        entry = self.entries.get(os.path.abspath(manifest))
+        return (entry is not None and entry["key"] == key and
+                entry["options"] is None)
+
+    def store(self, manifest, key, options):
+        """Store the variables defined by the manifest file when run with
+        the given key. Manifests declaring themselves impure (__impure =
+        True) and those defining anything but plain data (e.g. imported
+        modules or functions) are not cached: only the key of the run is
+        kept, so that they aren't run by the worker processes again"""
+        path = os.path.abspath(manifest)
+        cacheable = not options.get("__impure", False)
+        if cacheable:
+            try:
+                stored = json.loads(json.dumps(options))
+                cacheable = stored == options
+            except (TypeError, ValueError):
+                cacheable = False
+        if not cacheable:
+            logging.debug("Manifest not cacheable: %s", manifest)
+            stored = None
+        if self.entries.get(path) != {"key": key, "options": stored}:
+            self.entries[path] = {"key": key, "options": stored}
+            self._dirty = True
+
+    def get_code(self, source, filename, flags=0):
+        """Get the code object for the source read from filename, compiled
+        with the given flags. It's loaded from the code cache if it was
+        already compiled by this Python version, as the .pyc files are"""
+        # the prefix and sufix code is the same for every manifest
+        code = self._codes.get((source, filename, flags))
+        if code is not None:
+            return code
+        digest = hashlib.sha1(("%s\0%d\0%s" % (filename, flags, source))
+                              .encode("utf-8")).hexdigest()
+        code_file = os.path.join(self.code_dir, digest + ".pyc")
+        try:
+            with open(code_file, "rb") as file_aux:
+                data = file_aux.read()
+            if data[:len(MAGIC_NUMBER)] == MAGIC_NUMBER:
+                code = marshal.loads(data[len(MAGIC_NUMBER):])
+                self._codes[(source, filename, flags)] = code
+                return code
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            pass
+        code = compile(source, filename, "exec", flags, True)
+        self._codes[(source, filename, flags)] = code
+        try:
+            if not os.path.isdir(self.code_dir):
+                os.makedirs(self.code_dir)
+            tmp_file = "%s.%d.tmp" % (code_file, os.getpid())
+            with open(tmp_file, "wb") as file_aux:
+                file_aux.write(MAGIC_NUMBER + marshal.dumps(code))
+            if os.path.exists(code_file):
+                os.remove(code_file)
+            os.rename(tmp_file, code_file)
+        except (IOError, OSError) as error_io:
+            logging.debug("Unable to write the manifest code cache %s: %s",
+                          code_file, error_io)
+        return code
+
+    def clear(self):
+        """Drop every cache entry and remove the cache file and the cached
+        code objects from disk"""
+        super(ManifestCache, self).clear()
+        if os.path.isdir(self.code_dir):
+            shutil.rmtree(self.code_dir)
@@ -27,6 +27,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 import os
 import logging
+import collections
 
 from .util import path as path_mod
 from .dep_file import DepFile, File
@@ -38,6 +39,8 @@ class SourceFile(DepFile):
     """This is a class acting as a base for the different
     HDL sources files, i.e. those that can be parsed"""
 
+    __slots__ = ("library", "_hash", "parser")
+
     cur_index = 0
 
     def __init__(self, path, module, library):
@@ -48,9 +51,21 @@ class SourceFile(DepFile):
         DepFile.__init__(self,
                          file_path=path,
                          module=module)
+        self._hash = hash(self.path + self.library)
 
     def __hash__(self):
-        return hash(self.path + self.library)
+        return self._hash
+
+    def _new_parser(self):
+        """Create the parser of the file"""
+        raise NotImplementedError()
+
+    def reset(self):
+        """Forget the relations and dependencies found by parsing and
+        solving the file, along with the state of its parser (e.g. the
+        macros defined by the previous parse of a Verilog file)"""
+        DepFile.reset(self)
+        self.parser = self._new_parser()
 
 
 # SOURCE FILES
@@ -59,10 +74,16 @@ class VHDLFile(SourceFile):
 
     """This is the class providing the generic VHDL file"""
 
+    __slots__ = ()
+
     def __init__(self, path, module, library=None):
         SourceFile.__init__(self, path=path, module=module, library=library)
+        self.parser = self._new_parser()
+
+    def _new_parser(self):
+        """Create the parser of the VHDL file"""
         from hdlmake.vhdl_parser import VHDLParser
-        self.parser = VHDLParser(self)
+        return VHDLParser(self)
 
     def _check_encryption(self):
         """Check if the VHDL is encrypted (in Xilinx toolchain)"""
@@ -79,112 +100,124 @@ class VerilogFile(SourceFile):
 
     """This is the class providing the generic Verilog file"""
 
+    __slots__ = ("include_dirs", "vlog_defines")
+
     def __init__(self, path, module, library=None,
-                 include_dirs=None):
+                 include_dirs=None, vlog_defines=None):
         SourceFile.__init__(self, path=path, module=module, library=library)
-        from hdlmake.vlog_parser import VerilogParser
         self.include_dirs = []
         if include_dirs:
             self.include_dirs.extend(include_dirs)
         self.include_dirs.append(path_mod.relpath(self.dirname))
-        self.parser = VerilogParser(self)
+        # (name, expansion) macros defined before preprocessing the file
+        self.vlog_defines = []
+        if vlog_defines:
+            self.vlog_defines.extend(vlog_defines)
+        self.parser = self._new_parser()
+
+    def _new_parser(self):
+        """Create the parser of the Verilog file, whose preprocessor
+        doesn't know any macro yet"""
+        from hdlmake.vlog_parser import VerilogParser
+        parser = VerilogParser(self)
         for dir_aux in self.include_paths:
-            self.parser.add_search_path(dir_aux)
+            parser.add_search_path(dir_aux)
+        return parser
 
 
 class SVFile(VerilogFile):
     """This is the class providing the generic SystemVerilog file"""
-    pass
+    __slots__ = ()
 
 
 # TCL COMMAND FILE
 
 class TCLFile(File):
     """This is the class providing the Tool Command Language file"""
-    pass
+    __slots__ = ()
 
 
 # XILINX FILES
 
 class UCFFile(File):
     """This is the class providing the User Constraint Guide file"""
-    pass
+    __slots__ = ()
 
 
 class XISEFile(File):
     """This is the class providing the new Xilinx ISE project file"""
-    pass
+    __slots__ = ()
 
 
 class CDCFile(File):
     """This is the class providing the Xilinx ChipScope Definition
     and Connection file"""
-    pass
+    __slots__ = ()
 
 
 class XMPFile(File):
     """Xilinx Embedded Micro Processor"""
-    pass
+    __slots__ = ()
 
 
 class PPRFile(File):
     """Xilinx PlanAhead Project"""
-    pass
+    __slots__ = ()
 
 
 class XPRFile(File):
     """Xilinx Vivado Project"""
-    pass
+    __slots__ = ()
 
 
 class BDFile(File):
     """Xilinx Block Design"""
-    pass
+    __slots__ = ()
 
 
 class XCOFile(File):
     """Xilinx Core Generator File"""
-    pass
+    __slots__ = ()
 
 
 class NGCFile(File):
     """Xilinx Generated Netlist File"""
-    pass
+    __slots__ = ()
 
 
 class XDCFile(File):
     """Xilinx Design Constraint File"""
-    pass
+    __slots__ = ()
 
 
 class COEFile(File):
     """Xilinx Coefficient File"""
-    pass
+    __slots__ = ()
 
 
 class MIFFile(File):
     """Xilinx Memory Initialization File"""
-    pass
+    __slots__ = ()
 
 
 class RAMFile(File):
     """Xilinx RAM  File"""
-    pass
+    __slots__ = ()
 
 
 class VHOFile(File):
     """Xilinx VHDL Template File"""
-    pass
+    __slots__ = ()
 
 
 class VEOFile(File):
     """Xilinx Verilog Template File"""
-    pass
+    __slots__ = ()
 
 
 class XCIFile(File):
     """Xilinx Core IP File"""
-    pass
+    __slots__ = ()
 
 
 XILINX_FILE_DICT = {
@@ -211,27 +244,27 @@ XILINX_FILE_DICT = {
 
 class SDCFile(File):
     """Synopsys Design Constraints"""
-    pass
+    __slots__ = ()
 
 
 # LATTICE FILES
 
 class LDFFile(File):
     """Lattice Diamond Project File"""
-    pass
+    __slots__ = ()
 
 
 class LPFFile(File):
     """Lattice Preference/Constraint File"""
-    pass
+    __slots__ = ()
 
 class PCFFile(File):
     """Icestorm Physical constraints File"""
-    pass
+    __slots__ = ()
 
 class EDFFile(File):
     """EDIF Netlist Files"""
-    pass
+    __slots__ = ()
 
 
 LATTICE_FILE_DICT = {
@@ -248,7 +281,7 @@ LATTICE_FILE_DICT = {
 
 class PDCFile(File):
     """Physical Design Constraints"""
-    pass
+    __slots__ = ()
 
 
 MICROSEMI_FILE_DICT = {
@@ -259,54 +292,54 @@ MICROSEMI_FILE_DICT = {
 
 class WBGenFile(File):
     """Wishbone generator file"""
-    pass
+    __slots__ = ()
 
 
 # INTEL/ALTERA FILES
 
 class QIPFile(File):
     """This is the class providing the Altera Quartus IP file"""
-    pass
+    __slots__ = ()
 
 
 class QSYSFile(File):
     """Qsys - Altera's System Integration Tool"""
-    pass
+    __slots__ = ()
 
 
 class DPFFile(File):
     """This is the class providing Altera Quartus Design Protocol File"""
-    pass
+    __slots__ = ()
 
 
 class QSFFile(File):
     """Quartus Settings File"""
-    pass
+    __slots__ = ()
 
 
 class BSFFile(File):
     """Quartus Block Symbol File"""
-    pass
+    __slots__ = ()
 
 
 class BDFFile(File):
     """Quartus Block Design File"""
-    pass
+    __slots__ = ()
 
 
 class TDFFile(File):
     """Quartus Text Design File"""
-    pass
+    __slots__ = ()
 
 
 class GDFFile(File):
     """Quartus Graphic Design File"""
-    pass
+    __slots__ = ()
 
 
 class SignalTapFile(File):
     """This is the class providing the Altera Signal Tap Language file"""
-    pass
+    __slots__ = ()
 
 
 ALTERA_FILE_DICT = {
@@ -321,19 +354,59 @@ ALTERA_FILE_DICT = {
     'gdf': GDFFile}
 
 
+def _get_type(file_aux):
+    """Key of the file type index of a SourceFileSet"""
+    return type(file_aux)
+
+
+def _get_library(file_aux):
+    """Key of the library index of a SourceFileSet"""
+    return getattr(file_aux, "library", None)
+
+
+def _get_sort_key(file_aux):
+    """Key of the iteration order of a SourceFileSet"""
+    return (file_aux.path, getattr(file_aux, "library", ""))
+
+
 class SourceFileSet(set):
 
     """Class providing a extension of the 'set' object that includes
     methods that allow for an easier management of a collection of HDL
-    source files"""
+    source files. The files are indexed by their class and library, so
+    that the filters don't need to check every file: the
+    indexes are built when first needed and then kept up to date by add,
+    while any other change of the set drops them. The files are iterated
+    in the order of their paths, so that the generated Makefiles don't
+    change from one run to the next"""
 
     def __init__(self):
         super(SourceFileSet, self).__init__()
-        self = []
+        # key function -> {key: SourceFileSet}
+        self._indexes = {}
+        # files sorted by path, None if they must be sorted again
+        self._sorted = None
+
+    def __iter__(self):
+        if self._sorted is None:
+            self._sorted = sorted(set.__iter__(self), key=_get_sort_key)
+        return iter(self._sorted)
 
     def __str__(self):
         return str([str(f) for f in self])
 
+    def _add_file(self, file_aux):
+        """Add a single file to the set and to its indexes"""
+        if file_aux in self:
+            return
+        super(SourceFileSet, self).add(file_aux)
+        self._sorted = None
+        for key, index in six.iteritems(self._indexes):
+            bucket = index.get(key(file_aux))
+            if bucket is None:
+                bucket = index[key(file_aux)] = SourceFileSet()
+            bucket._add_file(file_aux)
+
     def add(self, files):
         """Add a set of files to the source fileset instance"""
         if isinstance(files, str):
@@ -343,17 +416,98 @@ class SourceFileSet(set):
         else:
             try:
                 for file_aux in files:
-                    super(SourceFileSet, self).add(file_aux)
+                    self._add_file(file_aux)
             except TypeError:  # single file, not a list
-                super(SourceFileSet, self).add(files)
+                self._add_file(files)
+
+    def _get_index(self, key):
+        """Get the {key: SourceFileSet} index of the files, building it if
+        it isn't up to date"""
+        index = self._indexes.get(key)
+        if index is None:
+            groups = {}
+            for file_aux in self:
+                groups.setdefault(key(file_aux), []).append(file_aux)
+            index = {}
+            for key_value, files in six.iteritems(groups):
+                index[key_value] = SourceFileSet()
+                set.update(index[key_value], files)
+            self._indexes[key] = index
+        return index
+
+    def _drop_indexes(self):
+        """Forget the indexes, after a change not made by add"""
+        self._indexes = {}
+        self._sorted = None
+
+    def remove(self, file_aux):
+        """Remove a file, that must be in the set"""
+        super(SourceFileSet, self).remove(file_aux)
+        self._drop_indexes()
+
+    def discard(self, file_aux):
+        """Remove a file if it is in the set"""
+        super(SourceFileSet, self).discard(file_aux)
+        self._drop_indexes()
+
+    def pop(self):
+        """Remove and return any file of the set"""
+        self._drop_indexes()
+        return super(SourceFileSet, self).pop()
+
+    def clear(self):
+        """Remove every file of the set"""
+        super(SourceFileSet, self).clear()
+        self._drop_indexes()
+
+    def update(self, *others):
+        """Add the files of every other set"""
+        for other in others:
+            self.add(other)
+
+    def __ior__(self, other):
+        """Add the files of the other set"""
+        self.add(other)
+        return self
+
+    def difference_update(self, *others):
+        """Remove the files of every other set"""
+        super(SourceFileSet, self).difference_update(*others)
+        self._drop_indexes()
+
+    def intersection_update(self, *others):
+        """Keep only the files in every other set"""
+        super(SourceFileSet, self).intersection_update(*others)
+        self._drop_indexes()
+
+    def symmetric_difference_update(self, other):
+        """Keep only the files in just one of the sets"""
+        super(SourceFileSet, self).symmetric_difference_update(other)
+        self._drop_indexes()
+
+    def __isub__(self, other):
+        """Remove the files of the other set"""
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        """Keep only the files in the other set"""
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        """Keep only the files in just one of the sets"""
+        self.symmetric_difference_update(other)
+        return self
 
     def filter(self, filetype):
         """Method that filters and returns all of the HDL source files
         contained in the instance SourceFileSet matching the provided type"""
         out = SourceFileSet()
-        for file_aux in self:
-            if isinstance(file_aux, filetype):
-                out.add(file_aux)
+        for file_class, bucket in six.iteritems(self._get_index(_get_type)):
+            if issubclass(file_class, filetype):
+                # out has no indexes yet, the plain set update is enough
+                set.update(out, bucket)
         return out
 
     def inversed_filter(self, filetype):
@@ -361,62 +515,130 @@ class SourceFileSet(set):
         contained in the instance SourceFileSet NOT matching the provided
         type"""
         out = SourceFileSet()
-        for file_aux in self:
-            if not isinstance(file_aux, filetype):
-                out.add(file_aux)
+        for file_class, bucket in six.iteritems(self._get_index(_get_type)):
+            if not issubclass(file_class, filetype):
+                set.update(out, bucket)
         return out
 
     def get_libs(self):
         """Method that returns a set containing all of the libraries that are
         provided by any of the source files in the SourceFileSet"""
-        ret = set()
-        for file_aux in self:
-            try:
-                ret.add(file_aux.library)
-            except TypeError:
-                pass
-        return ret
+        return set(library for library in self._get_index(_get_library)
+                   if library is not None)
+
+
+VHDL_EXTENSIONS = ['vhd', 'vhdl', 'vho']
+VERILOG_EXTENSIONS = ['v', 'vh', 'vo', 'vm']
+SV_EXTENSIONS = ['sv', 'svh']
+
+# Registry of the file types: extension -> class of the file objects
+# created by create_source_file. New extensions can be added with
+# register_file_type (or the file_types variable of the top manifest)
+FILE_TYPES = {}
+
+# Number of files found with an extension that isn't in FILE_TYPES, by
+# extension, that have not been reported yet
+UNKNOWN_EXTENSIONS = collections.Counter()
+
+
+def register_file_type(extensions, file_class):
+    """Make create_source_file create a file_class object for the files
+    with any of the extensions (a single one or a list of them)"""
+    for extension in path_mod.flatten_list(extensions):
+        FILE_TYPES[extension.lstrip('.')] = file_class
+
+
+def get_file_type(extension):
+    """Get the class registered for the extension, or None"""
+    return FILE_TYPES.get(extension.lstrip('.'))
+
+
+# Registered from the lowest to the highest precedence, as an extension
+# may be claimed by several classes (e.g. "vho" is a VHDL file)
+for _file_dict in [MICROSEMI_FILE_DICT, LATTICE_FILE_DICT, ALTERA_FILE_DICT,
+                   XILINX_FILE_DICT, {'sdc': SDCFile}, {'tcl': TCLFile},
+                   {'wb': WBGenFile}, dict.fromkeys(SV_EXTENSIONS, SVFile),
+                   dict.fromkeys(VERILOG_EXTENSIONS, VerilogFile),
+                   dict.fromkeys(VHDL_EXTENSIONS, VHDLFile)]:
+    FILE_TYPES.update(_file_dict)
+
+
+def get_extension(path):
+    """Get the extension create_source_file uses to choose the file type,
+    i.e. the text after the last dot of the file name"""
+    return os.path.splitext(os.path.basename(path))[1][1:]
+
+
+def is_source_file(path):
+    """Check if create_source_file would make a source file for path"""
+    return get_extension(path) in FILE_TYPES
+
+
+def report_unknown_extensions():
+    """Log a summary of the files ignored since the last report because
+    their extension is unknown"""
+    if UNKNOWN_EXTENSIONS:
+        logging.info(
+            "Ignored %d files with an unknown extension: %s",
+            sum(UNKNOWN_EXTENSIONS.values()),
+            ", ".join("%s (%d)" % (extension or "no extension", count)
+                      for extension, count in
+                      sorted(UNKNOWN_EXTENSIONS.items())))
+        UNKNOWN_EXTENSIONS.clear()
+
+
+def _new_source_file(file_class, path, module, library,
+                     include_dirs, vlog_defines):
+    """Create the file_class object for the file at the absolute path"""
+    logging.debug("add file " + path)
+    if issubclass(file_class, VerilogFile):
+        return file_class(path=path,
+                          module=module,
+                          library=library,
+                          include_dirs=include_dirs,
+                          vlog_defines=vlog_defines)
+    elif issubclass(file_class, SourceFile):
+        return file_class(path=path,
+                          module=module,
+                          library=library)
+    return file_class(path=path, module=module)
+
+
+def create_source_files(paths, module, library=None,
+                        include_dirs=None, vlog_defines=None):
+    """Function that returns the list of new HDL source files of the
+    appropriated type for the given paths. The files whose extension is
+    unknown are left out, and counted to be reported by
+    report_unknown_extensions"""
+    new_files = []
+    for path in paths:
+        if not os.path.isabs(path):
+            path = os.path.abspath(path)
+        extension = get_extension(path)
+        file_class = FILE_TYPES.get(extension)
+        if file_class is None:
+            logging.debug("Unknown extension, omitting file " + path)
+            UNKNOWN_EXTENSIONS[extension] += 1
+        else:
+            new_files.append(_new_source_file(file_class, path, module,
+                                              library, include_dirs,
+                                              vlog_defines))
+    return new_files
 
 
 def create_source_file(path, module, library=None,
-                       include_dirs=None):
+                       include_dirs=None, vlog_defines=None):
     """Function that analyzes the given arguments and returns a new HDL source
-    file of the appropriated type"""
+    file of the appropriated type, or None (with a warning) if the extension
+    is unknown"""
     if path is None or path == "":
         raise RuntimeError("Expected a file path, got: " + str(path))
     if not os.path.isabs(path):
         path = os.path.abspath(path)
-    tmp = path.rsplit('.')
-    extension = tmp[len(tmp) - 1]
-    logging.debug("add file " + path)
-
-    new_file = None
-    if extension in ['vhd', 'vhdl', 'vho']:
-        new_file = VHDLFile(path=path,
-                            module=module,
-                            library=library)
-    elif extension in ['v', 'vh', 'vo', 'vm']:
-        new_file = VerilogFile(path=path,
-                               module=module,
-                               library=library,
-                               include_dirs=include_dirs)
-    elif extension == 'sv' or extension == 'svh':
-        new_file = SVFile(path=path,
-                          module=module,
-                          library=library,
-                          include_dirs=include_dirs)
-    elif extension == 'wb':
-        new_file = WBGenFile(path=path, module=module)
-    elif extension == 'tcl':
-        new_file = TCLFile(path=path, module=module)
-    elif extension == 'sdc':
-        new_file = SDCFile(path=path, module=module)
-    elif extension in XILINX_FILE_DICT:
-        new_file = XILINX_FILE_DICT[extension](path=path, module=module)
-    elif extension in ALTERA_FILE_DICT:
-        new_file = ALTERA_FILE_DICT[extension](path=path, module=module)
-    elif extension in LATTICE_FILE_DICT:
-        new_file = LATTICE_FILE_DICT[extension](path=path, module=module)
-    elif extension in MICROSEMI_FILE_DICT:
-        new_file = MICROSEMI_FILE_DICT[extension](path=path, module=module)
-    return new_file
+    file_class = FILE_TYPES.get(get_extension(path))
+    if file_class is None:
+        logging.warning("Unknown extension, %s is not a source file and "
+                        "its changes are not tracked", path)
+        return None
+    return _new_source_file(file_class, path, module, library,
+                            include_dirs, vlog_defines)
@@ -130,7 +130,7 @@ XILINX_INI_PATH := """ + __get_xilinxsim_ini_dir() +
     def _makefile_sim_compilation(self):
         """Print the compile simulation target for Xilinx ISim"""
         fileset = self.fileset
-        libs = set(f.library for f in fileset)
+        libs = sorted(fileset.get_libs())
         self.write('LIBS := ')
         self.write(' '.join(libs))
         self.write('\n')
@@ -195,7 +195,8 @@ fuse:
                 ': ')
             self.write(vl_file.rel_path() + ' ')
             self.writeln(
-                ' '.join([fname.rel_path() for fname in vl_file.depends_on]))
+                ' '.join([fname.rel_path() for fname
+                          in self._sorted_files(vl_file.depends_on)]))
             self.write("\t\tvlogcomp -work " + vl_file.library
                        + "=." + shell.slash_char() + vl_file.library)
             self.write(" $(VLOGCOMP_FLAGS) ")
@@ -249,7 +250,7 @@ fuse:
             # recompile only what is needed (out of date)
             # if len(vhdl_file.depends_on) != 0:
             self.write(os.path.join(lib, purename, "." + purename) + ":")
-            for dep_file in vhdl_file.depends_on:
+            for dep_file in self._sorted_files(vhdl_file.depends_on):
                 if dep_file in fileset:
                     name = dep_file.purename
                     self.write(
@@ -99,14 +99,11 @@ class ToolLibero(ToolSyn):
         compilation_constraints = []
         ret = []
         # First stage: linking files
-        for file_aux in self.fileset:
-            if isinstance(file_aux, SDCFile):
-                synthesis_constraints.append(file_aux)
-                compilation_constraints.append(file_aux)
-            elif isinstance(file_aux, PDCFile):
-                compilation_constraints.append(file_aux)
-            else:
-                continue
+        for file_aux in self.fileset.filter(SDCFile):
+            synthesis_constraints.append(file_aux)
+            compilation_constraints.append(file_aux)
+        for file_aux in self.fileset.filter(PDCFile):
+            compilation_constraints.append(file_aux)
         # Second stage: Organizing / activating synthesis constraints (the top
         # module needs to be present!)
         if synthesis_constraints:
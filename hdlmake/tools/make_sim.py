@@ -8,7 +8,7 @@ import logging
 
 from .makefile import ToolMakefile
 from hdlmake.util import shell
-from hdlmake.srcfile import VerilogFile, VHDLFile, SVFile
+from hdlmake.srcfile import VerilogFile, VHDLFile, SVFile, SourceFileSet
 
 
 def _check_simulation_manifest(manifest_dict):
@@ -113,35 +113,37 @@ PWD := $$(shell pwd)
     def _makefile_sim_dep_files(self):
         """Print dummy targets to handle file dependencies"""
         fileset = self.fileset
-        for file_aux in fileset:
-            if any(isinstance(file_aux, file_type)
-                   for file_type in self._hdl_files):
-                self.write("%s: %s" % (os.path.join(
-                    file_aux.library, file_aux.purename,
-                    ".%s_%s" % (file_aux.purename, file_aux.extension())),
-                    file_aux.rel_path()))
-                # list dependencies, do not include the target file
-                for dep_file in [dfile for dfile in file_aux.depends_on
-                                 if dfile is not file_aux]:
-                    if dep_file in fileset:
-                        name = dep_file.purename
-                        extension = dep_file.extension()
-                        self.write(" \\\n" + os.path.join(
-                            dep_file.library, name, ".%s_%s" %
-                            (name, extension)))
-                    else:
-                        # the file is included -> we depend directly on it
-                        self.write(" \\\n" + dep_file.rel_path())
-                self.writeln()
-                if isinstance(file_aux, VHDLFile):
-                    command_key = 'vhdl'
-                elif (isinstance(file_aux, VerilogFile) or
-                      isinstance(file_aux, SVFile)):
-                    command_key = 'vlog'
-                self.writeln("\t\t" + self._simulator_controls[command_key])
-                self.write("\t\t@" + shell.mkdir_command() + " $(dir $@)")
-                self.writeln(" && " + shell.touch_command()  + " $@ \n")
-                self.writeln()
+        hdl_files = SourceFileSet()
+        for file_type in self._hdl_files:
+            hdl_files.add(fileset.filter(file_type))
+        for file_aux in hdl_files:
+            self.write("%s: %s" % (os.path.join(
+                file_aux.library, file_aux.purename,
+                ".%s_%s" % (file_aux.purename, file_aux.extension())),
+                file_aux.rel_path()))
+            # list dependencies, do not include the target file
+            for dep_file in [dfile for dfile
+                             in self._sorted_files(file_aux.depends_on)
+                             if dfile is not file_aux]:
+                if dep_file in fileset:
+                    name = dep_file.purename
+                    extension = dep_file.extension()
+                    self.write(" \\\n" + os.path.join(
+                        dep_file.library, name, ".%s_%s" %
+                        (name, extension)))
+                else:
+                    # the file is included -> we depend directly on it
+                    self.write(" \\\n" + dep_file.rel_path())
+            self.writeln()
+            if isinstance(file_aux, VHDLFile):
+                command_key = 'vhdl'
+            elif (isinstance(file_aux, VerilogFile) or
+                  isinstance(file_aux, SVFile)):
+                command_key = 'vlog'
+            self.writeln("\t\t" + self._simulator_controls[command_key])
+            self.write("\t\t@" + shell.mkdir_command() + " $(dir $@)")
+            self.writeln(" && " + shell.touch_command()  + " $@ \n")
+            self.writeln()
 
     def _makefile_sim_command(self):
         """Generic method to write the simulation Makefile user commands"""
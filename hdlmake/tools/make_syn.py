@@ -112,9 +112,8 @@ endif""")
         fileset_dict.update(self._supported_files)
         for filetype in fileset_dict:
             file_list = []
-            for file_aux in self.fileset:
-                if isinstance(file_aux, filetype):
-                    file_list.append(shell.tclpath(file_aux.rel_path()))
+            for file_aux in self.fileset.filter(filetype):
+                file_list.append(shell.tclpath(file_aux.rel_path()))
             if not file_list == []:
                 ret.append(
                    'SOURCES_{0} := \\\n'
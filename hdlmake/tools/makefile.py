@@ -29,6 +29,7 @@ import logging
 import six
 
 from hdlmake.util import shell
+from hdlmake.util import path as path_mod
 
 
 class ToolMakefile(object):
@@ -37,8 +38,10 @@ class ToolMakefile(object):
 
     def __init__(self):
         super(ToolMakefile, self).__init__()
-        self._file = None
+        # fragments of the Makefile, written to disk at once by close
+        self._chunks = []
         self._initialized = False
+        self._windows = shell.check_windows()
         self._tool_info = {}
         self._clean_targets = {}
         self._tcl_controls = {}
@@ -49,9 +52,29 @@ class ToolMakefile(object):
         self.manifest_dict = {}
         self._filename = "Makefile"
 
-    def __del__(self):
-        if self._file:
-            self._file.close()
+    def close(self):
+        """Write the Makefile to disk, returning False if there was nothing
+        to write or the file already had the very same content. The file
+        is replaced atomically, and is left untouched when it doesn't change
+        so that make doesn't see a new modification time"""
+        if not self._initialized:
+            return False
+        content = "".join(self._chunks)
+        self._chunks = []
+        self._initialized = False
+        if os.path.isdir(self._filename):
+            os.rmdir(self._filename)
+        if not path_mod.write_if_changed(self._filename, content):
+            logging.debug("%s is up to date", self._filename)
+            return False
+        return True
+
+    @staticmethod
+    def _sorted_files(files):
+        """Get the files of a plain set (e.g. the dependencies of a file)
+        sorted by path, so that the Makefile doesn't change from one run
+        to the next"""
+        return sorted(files, key=lambda file_aux: file_aux.path)
 
     def get_standard_libs(self):
         """Get the standard libs supported by the tool"""
@@ -158,32 +181,24 @@ class ToolMakefile(object):
         self.writeln(tmp)
 
     def initialize(self):
-        """Open the Makefile file and print a header if not initialized"""
+        """Start the Makefile with a header if not initialized"""
         if not self._initialized:
-            if os.path.exists(self._filename):
-                if os.path.isfile(self._filename):
-                    os.remove(self._filename)
-                elif os.path.isdir(self._filename):
-                    os.rmdir(self._filename)
-
-            self._file = open(self._filename, "a+")
+            self._chunks = []
             self._initialized = True
             self.writeln("########################################")
             self.writeln("#  This file was generated by hdlmake  #")
             self.writeln("#  http://ohwr.org/projects/hdl-make/  #")
             self.writeln("########################################")
             self.writeln()
-        elif not self._file:
-            self._file = open(self._filename, "a+")
 
     def write(self, line=None):
         """Write a string in the manifest, no new line"""
         if not self._initialized:
             self.initialize()
-        if shell.check_windows():
-            self._file.write(line.replace('\\"', '"'))
+        if self._windows:
+            self._chunks.append(line.replace('\\"', '"'))
         else:
-            self._file.write(line)
+            self._chunks.append(line)
 
     def writeln(self, text=None):
         """Write a string in the manifest, automatically add new line"""
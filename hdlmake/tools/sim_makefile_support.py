@@ -96,7 +96,7 @@ class VsimMakefileWriter(ToolSim):
         fileset = self.fileset
         # self.writeln("INCLUDE_DIRS := +incdir+%s" %
         #    ('+'.join(top_module.include_dirs)))
-        libs = set(f.library for f in fileset)
+        libs = sorted(fileset.get_libs())
         self.write('LIBS := ')
         self.write(' '.join(libs))
         self.write('\n')
@@ -133,7 +133,8 @@ class VsimMakefileWriter(ToolSim):
                 vlog.rel_path()))
             # list dependencies, do not include the target file
             for dep_file in [dfile for dfile
-                             in vlog.depends_on if dfile is not vlog]:
+                             in self._sorted_files(vlog.depends_on)
+                             if dfile is not vlog]:
                 if dep_file in fileset:
                     name = dep_file.purename
                     extension = dep_file.extension()
@@ -161,7 +162,8 @@ class VsimMakefileWriter(ToolSim):
                 lib, purename, "." + purename + "_" + vhdl.extension()),
                 vhdl.rel_path()))
             # list dependencies, do not include the target file
-            for dep_file in [dfile for dfile in vhdl.depends_on
+            for dep_file in [dfile for dfile
+                             in self._sorted_files(vhdl.depends_on)
                              if dfile is not vhdl]:
                 if dep_file in fileset:
                     name = dep_file.purename
@@ -25,6 +25,11 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import os
+import re
+from six.moves.urllib.parse import urlparse
+
+# scp-like syntax of the ssh URLs: [user@]host:path
+_SCP_URL_PATTERN = re.compile(r"^(?:[^@/]+@)?([^:/]+):(?!//)(.*)$")
 
 
 def url_parse(url):
@@ -43,6 +48,28 @@ def url_parse(url):
     return (url_clean, branch, rev)
 
 
+def normalize_url(url):
+    """
+    Get a normalized form of a repository url, so that the different
+    spellings of the same repository (scp-like or ssh:// syntax, scheme
+    and user, trailing slash or .git suffix, host name case) are equal
+    """
+    url = url.strip()
+    match = _SCP_URL_PATTERN.match(url)
+    # a single letter host is a Windows drive
+    if match and "://" not in url and len(match.group(1)) > 1:
+        host, path = match.group(1), match.group(2)
+    else:
+        parsed = urlparse(url)
+        host, path = parsed.hostname or "", parsed.path
+        if len(parsed.scheme) < 2:  # plain (or Windows) path
+            path = os.path.normpath(url)
+    path = path.strip("/")
+    if path.endswith(".git"):
+        path = path[:-4]
+    return host.lower() + "/" + path.rstrip("/")
+
+
 def url_basename(url):
     """
     Get basename from an url
@@ -151,3 +178,29 @@ def flatten_list(sth):
     else:
         sth = []
     return sth
+
+
+def _replace_file(src, dst):
+    """Rename the file src as dst, replacing it if it exists"""
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def write_if_changed(filename, content):
+    """Write the text content to filename unless the file already has the
+    very same content, returning False in that case. The file is replaced
+    atomically, and is left untouched when it doesn't change so that its
+    modification time is kept"""
+    if os.path.isfile(filename):
+        with open(filename, "r") as file_aux:
+            if file_aux.read() == content:
+                return False
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, "w") as file_aux:
+        file_aux.write(content)
+    _replace_file(tmp_filename, filename)
+    return True
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module provides the walker resolving the glob patterns of the
+manifests (e.g. "rtl/**/*.vhd") into the matching files of a module"""
+
+from __future__ import absolute_import
+import os
+import re
+import fnmatch
+
+from . import stat_cache
+
+# Pattern component matching any number of nested folders
+RECURSIVE = "**"
+
+_MAGIC_CHARS = re.compile(r"[*?[]")
+
+
+def is_pattern(path):
+    """Check if the path has glob wildcards, i.e. it's a pattern"""
+    return _MAGIC_CHARS.search(path) is not None
+
+
+def _split(path):
+    """Get the list of the components of the relative path"""
+    return [part for part in path.replace(os.sep, "/").split("/")
+            if part and part != "."]
+
+
+class _Component(object):
+
+    """A component of a pattern, matching a single file or folder name"""
+
+    def __init__(self, text):
+        self.text = text
+        self.is_literal = not is_pattern(text)
+        self._regex = re.compile(fnmatch.translate(os.path.normcase(text)))
+
+    def match(self, name):
+        """Check if the name matches the component. As in the shell, the
+        hidden names must be matched by a component starting with a dot"""
+        if name.startswith(".") and not self.text.startswith("."):
+            return False
+        return self._regex.match(os.path.normcase(name)) is not None
+
+
+def compile_pattern(pattern):
+    """Get the list of components of the pattern: RECURSIVE or a
+    _Component. A trailing "**" matches every file below the folder"""
+    components = []
+    for part in _split(pattern):
+        if part == RECURSIVE:
+            if components and components[-1] is RECURSIVE:
+                continue
+            components.append(RECURSIVE)
+        else:
+            components.append(_Component(part))
+    if components and components[-1] is RECURSIVE:
+        components.append(_Component("*"))
+    return components
+
+
+def _match_parts(parts, components):
+    """Check if the list of path components matches the pattern ones"""
+    if not components:
+        return not parts
+    head, rest = components[0], components[1:]
+    if head is RECURSIVE:
+        return any(_match_parts(parts[index:], rest)
+                   for index in range(len(parts) + 1))
+    return (bool(parts) and head.match(parts[0]) and
+            _match_parts(parts[1:], rest))
+
+
+class PatternWalker(object):
+
+    """Class resolving the patterns relative to the root folder of a
+    module. Every folder is listed at most once, only the folders that
+    can hold a match are entered and the excluded ones are pruned. The
+    number of listed entries is kept in the visited attribute"""
+
+    def __init__(self, root, excludes=None, accept=None):
+        self.root = root
+        self.visited = 0
+        self._scanned = set()
+        self._excludes = [compile_pattern(exclude)
+                          for exclude in excludes or []]
+        self._accept = accept
+
+    def is_excluded(self, path):
+        """Check if path, or any folder holding it below the root, matches
+        one of the exclude patterns"""
+        if not self._excludes:
+            return False
+        parts = _split(os.path.relpath(path, self.root))
+        return self._is_excluded_parts(parts, parents=True)
+
+    def _is_excluded_parts(self, parts, parents=False):
+        """Check if the relative path components match an exclude pattern,
+        also checking their parent folders if required"""
+        first = 1 if parents else len(parts)
+        return any(_match_parts(parts[:index], exclude)
+                   for exclude in self._excludes
+                   for index in range(first, len(parts) + 1))
+
+    def glob(self, pattern):
+        """Get the sorted list of the absolute paths of the accepted files
+        matching the pattern"""
+        found = set()
+        self._walk(self.root, [], compile_pattern(pattern), found, set())
+        return sorted(found)
+
+    def _scan(self, folder):
+        """List the folder, counting its entries as visited the first
+        time"""
+        entries = stat_cache.scan_dir(folder)
+        if folder not in self._scanned:
+            self._scanned.add(folder)
+            self.visited += len(entries)
+        return entries
+
+    def _walk(self, folder, parts, components, found, active):
+        """Add to found the files below folder matching the components,
+        being parts the relative path components of folder. The active set
+        holds the folders being walked by a RECURSIVE component, so that
+        symbolic links can't make the walker loop"""
+        head, rest = components[0], components[1:]
+        if head is RECURSIVE:
+            folder_stat = stat_cache.get_stat(folder)
+            folder_id = (folder_stat.st_dev, folder_stat.st_ino)
+            if folder_id in active:
+                return
+            active.add(folder_id)
+            self._walk(folder, parts, rest, found, active)
+            for name, kind in self._scan(folder):
+                if kind == stat_cache.DIR and not name.startswith("."):
+                    self._visit(folder, parts, name, kind, components,
+                                found, active)
+            active.discard(folder_id)
+        elif head.is_literal:
+            path = os.path.join(folder, head.text)
+            self.visited += 1
+            self._visit(folder, parts, head.text, stat_cache.get_kind(path),
+                        rest, found, active)
+        else:
+            for name, kind in self._scan(folder):
+                if head.match(name):
+                    self._visit(folder, parts, name, kind, rest,
+                                found, active)
+
+    def _visit(self, folder, parts, name, kind, components, found, active):
+        """Handle the entry name of folder, that matched the components
+        preceding the given ones"""
+        if kind == stat_cache.MISSING:
+            return
+        parts = parts + [name]
+        if self._is_excluded_parts(parts):
+            return
+        path = os.path.join(folder, name)
+        if components:
+            if kind == stat_cache.DIR:
+                self._walk(path, parts, components, found, active)
+        elif kind != stat_cache.DIR:
+            if self._accept is None or self._accept(path):
+                found.add(path)
@@ -28,18 +28,40 @@ import os
 import sys
 import platform
 import logging
-from subprocess import PIPE, Popen, CalledProcessError
+import threading
+from subprocess import PIPE, STDOUT, Popen, CalledProcessError
 
+# Output kept by the threads capturing it, see capture_output
+_CAPTURE = threading.local()
 
-def run(command):
-    """Execute a command in the shell and print the output lines as a list"""
+
+class _CaptureFilter(logging.Filter):
+
+    """Filter keeping the log records of the threads capturing their output
+    instead of letting them be emitted"""
+
+    def filter(self, record):
+        output = getattr(_CAPTURE, "output", None)
+        if output is None:
+            return True
+        output.append(record)
+        return False
+
+
+logging.getLogger().addFilter(_CaptureFilter())
+
+
+def run(command, cwd=None):
+    """Execute a command in the shell (from the cwd folder if provided) and
+    print the output lines as a list"""
     try:
         command_out = Popen(command,
             stdout=PIPE,
             stdin=PIPE,
             stderr=PIPE,
             close_fds=not check_windows(),
-            shell=True)
+            shell=True,
+            cwd=cwd)
         lines = command_out.stdout.readlines()
         if len(lines) == 0:
             return None
@@ -50,17 +72,55 @@ def run(command):
         quit()
 
 
+def system(command):
+    """Execute a command in the shell and return its exit status, like
+    os.system. If the calling thread is capturing its output, the output
+    of the command is kept along with it instead of being printed"""
+    output = getattr(_CAPTURE, "output", None)
+    if output is None:
+        return os.system(command)
+    process = Popen(command, stdout=PIPE, stderr=STDOUT, shell=True,
+                    close_fds=not check_windows(), universal_newlines=True)
+    output.append(process.communicate()[0])
+    return process.returncode
+
+
+def capture_output():
+    """Start keeping the output of the calling thread -- its log records
+    and the output of the commands it runs through system() -- so that it
+    can be printed at once, not mixed with the output of other threads"""
+    _CAPTURE.output = []
+
+
+def captured_output():
+    """Stop keeping the output of the calling thread and get it"""
+    output = _CAPTURE.output
+    _CAPTURE.output = None
+    return output
+
+
+def print_output(output):
+    """Print the output kept by capture_output, in the same order"""
+    for item in output:
+        if isinstance(item, logging.LogRecord):
+            logging.getLogger().handle(item)
+        else:
+            sys.stdout.write(item)
+    sys.stdout.flush()
+
+
 def tclpath(path):
     """Convert a O.S. specific path into a TCL friendly one"""
     return path.replace(slash_char(), "/")
 
 
+# The platform is checked once, as the Makefile writers ask it very often
+_IS_WINDOWS = platform.system() == 'Windows' or sys.platform == 'cygwin'
+
+
 def check_windows():
     """Check if we are operating on a Windows filesystem"""
-    if platform.system() == 'Windows' or sys.platform == 'cygwin':
-        return True
-    else:
-        return False
+    return _IS_WINDOWS
 
 
 def del_command():
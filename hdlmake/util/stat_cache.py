@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module provides a cache of the file system queries done while the
+design is being discovered, so that every path is only queried once per
+run. The directories are listed with os.scandir when available, which gets
+the type of their entries without a stat call per entry"""
+
+from __future__ import absolute_import
+import os
+import stat
+
+# Kind of the cached paths
+MISSING = 0
+FILE = 1
+DIR = 2
+OTHER = 3
+
+# Absolute path -> kind, for the paths already queried or listed
+_KINDS = {}
+# Absolute path -> os.stat result (None if missing), for the paths whose
+# full stat was already required
+_STATS = {}
+# Absolute path -> list of (name, kind) entries, for the listed directories
+_LISTINGS = {}
+
+
+def _mode_kind(mode):
+    """Get the kind matching the st_mode of a stat result"""
+    if stat.S_ISDIR(mode):
+        return DIR
+    if stat.S_ISREG(mode):
+        return FILE
+    return OTHER
+
+
+def get_stat(path):
+    """Cached version of os.stat, returning None if path doesn't exist"""
+    path = os.path.abspath(path)
+    try:
+        return _STATS[path]
+    except KeyError:
+        pass
+    try:
+        result = os.stat(path)
+    except OSError:
+        result = None
+    _STATS[path] = result
+    _KINDS[path] = MISSING if result is None else _mode_kind(result.st_mode)
+    return result
+
+
+def get_kind(path):
+    """Get the kind of the file system object at path: MISSING, FILE, DIR
+    or OTHER"""
+    path = os.path.abspath(path)
+    kind = _KINDS.get(path)
+    if kind is None:
+        get_stat(path)
+        kind = _KINDS[path]
+    return kind
+
+
+def exists(path):
+    """Cached version of os.path.exists"""
+    return get_kind(path) != MISSING
+
+
+def isdir(path):
+    """Cached version of os.path.isdir"""
+    return get_kind(path) == DIR
+
+
+def isfile(path):
+    """Cached version of os.path.isfile"""
+    return get_kind(path) == FILE
+
+
+def _scan(path):
+    """Get the (name, kind) entries of the directory at path"""
+    entries = []
+    if hasattr(os, "scandir"):
+        for entry in os.scandir(path):
+            try:
+                if entry.is_dir():
+                    kind = DIR
+                elif entry.is_file():
+                    kind = FILE
+                elif entry.is_symlink() and not os.path.exists(entry.path):
+                    kind = MISSING
+                else:
+                    kind = OTHER
+            except OSError:
+                kind = MISSING
+            entries.append((entry.name, kind))
+    else:
+        for name in os.listdir(path):
+            entries.append((name, get_kind(os.path.join(path, name))))
+    return entries
+
+
+def scan_dir(path):
+    """Get the list of (name, kind) entries of the directory at path, in
+    the os.listdir order. The kind of every entry is cached as well"""
+    path = os.path.abspath(path)
+    entries = _LISTINGS.get(path)
+    if entries is None:
+        entries = _scan(path)
+        for name, kind in entries:
+            _KINDS[os.path.join(path, name)] = kind
+        _KINDS[path] = DIR
+        _LISTINGS[path] = entries
+    return entries
+
+
+def listdir(path):
+    """Cached version of os.listdir"""
+    return [name for name, _ in scan_dir(path)]
+
+
+def clear():
+    """Forget every cached query, e.g. after the file system was changed"""
+    _KINDS.clear()
+    _STATS.clear()
+    _LISTINGS.clear()
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module provides the functions used to scan large text files while
+keeping only a window of them in memory"""
+
+from __future__ import absolute_import
+import os
+import logging
+
+from . import stat_cache
+
+# Files larger than this (in bytes) are scanned through a sliding window,
+# the value can be changed with the HDLMAKE_STREAM_THRESHOLD variable
+STREAM_THRESHOLD = 64 * 1024 * 1024
+# Amount of text read from the file at a time
+CHUNK_SIZE = 4 * 1024 * 1024
+# Amount of text that is kept after the position where a match may start,
+# i.e. the maximum length of a match within the window
+LOOKAHEAD = 1024 * 1024
+
+
+def get_stream_threshold():
+    """Get the file size above which the files are scanned in windows"""
+    threshold = os.environ.get("HDLMAKE_STREAM_THRESHOLD")
+    if threshold is None:
+        return STREAM_THRESHOLD
+    try:
+        return int(threshold)
+    except ValueError:
+        logging.warning("Ignoring invalid HDLMAKE_STREAM_THRESHOLD: %s",
+                        threshold)
+        return STREAM_THRESHOLD
+
+
+def use_stream(path):
+    """Check if the file at path must be scanned in windows instead of
+    being read in memory at once"""
+    return stat_cache.get_stat(path).st_size > get_stream_threshold()
+
+
+def read_chunks(path, chunk_size=None):
+    """Generator reading the text file at path in chunks of whole lines
+    (of CHUNK_SIZE if chunk_size isn't provided)"""
+    with open(path, "r") as text_file:
+        for chunk in read_file_chunks(text_file, chunk_size):
+            yield chunk
+
+
+def read_file_chunks(text_file, chunk_size=None):
+    """Generator reading the already open text_file from its current
+    position in chunks of whole lines (see read_chunks)"""
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    while True:
+        chunk = text_file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk + text_file.readline()
+
+
+def split_lines(pieces):
+    """Generator splitting the text provided in pieces into lines, as
+    str.splitlines() would do on the whole text"""
+    rest = ""
+    for piece in pieces:
+        lines = (rest + piece).splitlines(True)
+        rest = ""
+        if lines and lines[-1] == lines[-1].splitlines()[0]:
+            rest = lines.pop()
+        for line in lines:
+            yield line.splitlines()[0]
+    if rest:
+        yield rest
+
+
+def join_lines(lines, chunk_size=None):
+    """Generator grouping the provided lines into chunks of text"""
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line) + 1
+        if size >= chunk_size:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+            size = 0
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def scan_chunks(chunks, consumers, lookahead=None):
+    """Feed the text provided in chunks to the consumers through a sliding
+    window. A consumer is called as consumer(window, pos, limit): it must
+    process the matches starting in window[pos:limit] (up to the end of the
+    window if limit is None, for the last one) and return the position from
+    which it will resume scanning when more text is available. The
+    lookahead is LOOKAHEAD if it isn't provided"""
+    if lookahead is None:
+        lookahead = LOOKAHEAD
+    window = ""
+    positions = [0] * len(consumers)
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        window += chunk
+        chunk = next(chunks, None)
+        if chunk is None:
+            limit = None
+        else:
+            # a window shorter than the lookahead can't be processed yet
+            limit = max(0, len(window) - lookahead)
+        positions = [consumer(window, pos, limit)
+                     for consumer, pos in zip(consumers, positions)]
+        if limit is not None:
+            # keep whole lines, so that ^ still matches where it did
+            keep = window.rfind("\n", 0, min(positions)) + 1
+            window = window[keep:]
+            positions = [pos - keep for pos in positions]
+
+
+def search_consumer(pattern, callback):
+    """Get a scan_chunks consumer calling callback for every match of the
+    compiled pattern, as re.finditer() would do on the whole text"""
+    def _consumer(window, pos, limit):
+        """Process the matches starting in window[pos:limit]"""
+        while True:
+            match = pattern.search(window, pos)
+            if match is None:
+                if limit is None:
+                    return pos
+                return max(pos, limit)
+            if limit is not None and match.start() >= limit:
+                return match.start()
+            callback(match)
+            pos = max(match.end(), match.start() + 1)
+    return _consumer
+
+
+def sub_chunks(pattern, repl, chunks, lookahead=None):
+    """Generator applying pattern.sub(repl) to the text provided in chunks,
+    as it would be done on the whole text, and yielding the result in
+    pieces. The pattern must not match the empty string, and the
+    lookahead is LOOKAHEAD if it isn't provided"""
+    if lookahead is None:
+        lookahead = LOOKAHEAD
+    window = ""
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        window += chunk
+        chunk = next(chunks, None)
+        if chunk is None:
+            limit = len(window)
+        else:
+            limit = max(0, len(window) - lookahead)
+        pos = 0
+        pieces = []
+        while True:
+            match = pattern.search(window, pos)
+            if match is None or match.start() >= limit:
+                break
+            pieces.append(window[pos:match.start()])
+            pieces.append(repl(match))
+            pos = match.end()
+        if chunk is None:
+            pieces.append(window[pos:])
+        else:
+            # keep whole lines, so that ^ still matches where it did
+            keep = max(pos, window.rfind("\n", 0, limit) + 1)
+            pieces.append(window[pos:keep])
+            window = window[keep:]
+        yield "".join(pieces)
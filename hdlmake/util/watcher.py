@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module provides the watchers reporting the files changed below a
+set of folders: the Linux inotify interface is used when available, and
+the folders are polled otherwise. The hidden folders are not watched"""
+
+from __future__ import absolute_import
+import os
+import sys
+import errno
+import struct
+import logging
+
+# inotify constants, from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+               _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR)
+# struct inotify_event, followed by the (len bytes) name
+_EVENT = struct.Struct("iIII")
+
+
+def _get_roots(folders):
+    """Get the sorted absolute paths of the provided folders that are not
+    below another one of them"""
+    roots = []
+    for folder in sorted(set(os.path.abspath(path) for path in folders)):
+        if not any(folder.startswith(os.path.join(root, ""))
+                   for root in roots):
+            roots.append(folder)
+    return roots
+
+
+def _walk(folder):
+    """Get the list of folders below folder, including it, and the list of
+    files in all of them, skipping the hidden folders"""
+    folders = []
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        folders.append(root)
+        files.extend(os.path.join(root, name) for name in names)
+    return folders, files
+
+
+class PollingWatcher(object):
+
+    """Watcher finding the changed files by comparing the modification time
+    and size of every file below the watched folders with the ones they
+    had when they were previously polled, every interval seconds"""
+
+    def __init__(self, folders, interval=1.0):
+        self.interval = interval
+        self._roots = []
+        self._stamps = {}
+        self.add_folders(folders)
+
+    def fileno(self):
+        """There isn't any file descriptor to wait for"""
+        return None
+
+    def close(self):
+        """Stop watching the folders"""
+        self._roots = []
+        self._stamps = {}
+
+    def add_folders(self, folders):
+        """Start watching the provided folders, along with every folder
+        below them, if they weren't already"""
+        self._roots = _get_roots(self._roots + list(folders))
+        stamps = self._poll()
+        stamps.update(self._stamps)
+        self._stamps = stamps
+
+    def _poll(self):
+        """Get the (mtime, size) stamps of every file below the folders"""
+        stamps = {}
+        for root in self._roots:
+            for path in _walk(root)[1]:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                stamps[path] = (stat.st_mtime, stat.st_size)
+        return stamps
+
+    def read_changes(self):
+        """Get the set of paths of the files that were created, modified or
+        removed since the previous call"""
+        stamps = self._poll()
+        changed = set(path for path, stamp in stamps.items()
+                      if self._stamps.get(path) != stamp)
+        changed.update(path for path in self._stamps if path not in stamps)
+        self._stamps = stamps
+        return changed
+
+
+class InotifyWatcher(object):
+
+    """Watcher getting the changed files from the Linux inotify interface,
+    as soon as they're changed. A file descriptor is provided, so that the
+    changes can be waited for along with other events"""
+
+    def __init__(self, folders):
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # watch descriptor -> folder, and folder -> watch descriptor
+        self._folders = {}
+        self._watches = {}
+        try:
+            self.add_folders(folders)
+        except OSError:
+            self.close()
+            raise
+
+    def fileno(self):
+        """Get the inotify file descriptor, readable when there are changes"""
+        return self._fd
+
+    def close(self):
+        """Stop watching the folders"""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def add_folders(self, folders):
+        """Start watching the provided folders, along with every folder
+        below them, if they weren't already. An OSError is raised if the
+        limit of watches is reached"""
+        for root in _get_roots(folders):
+            for folder in _walk(root)[0]:
+                self._add_watch(folder)
+
+    def _add_watch(self, folder):
+        """Watch the folder, whose events are reported by descriptor"""
+        if folder in self._watches:
+            return
+        watch = self._libc.inotify_add_watch(
+            self._fd, folder.encode(sys.getfilesystemencoding()),
+            _WATCH_MASK)
+        if watch < 0:
+            error = self._ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "the limit of inotify watches was "
+                              "reached while watching %s" % folder)
+            # e.g. the folder was removed in the meantime
+            logging.debug("Unable to watch %s: %s", folder,
+                          os.strerror(error))
+            return
+        self._folders[watch] = folder
+        self._watches[folder] = watch
+
+    def _remove_watches(self, path):
+        """Stop watching the folder at path and every folder below it"""
+        prefix = os.path.join(path, "")
+        for folder in [folder for folder in self._watches
+                       if folder == path or folder.startswith(prefix)]:
+            watch = self._watches.pop(folder)
+            del self._folders[watch]
+            self._libc.inotify_rm_watch(self._fd, watch)
+
+    def read_changes(self):
+        """Get the set of paths of the files (and folders) that were
+        created, modified or removed since the previous call. The new
+        folders are watched as well, and the files they already hold are
+        reported as changed"""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                watch, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                self._handle_event(watch, mask,
+                                   name.decode(sys.getfilesystemencoding()),
+                                   changed)
+        return changed
+
+    def _handle_event(self, watch, mask, name, changed):
+        """Add to changed the paths affected by an inotify event"""
+        if mask & _IN_Q_OVERFLOW:
+            # some events were lost, so every watched folder may have changed
+            logging.warning("Too many changes at once, some of them may "
+                            "have been missed")
+            changed.update(self._watches)
+            return
+        folder = self._folders.get(watch)
+        if folder is None:
+            return
+        if mask & _IN_IGNORED:
+            # the folder was removed
+            del self._folders[watch]
+            del self._watches[folder]
+            return
+        if not name:
+            return
+        path = os.path.join(folder, name)
+        if mask & _IN_ISDIR:
+            if name.startswith("."):
+                return
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                folders, files = _walk(path)
+                for sub_folder in folders:
+                    self._add_watch(sub_folder)
+                changed.update(files)
+            else:
+                if mask & _IN_MOVED_FROM:
+                    # the watches would keep reporting the former paths
+                    self._remove_watches(path)
+                changed.add(path)
+        else:
+            changed.add(path)
+
+
+def get_watcher(folders, polling=False, interval=1.0):
+    """Get a watcher for the provided folders: the inotify one unless
+    polling is requested or it's not available, the polling one otherwise"""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as error:
+            logging.info("inotify is not available (%s), the folders will "
+                         "be polled every %s seconds", error, interval)
+    return PollingWatcher(folders, interval)
@@ -24,10 +24,174 @@
 """Module providing the VHDL parser capabilities"""
 
 from __future__ import absolute_import
+import os
 import logging
 import re
 
 from .new_dep_solver import DepParser
+from .dep_file import DepRelation
+from .util import stream
+
+# Set HDLMAKE_VHDL_PARSER=regex to go back to the regular expression based
+# parser, e.g. to compare its results with the ones from the scanner
+VHDL_PARSER_VAR = "HDLMAKE_VHDL_PARSER"
+
+_FLAGS = re.DOTALL | re.MULTILINE | re.IGNORECASE
+
+# The VHDL constructs looked for by the parsers, in the order in which the
+# regular expression based parser applies them
+_COMMENT_AND_STRING_PATTERN = re.compile('--.*?$|".?"',
+                                         re.DOTALL | re.MULTILINE)
+_USE_PATTERN = re.compile(
+    r"^\s*use\s+(\w+)\s*\.\s*(\w+)", _FLAGS)
+_ENTITY_PATTERN = re.compile(
+    r"^\s*entity\s+(?P<name>\w+)\s+is\s+(?:port|generic|end)"
+    r".*?(?P=name)\s*;", _FLAGS)
+_ARCHITECTURE_PATTERN = re.compile(
+    r"^\s*architecture\s+(\w+)\s+of\s+(\w+)\s+is", _FLAGS)
+_PACKAGE_PATTERN = re.compile(
+    r"^\s*package\s+(\w+)\s+is", _FLAGS)
+_COMPONENT_PATTERN = re.compile(
+    r"^\s*component\s+(\w+).*?end\s+component.*?;", _FLAGS)
+_RECORD_PATTERN = re.compile(
+    r"^\s*type\s+(\w+)\s+is\s+record.*?end\s+record.*?;", _FLAGS)
+_FUNCTION_PATTERN = re.compile(
+    r"^\s*function\s+(\w+).*?return.*?(?:is|;)", _FLAGS)
+_INSTANCE_PATTERN = re.compile(
+    r"^\s*(\w+)\s*\:\s*(\w+)\s*(?:port\s+map.*?;"
+    r"|generic\s+map.*?;|\s*;)", _FLAGS)
+_INSTANCE_FROM_LIBRARY_PATTERN = re.compile(
+    r"^\s*(\w+)\s*\:\s*entity\s*(\w+)\s*\.\s*(\w+)\s*(?:port"
+    r"\s+map.*?;|generic\s+map.*?;|\s*;)", _FLAGS)
+_LIBRARY_PATTERN = re.compile(
+    r"^\s*library\s*(\w+)\s*;", _FLAGS)
+
+# Beginning of a line where one of the above constructs may start
+_CONSTRUCT_START_PATTERN = re.compile(
+    r"^\s*(?:(use|entity|architecture|package|component|type|function)\b"
+    r"|\w+\s*:)", _FLAGS)
+
+
+def _use_regex_parser():
+    """Check if the regular expression based VHDL parser was requested"""
+    return os.environ.get(VHDL_PARSER_VAR, "").lower() == "regex"
+
+
+class _VHDLScanner(object):
+
+    """Class providing a single pass scanner for the VHDL code. Instead of
+    applying every pattern to the whole code in turn, the scanner moves
+    forward through the code and, at the beginning of every line that may
+    start a construct, tries the patterns for that construct. A construct
+    spanning over several lines (e.g. a component declaration) is skipped
+    as a whole, but the constructs that the regular expression based parser
+    looks for before it are still looked for within it, so that both parsers
+    find the same relations"""
+
+    def __init__(self, library, add_relation):
+        self.library = library
+        self.add_relation = add_relation
+        instance_constructs = [
+            (8, _INSTANCE_PATTERN, self._do_instance),
+            (9, _INSTANCE_FROM_LIBRARY_PATTERN,
+             self._do_instance_from_library)]
+        self._constructs = {
+            "use": [(1, _USE_PATTERN, self._do_use)],
+            "entity": [(2, _ENTITY_PATTERN, self._do_entity)],
+            "architecture": [(3, _ARCHITECTURE_PATTERN,
+                              self._do_architecture)],
+            "package": [(4, _PACKAGE_PATTERN, self._do_package)],
+            "component": [(5, _COMPONENT_PATTERN, None)],
+            "type": [(6, _RECORD_PATTERN, None)],
+            "function": [(7, _FUNCTION_PATTERN, None)]}
+        for keyword in self._constructs:
+            self._constructs[keyword] = (self._constructs[keyword] +
+                                         instance_constructs)
+        self._constructs[None] = instance_constructs
+
+    def scan(self, buf, pos=0, endpos=None, max_rank=None, limit=None):
+        """Look for the constructs starting in buf[pos:endpos] and add the
+        relations found, considering only the constructs ranked below
+        max_rank. If limit is provided, the scan stops at the first construct
+        starting at or beyond it: the position to resume from is returned,
+        so that buf can be a window of the code (see scan_chunks)"""
+        if endpos is None:
+            endpos = len(buf)
+        while True:
+            start = _CONSTRUCT_START_PATTERN.search(buf, pos, endpos)
+            if start is None:
+                if limit is None:
+                    return pos
+                return max(pos, limit)
+            if limit is not None and start.start() >= limit:
+                return start.start()
+            keyword = start.group(1)
+            if keyword is not None:
+                keyword = keyword.lower()
+            pos = start.end()
+            for rank, pattern, handler in self._constructs[keyword]:
+                if max_rank is not None and rank >= max_rank:
+                    continue
+                match = pattern.match(buf, start.start())
+                if match is None:
+                    continue
+                if handler is not None:
+                    handler(match)
+                else:
+                    logging.debug("found declaration %s", match.group(1))
+                if rank > 1:
+                    self.scan(buf, match.end(1), match.end(), rank)
+                pos = match.end()
+                break
+
+    def _get_library(self, library):
+        """Get the library name, solving the work alias"""
+        if library.lower() == "work":
+            return self.library
+        return library
+
+    def _do_use(self, match):
+        """Add the USE relation for a use clause"""
+        library = self._get_library(match.group(1))
+        logging.debug("use package %s.%s", library, match.group(2))
+        self.add_relation("%s.%s" % (library, match.group(2)),
+                          DepRelation.USE, DepRelation.PACKAGE)
+
+    def _do_entity(self, match):
+        """Add the PROVIDE relation for an entity declaration"""
+        logging.debug("found entity %s.%s", self.library, match.group(1))
+        self.add_relation("%s.%s" % (self.library, match.group(1)),
+                          DepRelation.PROVIDE, DepRelation.ENTITY)
+
+    def _do_architecture(self, match):
+        """Add the relations for an architecture body"""
+        logging.debug("found architecture %s of entity %s.%s",
+                      match.group(1), self.library, match.group(2))
+        self.add_relation("%s.%s" % (self.library, match.group(2)),
+                          DepRelation.PROVIDE, DepRelation.ARCHITECTURE)
+        self.add_relation("%s.%s" % (self.library, match.group(2)),
+                          DepRelation.USE, DepRelation.ENTITY)
+
+    def _do_package(self, match):
+        """Add the PROVIDE relation for a package declaration"""
+        logging.debug("found package %s.%s", self.library, match.group(1))
+        self.add_relation("%s.%s" % (self.library, match.group(1)),
+                          DepRelation.PROVIDE, DepRelation.PACKAGE)
+
+    def _do_instance(self, match):
+        """Add the USE relation for a component instance"""
+        logging.debug("-> instantiates %s.%s as %s",
+                      self.library, match.group(2), match.group(1))
+        self.add_relation("%s.%s" % (self.library, match.group(2)),
+                          DepRelation.USE, DepRelation.ARCHITECTURE)
+
+    def _do_instance_from_library(self, match):
+        """Add the USE relation for an entity instance"""
+        library = self._get_library(match.group(2))
+        logging.debug("-> instantiates %s.%s as %s",
+                      library, match.group(3), match.group(1))
+        self.add_relation("%s.%s" % (library, match.group(3)),
+                          DepRelation.USE, DepRelation.ARCHITECTURE)
 
 
 class VHDLParser(DepParser):
@@ -38,36 +202,65 @@ class VHDLParser(DepParser):
         DepParser.__init__(self, dep_file)
         # self.preprocessor = VHDLPreprocessor()
 
+    def get_cache_context(self, dep_file):
+        """Get the parser settings the results depend on: the library and
+        the parser implementation in use"""
+        return [dep_file.library, _use_regex_parser()]
+
     def parse(self, dep_file):
         """Parse the provided VHDL file and add the detected relations to it"""
-        from .dep_file import DepRelation
         if dep_file.is_parsed:
             return
         logging.debug("Parsing %s", dep_file.path)
+        if _use_regex_parser():
+            self._parse_regex(dep_file)
+        else:
+            self._parse_scanner(dep_file)
+        dep_file.is_parsed = True
 
-        def _preprocess(vhdl_file):
-            """Preprocess the supplied VHDL file instance"""
-            def _preprocess_file(file_content, file_name, library):
-                """Preprocess the suplied string using the arguments"""
-                def _remove_comments_and_strings(text):
-                    """Remove the comments and strings from the VHDL code"""
-                    pattern = re.compile('--.*?$|".?"',
-                                         re.DOTALL | re.MULTILINE)
-                    return re.sub(pattern, "", text)
-                logging.debug(
-                    "preprocess file %s (of length %d) in library %s",
-                    file_name, len(file_content), library)
-                return _remove_comments_and_strings(file_content)
-            file_path = vhdl_file.file_path
-            buf = open(file_path, "r").read()
-            return _preprocess_file(file_content=buf,
-                                    file_name=file_path,
-                                    library=vhdl_file.library)
-        buf = _preprocess(dep_file)
+    @staticmethod
+    def _read_code(dep_file):
+        """Read the VHDL code in the file, removing the comments and
+        strings from it"""
+        with open(dep_file.file_path, "r") as vhdl_file:
+            buf = vhdl_file.read()
+        logging.debug("preprocess file %s (of length %d) in library %s",
+                      dep_file.file_path, len(buf), dep_file.library)
+        return _COMMENT_AND_STRING_PATTERN.sub("", buf)
+
+    @staticmethod
+    def _read_code_chunks(dep_file):
+        """Generator reading the VHDL code in the file in chunks, removing
+        the comments and strings from it"""
+        logging.debug("preprocess file %s (of size %d) in library %s in "
+                      "chunks", dep_file.file_path,
+                      os.path.getsize(dep_file.file_path), dep_file.library)
+        return stream.sub_chunks(_COMMENT_AND_STRING_PATTERN,
+                                 lambda match: "",
+                                 stream.read_chunks(dep_file.file_path))
+
+    def _parse_scanner(self, dep_file):
+        """Parse the provided VHDL file in a single pass over the code. The
+        files above the stream threshold are scanned through a sliding window
+        instead of being read in memory at once"""
+        def _add_relation(obj_name, direction, rel_type):
+            """Add to the file the relation found by the scanner"""
+            dep_file.add_relation(DepRelation(obj_name, direction, rel_type))
+        scanner = _VHDLScanner(dep_file.library, _add_relation)
+        if stream.use_stream(dep_file.file_path):
+            stream.scan_chunks(
+                self._read_code_chunks(dep_file),
+                [lambda window, pos, limit:
+                 scanner.scan(window, pos, limit=limit)])
+        else:
+            scanner.scan(self._read_code(dep_file))
+
+    def _parse_regex(self, dep_file):
+        """Parse the provided VHDL file by applying in turn every regular
+        expression substitution to the whole code"""
+        buf = self._read_code(dep_file)
         # use packages
-        use_pattern = re.compile(
-            r"^\s*use\s+(\w+)\s*\.\s*(\w+)",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        use_pattern = _USE_PATTERN
 
         def do_use(text):
             """Function to be applied by re.sub to every match of the
@@ -92,10 +285,7 @@ class VHDLParser(DepParser):
                                                     text.group(2))
         buf = re.sub(use_pattern, do_use, buf)
         # new entity
-        entity_pattern = re.compile(
-            r"^\s*entity\s+(?P<name>\w+)\s+is\s+(?:port|generic|end)"
-            r".*?(?P=name)\s*;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        entity_pattern = _ENTITY_PATTERN
 
         def do_entity(text):
             """Function to be applied by re.sub to every match of the
@@ -112,9 +302,7 @@ class VHDLParser(DepParser):
                                                        text.group(1))
         buf = re.sub(entity_pattern, do_entity, buf)
         # new architecture
-        architecture_pattern = re.compile(
-            r"^\s*architecture\s+(\w+)\s+of\s+(\w+)\s+is",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        architecture_pattern = _ARCHITECTURE_PATTERN
 
         def do_architecture(text):
             """Function to be applied by re.sub to every match of the
@@ -135,9 +323,7 @@ class VHDLParser(DepParser):
                                                      text.group(2))
         buf = re.sub(architecture_pattern, do_architecture, buf)
         # new package
-        package_pattern = re.compile(
-            r"^\s*package\s+(\w+)\s+is",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        package_pattern = _PACKAGE_PATTERN
 
         def do_package(text):
             """Function to be applied by re.sub to every match of the
@@ -154,9 +340,7 @@ class VHDLParser(DepParser):
                                                 text.group(1))
         buf = re.sub(package_pattern, do_package, buf)
         # component declaration
-        component_pattern = re.compile(
-            r"^\s*component\s+(\w+).*?end\s+component.*?;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        component_pattern = _COMPONENT_PATTERN
 
         def do_component(text):
             """Function to be applied by re.sub to every match of the
@@ -167,9 +351,7 @@ class VHDLParser(DepParser):
             return "<hdlmake component %s>" % text.group(1)
         buf = re.sub(component_pattern, do_component, buf)
         # record declaration
-        record_pattern = re.compile(
-            r"^\s*type\s+(\w+)\s+is\s+record.*?end\s+record.*?;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        record_pattern = _RECORD_PATTERN
 
         def do_record(text):
             """Function to be applied by re.sub to every match of the
@@ -180,9 +362,7 @@ class VHDLParser(DepParser):
             return "<hdlmake record %s>" % text.group(1)
         buf = re.sub(record_pattern, do_record, buf)
         # function declaration
-        function_pattern = re.compile(
-            r"^\s*function\s+(\w+).*?return.*?(?:is|;)",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        function_pattern = _FUNCTION_PATTERN
 
         def do_function(text):
             """Function to be applied by re.sub to every match of the
@@ -194,10 +374,7 @@ class VHDLParser(DepParser):
         buf = re.sub(function_pattern, do_function, buf)
         # instantions
         libraries = set([dep_file.library])
-        instance_pattern = re.compile(
-            r"^\s*(\w+)\s*\:\s*(\w+)\s*(?:port\s+map.*?;"
-            r"|generic\s+map.*?;|\s*;)",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        instance_pattern = _INSTANCE_PATTERN
 
         def do_instance(text):
             """Function to be applied by re.sub to every match of the
@@ -213,10 +390,7 @@ class VHDLParser(DepParser):
             return "<hdlmake instance %s|%s>" % (text.group(1),
                                                  text.group(2))
         buf = re.sub(instance_pattern, do_instance, buf)
-        instance_from_library_pattern = re.compile(
-            r"^\s*(\w+)\s*\:\s*entity\s*(\w+)\s*\.\s*(\w+)\s*(?:port"
-            r"\s+map.*?;|generic\s+map.*?;|\s*;)",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        instance_from_library_pattern = _INSTANCE_FROM_LIBRARY_PATTERN
 
         def do_instance_from_library(text):
             """Function to be applied by re.sub to every match of the
@@ -242,9 +416,7 @@ class VHDLParser(DepParser):
         buf = re.sub(instance_from_library_pattern,
                      do_instance_from_library, buf)
         # libraries
-        library_pattern = re.compile(
-            r"^\s*library\s*(\w+)\s*;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+        library_pattern = _LIBRARY_PATTERN
 
         def do_library(text):
             """Function to be applied by re.sub to every match of the
@@ -256,4 +428,3 @@ class VHDLParser(DepParser):
             return "<hdlmake library %s>" % text.group(1)
         buf = re.sub(library_pattern, do_library, buf)
         # logging.debug("\n" + buf) # print modified buffer.
-        dep_file.is_parsed = True
@@ -31,12 +31,35 @@ import os
 import re
 import sys
 import logging
+import tempfile
+from collections import OrderedDict
 
 from .new_dep_solver import DepParser
 from .dep_file import DepRelation
 from hdlmake.srcfile import create_source_file
+from hdlmake.util import stat_cache
+from .util import stream
 import six
 
+# Regular expressions used to find the packages, modules and instances in the
+# preprocessed Verilog code
+_IMPORT_PATTERN = re.compile(r"(\w+) *::(\w+|\\*)")
+_PACKAGE_PATTERN = re.compile(
+    r"package\s+(\w+)\s*(?:\(.*?\))?\s*(.+?)endpackage",
+    re.DOTALL | re.MULTILINE)
+_MODULE_PATTERN = re.compile(
+    r"(?:module|interface)\s+(\w+)\s*(?:\(.*?\))?\s*(.+?)"
+    r"(?:endmodule|endinterface)",
+    re.DOTALL | re.MULTILINE)
+_INSTANCE_PATTERN = re.compile(
+    r"(?:\A|\s*)\s*(\w+)\s+(?:#\s*\(.*?\)\s*)?(\w+)\s*\(.*?\)\s*",
+    re.DOTALL | re.MULTILINE)
+# The parts of the module pattern, used when scanning in windows
+_MODULE_HEADER_PATTERN = re.compile(
+    r"(?:module|interface)\s+(\w+)\s*(?:\(.*?\))?\s*",
+    re.DOTALL | re.MULTILINE)
+_MODULE_END_PATTERN = re.compile(r"endmodule|endinterface")
+
 
 class VerilogPreprocessor(object):
 
@@ -54,6 +77,30 @@ class VerilogPreprocessor(object):
         "undef",
         "timescale"]
 
+    # Regular expressions used by the preprocessor, compiled only once
+    vpp_comment = re.compile(r'//.*?$|/\*.*?\*/|"(?:\\.|[^\\"])*"',
+                             re.DOTALL | re.MULTILINE)
+    vpp_empty_line = re.compile(r"^\s*$")
+    vpp_statements = {
+        "include": re.compile(r"^\s*`include\s+\"(.+)\""),
+        "define": re.compile(r"^\s*`define\s+(\w+)(?:\(([\w\s,]*)\))?(.*)"),
+        "ifdef_elsif": re.compile(r"^\s*`(ifdef|ifndef|elsif)\s+(\w+)\s*$"),
+        "endif_else": re.compile(r"^\s*`(endif|else)\s*$"),
+        "undef": re.compile(r"^\s*`undef\s+(\w+)\s*$"),
+        "begin_protected":
+        re.compile(r"^\s*`pragma\s*protect\s*begin_protected\s*$"),
+        "end_protected":
+        re.compile(r"^\s*`pragma\s*protect\s*end_protected\s*$")}
+    vpp_macro_expand = re.compile(r"`(\w+)(?:\(([\w\s,]*)\))?")
+
+    # Per-run cache of the preprocessed `include files, shared by every
+    # preprocessor instance. It maps the (path, library, include dirs and
+    # macros defined when the file is included) key to the preprocessed
+    # text along with the resulting macros and the file dependencies it adds.
+    # As the key doesn't tell if the file changed, it's cleared by
+    # clear_include_cache before every parse of a fileset
+    vpp_include_cache = {}
+
     class VLDefine(object):
 
         """Class that provides a container for Verilog Defines"""
@@ -93,17 +140,14 @@ class VerilogPreprocessor(object):
         self.vlog_file = None
         # List of `include search paths
         self.vpp_searchdir = ["."]
-        # List of macro definitions
-        self.vpp_macros = []
+        # Dictionary of macro definitions, indexed by name
+        self.vpp_macros = OrderedDict()
         # Dictionary of files sub-included by each file parsed
         self.vpp_filedeps = {}
 
     def _find_macro(self, name):
         """Get the Verilog preprocessor macro named 'name'"""
-        for macro_aux in self.vpp_macros:
-            if macro_aux.name == name:
-                return macro_aux
-        return None
+        return self.vpp_macros.get(name)
 
     def _search_include(self, filename, parent_dir=None):
         """Look for the 'filename' Verilog include file in the
@@ -112,11 +156,11 @@ class VerilogPreprocessor(object):
         preprocessor search directory"""
         if parent_dir is not None:
             possible_file = os.path.join(parent_dir, filename)
-            if os.path.isfile(possible_file):
+            if stat_cache.isfile(possible_file):
                 return os.path.abspath(possible_file)
         for searchdir in self.vlog_file.include_dirs:
             probable_file = os.path.join(searchdir, filename)
-            if os.path.isfile(probable_file):
+            if stat_cache.isfile(probable_file):
                 return os.path.abspath(probable_file)
         logging.error("Can't find %s for %s in any of the include "
                       "directories: %s", filename, self.vlog_file.file_path,
@@ -137,151 +181,215 @@ class VerilogPreprocessor(object):
             logging.error("Attempt to `define a reserved preprocessor keyword")
             quit()
         mdef = self.VLDefine(name, params, expansion)
-        self.vpp_macros.append(mdef)
+        self.vpp_macros[name] = mdef
         return mdef
 
+    @staticmethod
+    def _comment_replacer(match):
+        """Function to be applied by re.sub to every match of vpp_comment,
+        removing the comments and keeping the strings"""
+        text = match.group(0)
+        if text.startswith('/'):
+            return ""
+        else:
+            return text
+
+    @classmethod
+    def _degapize(cls, lines):
+        """Generator yielding the provided verilog lines in an ordered
+        way -- without empty 'gaps' and with the continued lines joined"""
+        cline = None
+        for line_aux in lines:
+            if re.match(cls.vpp_empty_line, line_aux) is not None:
+                continue
+            if line_aux.endswith('\\'):
+                if cline is None:
+                    cline = ""
+                cline += line_aux[:len(line_aux) - 1]
+                continue
+            elif cline:
+                line_aux = cline + line_aux
+                cline = None
+            else:
+                cline = None
+            yield line_aux
+
+    def _preprocess_line(self, line, file_name, library, protected_region):
+        """Preprocess a single line of the Verilog file. Return the resulting
+        text (None if the line is dropped), the updated protected region
+        state, and whether any macro or `include was expanded"""
+        exps = self.vpp_statements
+        vl_macro_expand = self.vpp_macro_expand
+        matches = {}
+        last = None
+        for statement, stmt_regex in six.iteritems(exps):
+            matches[statement] = re.match(stmt_regex, line)
+            if matches[statement]:
+                last = matches[statement]
+        if matches["begin_protected"]:
+            return None, True, False
+        if matches["end_protected"]:
+            return None, False, False
+        if protected_region:
+            return None, protected_region, False
+        if matches["ifdef_elsif"]:
+            cond_true = self._find_macro(last.group(2)) is not None
+            if last.group(1) == "ifndef":
+                cond_true = not cond_true
+            elif last.group(1) == "elsif":
+                self.vpp_stack.pop()
+            self.vpp_stack.push(cond_true)
+            return None, protected_region, False
+        elif matches["endif_else"]:
+            if last.group(1) == "endif":
+                self.vpp_stack.pop()
+            else:  # `else
+                self.vpp_stack.flip()
+            return None, protected_region, False
+        if not self.vpp_stack.all_true():
+            return None, protected_region, False
+        if matches["include"]:
+            included_file_path = self._search_include(
+                last.group(1), os.path.dirname(file_name))
+            logging.debug("File being parsed %s (library %s) "
+                          "includes %s",
+                          file_name, library, included_file_path)
+            line = self._preprocess_include(included_file_path,
+                                            library)
+            self.vpp_filedeps[
+                file_name +
+                library].append(
+                included_file_path)
+            # add the whole include chain to the dependencies of the
+            # currently parsed file
+            self.vpp_filedeps[file_name + library].extend(
+                self.vpp_filedeps[included_file_path + library])
+            return line, protected_region, True
+        elif matches["define"]:
+            self._parse_macro_def(matches["define"])
+        elif matches["undef"]:
+            self.undef(matches["undef"].group(1))
+
+        def do_expand(what):
+            """Function to be applied by re.sub to every match of the
+            vl_macro_expand in the Verilof code -- group() returns
+            positive matches as indexed plain strings."""
+            if what.group(1) in self.vpp_keywords:
+                return '`' + what.group(1)
+            macro = self._find_macro(what.group(1))
+            if macro:
+                return macro.expansion
+            else:
+                logging.error("No expansion for macro '`%s' (%s) (%s)",
+                              what.group(1), line[:50]
+                              if len(line) > 50 else line, file_name)
+        repl_line = re.sub(vl_macro_expand, do_expand, line)
+        # if there was any expansion, then keep on iterating
+        return repl_line, protected_region, repl_line != line
+
+    def _preprocess_pass(self, lines, file_name, library, state):
+        """Generator yielding the result of a preprocessing pass over the
+        provided lines. The state dictionary keeps the protected region state
+        from one pass to the next, and counts in "expansions" the lines in
+        which any macro or `include was expanded"""
+        for line in self._degapize(lines):
+            line, state["protected_region"], expanded = \
+                self._preprocess_line(line, file_name, library,
+                                      state["protected_region"])
+            if line is None:
+                continue
+            if expanded:
+                state["expansions"] += 1
+            yield line
+
     def _preprocess_file(self, file_content, file_name, library):
         """Preprocess the content of the Verilog file"""
-        def _remove_comment(text):
-            """Function that removes the comments from the Verilog code"""
-            def replacer(match):
-                """Funtion that replace the matching comments"""
-                text = match.group(0)
-                if text.startswith('/'):
-                    return ""
-                else:
-                    return text
-            pattern = re.compile(
-                r'//.*?$|/\*.*?\*/|"(?:\\.|[^\\"])*"',
-                re.DOTALL | re.MULTILINE)
-            return re.sub(pattern, replacer, text)
-
-        def _degapize(text):
-            """ Create a list in which the verilog sentences are
-            stored in an ordered way -- and without empty 'gaps'"""
-            lempty = re.compile(r"^\s*$")
-            cline = None
-            lines = []
-            for line_aux in text.splitlines(False):
-                if re.match(lempty, line_aux) is not None:
-                    continue
-                if line_aux.endswith('\\'):
-                    if cline is None:
-                        cline = ""
-                    cline += line_aux[:len(line_aux) - 1]
-                    continue
-                elif cline:
-                    line_aux = cline + line_aux
-                    cline = None
-                else:
-                    cline = None
-                lines.append(line_aux)
-            return lines
-        exps = {"include": re.compile(r"^\s*`include\s+\"(.+)\""),
-                "define":
-                re.compile(r"^\s*`define\s+(\w+)(?:\(([\w\s,]*)\))?(.*)"),
-                "ifdef_elsif":
-                re.compile(r"^\s*`(ifdef|ifndef|elsif)\s+(\w+)\s*$"),
-                "endif_else": re.compile(r"^\s*`(endif|else)\s*$"),
-                "begin_protected":
-                re.compile(r"^\s*`pragma\s*protect\s*begin_protected\s*$"),
-                "end_protected":
-                re.compile(r"^\s*`pragma\s*protect\s*end_protected\s*$")}
-        vl_macro_expand = re.compile(r"`(\w+)(?:\(([\w\s,]*)\))?")
         # init dependencies
         self.vpp_filedeps[file_name + library] = []
-        cur_iter = 0
         logging.debug("preprocess file %s (of length %d) in library %s",
                       file_name, len(file_content), library)
-        buf = _remove_comment(file_content)
-        protected_region = False
-        while True:
-            new_buf = ""
-            n_expansions = 0
-            cur_iter += 1
-            if cur_iter > 30:
-                raise Exception("Recursion level exceeded. Nested `includes?")
-            for line in _degapize(buf):
-                matches = {}
-                last = None
-                for statement, stmt_regex in six.iteritems(exps):
-                    matches[statement] = re.match(stmt_regex, line)
-                    if matches[statement]:
-                        last = matches[statement]
-                if matches["begin_protected"]:
-                    protected_region = True
-                    continue
-                if matches["end_protected"]:
-                    protected_region = False
-                    continue
-                if protected_region:
-                    continue
-                if matches["ifdef_elsif"]:
-                    cond_true = self._find_macro(last.group(2)) is not None
-                    if last.group(1) == "ifndef":
-                        cond_true = not cond_true
-                    elif last.group(1) == "elsif":
-                        self.vpp_stack.pop()
-                    self.vpp_stack.push(cond_true)
-                    continue
-                elif matches["endif_else"]:
-                    if last.group(1) == "endif":
-                        self.vpp_stack.pop()
-                    else:  # `else
-                        self.vpp_stack.flip()
-                    continue
-                if not self.vpp_stack.all_true():
-                    continue
-                if matches["include"]:
-                    included_file_path = self._search_include(
-                        last.group(1), os.path.dirname(file_name))
-                    logging.debug("File being parsed %s (library %s) "
-                                  "includes %s",
-                                  file_name, library, included_file_path)
-                    line = self._preprocess_file(
-                        file_content=open(included_file_path, "r").read(),
-                        file_name=included_file_path, library=library)
-                    self.vpp_filedeps[
-                        file_name +
-                        library].append(
-                        included_file_path)
-                    # add the whole include chain to the dependencies of the
-                    # currently parsed file
-                    self.vpp_filedeps[file_name + library].extend(
-                        self.vpp_filedeps[included_file_path + library])
-                    new_buf += line + '\n'
-                    n_expansions += 1
-                    continue
-                elif matches["define"]:
-                    self._parse_macro_def(matches["define"])
-
-                def do_expand(what):
-                    """Function to be applied by re.sub to every match of the
-                    vl_macro_expand in the Verilof code -- group() returns
-                    positive matches as indexed plain strings."""
-                    if what.group(1) in self.vpp_keywords:
-                        return '`' + what.group(1)
-                    macro = self._find_macro(what.group(1))
-                    if macro:
-                        return macro.expansion
-                    else:
-                        logging.error("No expansion for macro '`%s' (%s) (%s)",
-                                      what.group(1), line[:50]
-                                      if len(line) > 50 else line, file_name)
-                repl_line = re.sub(vl_macro_expand, do_expand, line)
-                new_buf += repl_line + '\n'
-                # if there was any expansion, then keep on iterating
-                if repl_line != line:
-                    n_expansions += 1
-            buf = new_buf
-            if n_expansions == 0:
-                return new_buf
-
-    def _define(self, name, expansion):
+        buf = re.sub(self.vpp_comment, self._comment_replacer, file_content)
+        state = {"protected_region": False}
+        for _ in range(30):
+            state["expansions"] = 0
+            buf = "".join(line + '\n' for line in self._preprocess_pass(
+                buf.splitlines(False), file_name, library, state))
+            if state["expansions"] == 0:
+                return buf
+        raise Exception("Recursion level exceeded. Nested `includes?")
+
+    def _preprocess_stream(self, file_name, library):
+        """Generator preprocessing the Verilog file while reading it, so that
+        only a window of it is kept in memory. As in _preprocess_file, the
+        code is preprocessed again and again until nothing is expanded (e.g.
+        a macro used before being defined is expanded by the second pass):
+        the result of every pass is kept in a temporary file"""
+        self.vpp_filedeps[file_name + library] = []
+        logging.debug("preprocess file %s (of size %d) in library %s in "
+                      "chunks", file_name, os.path.getsize(file_name),
+                      library)
+        lines = stream.split_lines(
+            stream.sub_chunks(self.vpp_comment, self._comment_replacer,
+                              stream.read_chunks(file_name)))
+        state = {"protected_region": False}
+        pass_file = None
+        try:
+            for _ in range(30):
+                state["expansions"] = 0
+                new_file = tempfile.TemporaryFile(mode="w+")
+                for line in self._preprocess_pass(lines, file_name, library,
+                                                  state):
+                    new_file.write(line + '\n')
+                if pass_file is not None:
+                    pass_file.close()
+                pass_file = new_file
+                pass_file.seek(0)
+                lines = stream.split_lines(
+                    stream.read_file_chunks(pass_file))
+                if state["expansions"] == 0:
+                    for line in lines:
+                        yield line
+                    return
+            raise Exception("Recursion level exceeded. Nested `includes?")
+        finally:
+            if pass_file is not None:
+                pass_file.close()
+
+    def _preprocess_include(self, file_path, library):
+        """Preprocess the `included Verilog file at file_path. The result
+        only depends on the macros defined at this point, so if the file was
+        already included with the same ones, it's taken from the include cache
+        (the preprocessor stack is known to be all true at this point)"""
+        key = (file_path, library, tuple(self.vlog_file.include_dirs),
+               tuple((macro.name, tuple(macro.args), macro.expansion)
+                     for macro in six.itervalues(self.vpp_macros)))
+        cached = self.vpp_include_cache.get(key)
+        if cached is not None:
+            text, macros, filedeps = cached
+            logging.debug("Include cache hit: %s", file_path)
+            self.vpp_macros = OrderedDict(macros)
+            self.vpp_filedeps[file_path + library] = list(filedeps)
+            return text
+        stack = list(self.vpp_stack.stack)
+        with open(file_path, "r") as include_file:
+            text = self._preprocess_file(file_content=include_file.read(),
+                                         file_name=file_path,
+                                         library=library)
+        # a file leaving unbalanced `ifdefs can't be replayed from the cache
+        if self.vpp_stack.stack == stack:
+            self.vpp_include_cache[key] = (
+                text, list(self.vpp_macros.items()),
+                list(self.vpp_filedeps[file_path + library]))
+        return text
+
+    def define(self, name, expansion=""):
         """Define a new expansion Verilog macro and add it to the macro
-        collection"""
-        mdef = self.VLDefine(name, [], expansion)
-        self.vpp_macros.append(mdef)
+        collection, replacing any previous definition with the same name"""
+        self.vpp_macros[name] = self.VLDefine(name, [], expansion)
+
+    def undef(self, name):
+        """Remove the named Verilog macro from the macro collection"""
+        self.vpp_macros.pop(name, None)
 
     def add_path(self, path):
         """Add a new path to the search directory list so that HDLMake
@@ -300,6 +408,14 @@ class VerilogPreprocessor(object):
                                      file_name=file_path,
                                      library=vlog_file.library)
 
+    def preprocess_stream(self, vlog_file):
+        """Assign the provided 'vlog_file' to the associated class property
+        and then preprocess its Verilog code while reading it, yielding the
+        resulting lines"""
+        self.vlog_file = vlog_file
+        return self._preprocess_stream(file_name=vlog_file.file_path,
+                                       library=vlog_file.library)
+
     def get_file_deps(self):
         """Look for all of the defined preprocessor filedeps and return a list
         containing all of them"""
@@ -310,6 +426,30 @@ class VerilogPreprocessor(object):
         return list(set(deps))
 
 
+def clear_include_cache():
+    """Forget every preprocessed `include file, as they may have changed
+    since they were cached (e.g. in a process watching the design)"""
+    VerilogPreprocessor.vpp_include_cache.clear()
+
+
+def get_vlog_opt_defines(vlog_opt):
+    """Get the list of (name, expansion) macros defined by the +define+
+    arguments in the provided vlog command line options"""
+    defines = []
+    for option in vlog_opt.split():
+        if option.startswith("+define+"):
+            defines.extend(split_define(define)
+                           for define in option.split("+")[2:] if define)
+    return defines
+
+
+def split_define(define):
+    """Split a NAME or NAME=VALUE macro definition into a (name, expansion)
+    tuple -- with an empty expansion if there is no VALUE"""
+    name, _, expansion = define.partition("=")
+    return name.strip(), expansion.strip()
+
+
 class VerilogParser(DepParser):
 
     """Class providing the Verilog Parser functionality"""
@@ -565,6 +705,13 @@ class VerilogParser(DepParser):
         containing the include dir candidates"""
         self.preprocessor.add_path(path)
 
+    def get_cache_context(self, dep_file):
+        """Get the settings, besides the file contents, that the Verilog
+        parse results depend on: library, include dirs and defines"""
+        return [dep_file.library,
+                list(dep_file.include_dirs),
+                [list(define) for define in dep_file.vlog_defines]]
+
     def parse(self, dep_file):
         """Parse the provided Verilog file and add to its properties
         all of the detected dependency relations"""
@@ -573,20 +720,37 @@ class VerilogParser(DepParser):
         logging.debug("Parsing %s", dep_file.path)
         # assert isinstance(dep_file, DepFile), print("unexpected type: " +
         # str(type(dep_file)))
-        buf = self.preprocessor.preprocess(dep_file)
-        self.preprocessed = buf[:]
+        for name, expansion in dep_file.vlog_defines:
+            self.preprocessor.define(name, expansion)
+        if stream.use_stream(dep_file.file_path):
+            self._parse_stream(dep_file)
+        else:
+            self._parse_buffer(dep_file)
         # add includes as dependencies
         try:
             includes = self.preprocessor.vpp_filedeps[
                 dep_file.path + dep_file.library]
-            for file_aux in includes:
-                dep_file.depends_on.add(
-                    create_source_file(path=file_aux,
-                                       module=dep_file.module))
+            for file_aux in sorted(set(includes)):
+                inc_file = create_source_file(path=file_aux,
+                                              module=dep_file.module)
+                if inc_file is not None:
+                    dep_file.depends_on.add(inc_file)
             logging.debug("%s has %d includes.",
                           str(dep_file), len(includes))
         except KeyError:
             logging.debug(str(dep_file) + " has no includes.")
+        dep_file.add_relation(
+            DepRelation(
+                dep_file.path,
+                DepRelation.PROVIDE,
+                DepRelation.INCLUDE))
+        dep_file.is_parsed = True
+
+    def _parse_buffer(self, dep_file):
+        """Preprocess the whole Verilog file in memory and look for the
+        packages, modules and instances in the resulting code"""
+        buf = self.preprocessor.preprocess(dep_file)
+        self.preprocessed = buf[:]
         # look for packages used inside in file
         # it may generate false dependencies as package in SV can be used by:
         #    import my_package::*;
@@ -597,73 +761,135 @@ class VerilogParser(DepParser):
         #    logic var = my_other_module::MY_CONST;
         # and HdlMake will anyway create dependency marking my_other_module as
         # requested package
-        import_pattern = re.compile(r"(\w+) *::(\w+|\\*)")
-
-        def do_imports(text):
-            """Function to be applied by re.subn to every match of the
-            import_pattern in the Verilog code -- group() returns positive
-            matches as indexed plain strings. It adds the found USE
-            relations to the file"""
-            logging.debug("file %s imports/uses %s.%s package",
-                          dep_file.path, dep_file.library, text.group(1))
-            dep_file.add_relation(
-                DepRelation("%s.%s" % (dep_file.library, text.group(1)),
-                            DepRelation.USE, DepRelation.PACKAGE))
-        re.subn(import_pattern, do_imports, buf)
+        for match in _IMPORT_PATTERN.finditer(buf):
+            self._add_import(dep_file, match)
         # packages
-        m_inside_package = re.compile(
-            r"package\s+(\w+)\s*(?:\(.*?\))?\s*(.+?)endpackage",
-            re.DOTALL | re.MULTILINE)
-
-        def do_package(text):
-            """Function to be applied by re.subn to every match of the
-            m_inside_pattern in the Verilog code -- group() returns positive
-            matches as indexed plain strings. It adds the found PROVIDE
-            relations to the file"""
-            logging.debug("found pacakge %s.%s", dep_file.library,
-                          text.group(1))
-            dep_file.add_relation(
-                DepRelation("%s.%s" % (dep_file.library, text.group(1)),
-                            DepRelation.PROVIDE, DepRelation.PACKAGE))
-        re.subn(m_inside_package, do_package, buf)
+        for match in _PACKAGE_PATTERN.finditer(buf):
+            self._add_package(dep_file, match)
         # modules and instatniations
-        m_inside_module = re.compile(
-            r"(?:module|interface)\s+(\w+)\s*(?:\(.*?\))?\s*(.+?)"
-            r"(?:endmodule|endinterface)",
-            re.DOTALL | re.MULTILINE)
-        m_instantiation = re.compile(
-            r"(?:\A|\s*)\s*(\w+)\s+(?:#\s*\(.*?\)\s*)?(\w+)\s*\(.*?\)\s*",
-            re.DOTALL | re.MULTILINE)
-
-        def do_module(text):
-            """Function to be applied by re.sub to every match of the
-            m_inside_module in the Verilog code -- group() returns
-            positive  matches as indexed plain strings. It adds the found
-            PROVIDE relations to the file"""
-            logging.debug("found module %s.%s", dep_file.library,
-                          text.group(1))
-            dep_file.add_relation(
-                DepRelation("%s.%s" % (dep_file.library, text.group(1)),
-                            DepRelation.PROVIDE, DepRelation.MODULE))
-
-            def do_inst(text):
-                """Function to be applied by re.sub to every match of the
-                m_instantiation in the Verilog code -- group() returns positive
-                matches as indexed plain strings. It adds the found USE
-                relations to the file"""
-                mod_name = text.group(1)
-                if mod_name in self.reserved_words:
-                    return
-                logging.debug("-> instantiates %s.%s as %s",
-                              dep_file.library, text.group(1), text.group(2))
-                dep_file.add_relation(
-                    DepRelation("%s.%s" % (dep_file.library, text.group(1)),
-                                DepRelation.USE, DepRelation.MODULE))
-            re.subn(m_instantiation, do_inst, text.group(2))
-        re.subn(m_inside_module, do_module, buf)
+        for match in _MODULE_PATTERN.finditer(buf):
+            instances = [self._get_instance(dep_file, inst)
+                         for inst in _INSTANCE_PATTERN.finditer(
+                             match.group(2))]
+            self._add_module(dep_file, match.group(1), instances)
+
+    def _parse_stream(self, dep_file):
+        """Preprocess the Verilog file while reading it and look for the
+        packages, modules and instances through a sliding window over the
+        resulting code, so that the whole file is never kept in memory"""
+        lines = self.preprocessor.preprocess_stream(dep_file)
+        stream.scan_chunks(
+            stream.join_lines(lines),
+            [stream.search_consumer(
+                _IMPORT_PATTERN,
+                lambda match: self._add_import(dep_file, match)),
+             stream.search_consumer(
+                 _PACKAGE_PATTERN,
+                 lambda match: self._add_package(dep_file, match)),
+             _ModuleScanner(
+                 lambda match: self._get_instance(dep_file, match),
+                 lambda name, instances: self._add_module(
+                     dep_file, name, instances))])
+
+    @staticmethod
+    def _add_import(dep_file, match):
+        """Add the USE relation for a match of the import pattern"""
+        logging.debug("file %s imports/uses %s.%s package",
+                      dep_file.path, dep_file.library, match.group(1))
         dep_file.add_relation(
-            DepRelation(
-                dep_file.path,
-                DepRelation.PROVIDE,
-                DepRelation.INCLUDE))
-        dep_file.is_parsed = True
+            DepRelation("%s.%s" % (dep_file.library, match.group(1)),
+                        DepRelation.USE, DepRelation.PACKAGE))
+
+    @staticmethod
+    def _add_package(dep_file, match):
+        """Add the PROVIDE relation for a match of the package pattern"""
+        logging.debug("found pacakge %s.%s", dep_file.library,
+                      match.group(1))
+        dep_file.add_relation(
+            DepRelation("%s.%s" % (dep_file.library, match.group(1)),
+                        DepRelation.PROVIDE, DepRelation.PACKAGE))
+
+    def _get_instance(self, dep_file, match):
+        """Get the name of the module instantiated in a match of the instance
+        pattern, or None if it's a reserved word"""
+        mod_name = match.group(1)
+        if mod_name in self.reserved_words:
+            return None
+        logging.debug("-> instantiates %s.%s as %s",
+                      dep_file.library, match.group(1), match.group(2))
+        return mod_name
+
+    @staticmethod
+    def _add_module(dep_file, name, instances):
+        """Add the PROVIDE relation for the named module, along with the USE
+        relations for the modules instantiated inside it"""
+        logging.debug("found module %s.%s", dep_file.library, name)
+        dep_file.add_relation(
+            DepRelation("%s.%s" % (dep_file.library, name),
+                        DepRelation.PROVIDE, DepRelation.MODULE))
+        for mod_name in instances:
+            if mod_name is None:
+                continue
+            dep_file.add_relation(
+                DepRelation("%s.%s" % (dep_file.library, mod_name),
+                            DepRelation.USE, DepRelation.MODULE))
+
+
+class _ModuleScanner(object):
+
+    """Consumer for stream.scan_chunks looking for the modules (and
+    interfaces) and the instances inside them. Unlike the module pattern,
+    a module doesn't need to fit in the window: the instances are collected
+    while its body is scanned, and the module is added once its end is found
+    """
+
+    def __init__(self, get_instance, add_module):
+        self.get_instance = get_instance
+        self.add_module = add_module
+        # Name and instances of the module whose end was not found yet
+        self.module = None
+        self.instances = set()
+
+    def __call__(self, window, pos, limit):
+        """Process the modules starting in window[pos:limit], along with the
+        rest of the module being scanned"""
+        while True:
+            if self.module is None:
+                header = _MODULE_HEADER_PATTERN.search(window, pos)
+                if header is None:
+                    if limit is None:
+                        return pos
+                    return max(pos, limit)
+                if limit is not None and header.start() >= limit:
+                    return header.start()
+                self.module = header.group(1)
+                self.instances = set()
+                # the module body has at least one character
+                end = _MODULE_END_PATTERN.search(window, header.end(1) + 1)
+                pos = header.end()
+            else:
+                end = _MODULE_END_PATTERN.search(window, pos)
+            if end is None:
+                if limit is None:
+                    # the module is never closed
+                    self.module = None
+                    return pos
+                return self._scan_body(window, pos, len(window), limit)
+            self._scan_body(window, pos, end.start(), None)
+            self.add_module(self.module, self.instances)
+            self.module = None
+            pos = end.end()
+
+    def _scan_body(self, window, pos, endpos, limit):
+        """Collect the instances starting in window[pos:limit], within the
+        current module body ending at endpos"""
+        while True:
+            match = _INSTANCE_PATTERN.search(window, pos, endpos)
+            if match is None:
+                if limit is None:
+                    return pos
+                return max(pos, limit)
+            if limit is not None and match.start() >= limit:
+                return match.start()
+            self.instances.add(self.get_instance(match))
+            pos = match.end()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark comparing the interned DepRelation class with the former
+__dict__ based one, by creating relations and adding them to sets as the
+parsers do:
+
+    python scripts/bench_dep_relation.py [--relations N] [--names N]
+
+The time taken and, when tracemalloc is available, the memory held by the
+resulting sets are printed for both classes."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from hdlmake.dep_file import DepRelation
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class LegacyDepRelation(object):
+
+    """Copy of the former DepRelation class, used as the reference"""
+
+    PROVIDE = 1
+    USE = 2
+
+    ENTITY = 1
+    PACKAGE = 2
+    INCLUDE = 3
+    ARCHITECTURE = 4
+    MODULE = ARCHITECTURE
+
+    def __init__(self, obj_name, direction, rel_type):
+        self.direction = direction
+        self.rel_type = rel_type
+        self.obj_name = obj_name.lower()
+
+    def __repr__(self):
+        dstr = {self.USE: "Use", self.PROVIDE: "Provide"}
+        ostr = {
+            self.ENTITY: "entity",
+            self.PACKAGE: "package",
+            self.INCLUDE: "include/header",
+            self.ARCHITECTURE: "architecture",
+            self.MODULE: "module"}
+        return "%s %s '%s'" % (dstr[self.direction],
+                               ostr[self.rel_type],
+                               self.obj_name)
+
+    def __hash__(self):
+        return hash(self.__repr__())
+
+    def __eq__(self, other):
+        return (isinstance(other, self.__class__)
+                and self.__dict__ == other.__dict__)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def _run(rel_class, names, relations, per_file):
+    """Create (relations) relations over the provided names, adding them to
+    one set per (per_file) relations, and get the time taken, the memory
+    held by the sets and the sets themselves"""
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    files = []
+    rels = set()
+    for index in range(relations):
+        if index % per_file == 0:
+            rels = set()
+            files.append(rels)
+        rels.add(rel_class(names[index % len(names)],
+                           DepRelation.USE, DepRelation.MODULE))
+    elapsed = time.time() - start
+    memory = None
+    if tracemalloc is not None:
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return elapsed, memory, files
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--relations", type=int, default=500000,
+                        help="number of relations created")
+    parser.add_argument("--names", type=int, default=20000,
+                        help="number of different module names")
+    parser.add_argument("--per-file", type=int, default=50,
+                        help="number of relations added to every file")
+    options = parser.parse_args()
+    names = ["work.Cell_%d" % index for index in range(options.names)]
+    for label, rel_class in [("legacy", LegacyDepRelation),
+                             ("interned", DepRelation)]:
+        elapsed, memory, files = _run(rel_class, names, options.relations,
+                                      options.per_file)
+        line = "%-8s %d relations in %d sets: %.3fs" % (
+            label, options.relations, len(files), elapsed)
+        if memory is not None:
+            line += ", %.1f MB" % (memory / (1024.0 * 1024.0))
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark comparing the File path properties computed once with the
+former ones, computed on every access, by writing the sources and the
+dependency rules of a simulation Makefile:
+
+    python scripts/bench_makefile_writer.py [--files N] [--deps N]
+
+The time taken to write the Makefile sections is printed for both."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from hdlmake.util import path as path_mod
+from hdlmake.srcfile import VHDLFile, SourceFileSet
+from hdlmake.tools.ghdl import ToolGHDL
+
+
+def _legacy_property(getter):
+    """Read-only property, whose assignments in File.__init__ are ignored"""
+    return property(getter, lambda self, value: None)
+
+
+class LegacyVHDLFile(VHDLFile):
+
+    """VHDL file with the former File path properties, as the reference"""
+
+    @_legacy_property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @_legacy_property
+    def purename(self):
+        return os.path.splitext(self.name)[0]
+
+    @_legacy_property
+    def dirname(self):
+        return os.path.dirname(self.path)
+
+    def rel_path(self, directory=None):
+        if directory is None:
+            directory = os.getcwd()
+        return path_mod.relpath(self.path, directory)
+
+    def extension(self):
+        tmp = self.path.rsplit('.')
+        ext = tmp[len(tmp) - 1]
+        return ext
+
+
+def _run(file_class, options):
+    """Write the Makefile sections for a design of file_class files and get
+    the time taken"""
+    rand = random.Random(0)
+    cwd = os.getcwd()
+    files = [file_class(path=os.path.join(cwd, "ip%d" % (index % 200), "rtl",
+                                          "ent%d.vhd" % index),
+                        module=None)
+             for index in range(options.files)]
+    for file_aux in files:
+        file_aux.depends_on = set(rand.sample(files, options.deps))
+    fileset = SourceFileSet()
+    fileset.add(files)
+    handle, filename = tempfile.mkstemp(suffix=".mk")
+    os.close(handle)
+    try:
+        writer = ToolGHDL()
+        writer.makefile_setup({"sim_top": "top"}, fileset, filename=filename)
+        start = time.time()
+        writer._makefile_sim_sources()
+        writer._makefile_sim_dep_files()
+        writer.close()
+        elapsed = time.time() - start
+    finally:
+        os.remove(filename)
+    return elapsed
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=20000,
+                        help="number of files in the design")
+    parser.add_argument("--deps", type=int, default=10,
+                        help="number of dependencies of every file")
+    options = parser.parse_args()
+    for label, file_class in [("legacy", LegacyVHDLFile),
+                              ("cached", VHDLFile)]:
+        elapsed = _run(file_class, options)
+        print("%-8s %d files x %d deps: %.3fs" % (
+            label, options.files, options.deps, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark comparing the single pass VHDL scanner with the regular
+expression based parser, e.g. on large vendor netlists (.vho files):
+
+    python scripts/bench_vhdl_parser.py netlist.vho [more files...]
+
+For every file, the time taken by each parser is printed, and the script
+exits with an error status if the relations found by them differ."""
+
+from __future__ import print_function
+from __future__ import absolute_import
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from hdlmake.srcfile import VHDLFile
+from hdlmake.vhdl_parser import VHDL_PARSER_VAR
+
+
+def _parse(path, library, parser_name, repeat):
+    """Parse the file at path (repeat) times with the named parser, and
+    get the best time along with the set of relations found"""
+    os.environ[VHDL_PARSER_VAR] = parser_name
+    best = None
+    for _ in range(repeat):
+        vhdl_file = VHDLFile(path, module=None, library=library)
+        start = time.time()
+        vhdl_file.parser.parse(vhdl_file)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    rels = set((rel.obj_name, rel.direction, rel.rel_type)
+               for rel in vhdl_file.rels)
+    return best, rels
+
+
+def main():
+    """Run the benchmark over the files provided as arguments"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("files", nargs="+", help="VHDL files to be parsed")
+    parser.add_argument("--library", default="work",
+                        help="library the files are compiled into")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of times each file is parsed")
+    options = parser.parse_args()
+    mismatches = 0
+    for path in options.files:
+        regex_time, regex_rels = _parse(path, options.library, "regex",
+                                        options.repeat)
+        scan_time, scan_rels = _parse(path, options.library, "scanner",
+                                      options.repeat)
+        print("%s: %d bytes, %d relations, regex %.3fs, scanner %.3fs" %
+              (path, os.path.getsize(path), len(scan_rels),
+               regex_time, scan_time))
+        if regex_rels != scan_rels:
+            mismatches += 1
+            for rel in sorted(regex_rels - scan_rels):
+                print("  only found by regex: %s %s %s" % rel)
+            for rel in sorted(scan_rels - regex_rels):
+                print("  only found by scanner: %s %s %s" % rel)
+    if mismatches:
+        print("%d files with different relations" % mismatches)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
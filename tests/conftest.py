@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Settings shared by the tests: hdlmake is imported from this tree, and
+the caches kept by the process are cleared before every test"""
+
+from __future__ import absolute_import
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hdlmake.util import stat_cache  # noqa: E402
+from hdlmake.vlog_parser import clear_include_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Forget the file stats and the preprocessed includes, which the
+    tests change between two runs"""
+    stat_cache.clear()
+    clear_include_cache()
+    yield
+    stat_cache.clear()
+    clear_include_cache()
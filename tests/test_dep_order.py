@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the dependency levels computed by the iterative Tarjan pass
+and of the order of the files built from them"""
+
+from __future__ import absolute_import
+
+from hdlmake.dep_file import compute_dep_levels
+from hdlmake.srcfile import VHDLFile, SourceFileSet
+from hdlmake.new_dep_solver import make_dependency_sorted_list
+
+
+def _make_files(names, deps):
+    """Get a {name: file} dictionary with a VHDL file for every name, each
+    depending on the files named in deps[name]"""
+    files = dict((name, VHDLFile(path="/design/%s.vhd" % name, module=None))
+                 for name in names)
+    for name, dep_names in deps.items():
+        for dep_name in dep_names:
+            files[name].depends_on.add(files[dep_name])
+    return files
+
+
+def _levels(files):
+    """Get the {name: level} dictionary of the files"""
+    return dict((name, dep_file.dep_level)
+                for name, dep_file in files.items())
+
+
+def test_levels_of_an_acyclic_graph():
+    """A file is one level above the highest of its dependencies"""
+    files = _make_files("abcde", {"a": "bc", "b": "d", "c": "d", "e": ""})
+    assert compute_dep_levels(list(files.values())) == []
+    assert _levels(files) == {"a": 2, "b": 1, "c": 1, "d": 0, "e": 0}
+
+
+def test_deep_graph_does_not_recurse():
+    """A chain deeper than the recursion limit is walked"""
+    names = ["f%05d" % index for index in range(5000)]
+    files = _make_files(names, dict(
+        (name, [dep]) for name, dep in zip(names, names[1:])))
+    assert compute_dep_levels([files[names[0]]]) == []
+    assert files[names[0]].dep_level == len(names) - 1
+    assert files[names[-1]].dep_level == 0
+
+
+def test_cycle_is_reported_and_shares_a_level():
+    """The files in a cycle get the same level, computed from the files
+    they depend on outside of it, and the cycle is returned"""
+    files = _make_files("abcd", {"a": "b", "b": "c", "c": "bd"})
+    cycles = compute_dep_levels([files["a"]])
+    assert cycles == [["/design/b.vhd", "/design/c.vhd"]]
+    assert _levels(files) == {"a": 2, "b": 1, "c": 1, "d": 0}
+
+
+def test_self_dependency_is_a_cycle():
+    """A file depending on itself is reported"""
+    files = _make_files("ab", {"a": "ab"})
+    assert compute_dep_levels([files["a"]]) == [["/design/a.vhd"]]
+    assert _levels(files) == {"a": 1, "b": 0}
+
+
+def test_levels_already_set_are_kept():
+    """The levels of the files solved by a previous call are reused"""
+    files = _make_files("abc", {"a": "b", "b": "c"})
+    compute_dep_levels([files["b"]])
+    assert _levels(files) == {"a": None, "b": 1, "c": 0}
+    compute_dep_levels([files["a"]])
+    assert files["a"].dep_level == 2
+
+
+def test_sorted_list_puts_dependencies_first():
+    """Every file comes after the files it depends on, except within a
+    cycle, and the files of a level are sorted by path"""
+    files = _make_files("abcdefg", {"a": "bc", "b": "d", "c": "de",
+                                    "e": "f", "f": "eg"})
+    fileset = SourceFileSet()
+    fileset.add(list(files.values()))
+    order = [dep_file.purename
+             for dep_file in make_dependency_sorted_list(fileset)]
+    assert order == ["d", "g", "b", "e", "f", "c", "a"]
+    assert order[::-1] == [
+        dep_file.purename
+        for dep_file in make_dependency_sorted_list(fileset, reverse=True)]
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the interned DepRelation objects"""
+
+from __future__ import absolute_import
+import gc
+import pickle
+
+import pytest
+
+from hdlmake.dep_file import DepRelation
+
+
+def test_equal_relations_are_the_same_object():
+    """Creating a relation equal to an existing one returns it"""
+    rel = DepRelation("Work.Counter", DepRelation.USE, DepRelation.PACKAGE)
+    assert rel is DepRelation("work.counter", DepRelation.USE,
+                              DepRelation.PACKAGE)
+    assert rel is not DepRelation("work.counter", DepRelation.PROVIDE,
+                                  DepRelation.PACKAGE)
+    assert pickle.loads(pickle.dumps(rel)) is rel
+
+
+def test_relations_are_immutable():
+    """The attributes of a relation can't be changed"""
+    rel = DepRelation("work.counter", DepRelation.USE, DepRelation.PACKAGE)
+    with pytest.raises(AttributeError):
+        rel.obj_name = "work.other"
+
+
+def test_unused_relations_are_forgotten():
+    """The relations no one holds anymore don't stay interned"""
+    key = ("work.renamed_module", DepRelation.PROVIDE, DepRelation.MODULE)
+    rel = DepRelation(*key)
+    assert key in DepRelation._interned
+    del rel
+    gc.collect()
+    assert key not in DepRelation._interned
+    rel = DepRelation(*key)
+    assert rel == DepRelation(*key)
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the registry of the file types and of the report of the files
+whose extension is unknown"""
+
+from __future__ import absolute_import
+import logging
+
+from hdlmake import srcfile
+from hdlmake.srcfile import (create_source_file, create_source_files,
+                             register_file_type, report_unknown_extensions,
+                             VHDLFile, VerilogFile, TCLFile)
+
+
+def test_files_of_unknown_extension_are_counted(caplog):
+    """The files of unknown extension are left out, counted by extension
+    and reported once"""
+    srcfile.UNKNOWN_EXTENSIONS.clear()
+    files = create_source_files(
+        ["/design/a.vhd", "/design/b.v", "/design/notes.txt",
+         "/design/more.txt", "/design/README", "/design/run.tcl"],
+        module=None)
+    assert [type(dep_file) for dep_file in files] == [VHDLFile, VerilogFile,
+                                                      TCLFile]
+    assert dict(srcfile.UNKNOWN_EXTENSIONS) == {"txt": 2, "": 1}
+    with caplog.at_level(logging.INFO):
+        report_unknown_extensions()
+        report_unknown_extensions()
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == ["Ignored 3 files with an unknown extension: "
+                        "no extension (1), txt (2)"]
+    assert not srcfile.UNKNOWN_EXTENSIONS
+
+
+def test_single_file_of_unknown_extension_is_none(caplog):
+    """Creating a single file of unknown extension gives None along with a
+    warning, instead of adding None to a fileset"""
+    with caplog.at_level(logging.WARNING):
+        assert create_source_file("/design/notes.txt", module=None) is None
+    assert "/design/notes.txt" in caplog.text
+    assert isinstance(create_source_file("/design/a.vho", module=None),
+                      VHDLFile)
+
+
+def test_registered_extension_is_known():
+    """An extension registered with or without its dot creates files of
+    the given class"""
+    try:
+        register_file_type([".vhdx", "vhdy"], VHDLFile)
+        assert srcfile.is_source_file("/design/a.vhdx")
+        assert isinstance(create_source_file("/design/a.vhdy", module=None),
+                          VHDLFile)
+    finally:
+        srcfile.FILE_TYPES.pop("vhdx", None)
+        srcfile.FILE_TYPES.pop("vhdy", None)
+    assert not srcfile.is_source_file("/design/a.vhdx")
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the shallow and sparse fetch of the Git modules, using a local
+repository whose path holds spaces and shell metacharacters"""
+
+from __future__ import absolute_import
+import os
+import sys
+import subprocess
+
+import pytest
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fetching in this folder runs "touch pwned" if the paths aren't quoted
+_FETCHTO = "ip dir $(touch pwned)"
+
+_MODULE_MANIFEST = """files = ["rtl/a.vhd"]
+"""
+
+_TOP_MANIFEST = """action = "simulation"
+sim_tool = "ghdl"
+sim_top = "a"
+fetchto = {0!r}
+modules = {{"git": [{1!r}]}}
+"""
+
+pytestmark = pytest.mark.skipif(
+    subprocess.call("git --version", shell=True,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE) != 0,
+    reason="git is not available")
+
+
+def _git(args, cwd):
+    """Run git with the provided arguments in cwd and get its output"""
+    env = dict(os.environ)
+    env.update({"GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "t@test",
+                "GIT_COMMITTER_NAME": "test",
+                "GIT_COMMITTER_EMAIL": "t@test"})
+    return subprocess.check_output(["git"] + args, cwd=cwd, env=env,
+                                   universal_newlines=True).strip()
+
+
+def _write(path, text):
+    """Write the file at path, creating its folder if needed"""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as file_aux:
+        file_aux.write(text)
+
+
+def _make_repo(path):
+    """Create the Git repository of a module at path, with two commits,
+    and get the id of the first one"""
+    _write(os.path.join(path, "Manifest.py"), _MODULE_MANIFEST)
+    _write(os.path.join(path, "rtl", "a.vhd"),
+           "entity a is\nend entity a;\n")
+    _write(os.path.join(path, "tb", "tb.vhd"),
+           "entity tb is\nend entity tb;\n")
+    _git(["init", "--quiet"], path)
+    # let the shallow fetch ask for a commit by its id
+    _git(["config", "uploadpack.allowAnySHA1InWant", "true"], path)
+    _git(["add", "-A"], path)
+    _git(["commit", "--quiet", "-m", "first"], path)
+    first = _git(["rev-parse", "HEAD"], path)
+    _write(os.path.join(path, "rtl", "a.vhd"),
+           "entity a is\n  port (x : in bit);\nend entity a;\n")
+    _git(["commit", "--quiet", "-am", "second"], path)
+    return first
+
+
+def _fetch(tmpdir, args, cache_dir=None):
+    """Fetch the module pinned to its first commit with the hdlmake fetch
+    arguments, and get the path of the fetched module and the commit"""
+    repo = os.path.join(str(tmpdir), "remote $x", "lib repo")
+    first = _make_repo(repo)
+    design = os.path.join(str(tmpdir), "design")
+    _write(os.path.join(design, "Manifest.py"),
+           _TOP_MANIFEST.format(_FETCHTO, "file://%s@@%s" % (repo, first)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_REPO_DIR] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    env.pop("HDLMAKE_FETCH_CACHE", None)
+    if cache_dir is not None:
+        env["HDLMAKE_FETCH_CACHE"] = cache_dir
+    process = subprocess.Popen(
+        [sys.executable, "-m", "hdlmake", "fetch"] + args, cwd=design,
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+    output = process.communicate()[0]
+    assert process.returncode == 0, output
+    assert not os.path.exists(os.path.join(design, "pwned")), output
+    assert not os.path.exists(os.path.join(design, _FETCHTO, "pwned"))
+    module = os.path.join(design, _FETCHTO, "lib repo")
+    assert os.path.isdir(module), output
+    return module, first
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_fetch_quotes_paths(tmpdir, cached):
+    """A module is fetched at the requested commit into paths holding
+    spaces and shell metacharacters, with or without the fetch cache"""
+    cache_dir = None
+    if cached:
+        cache_dir = os.path.join(str(tmpdir), "fetch cache $y")
+    module, first = _fetch(tmpdir, [], cache_dir)
+    assert _git(["rev-parse", "HEAD"], module) == first
+    assert _git(["rev-list", "--count", "--all"], module) == "2"
+    assert os.path.isfile(os.path.join(module, "tb", "tb.vhd"))
+    if cached:
+        assert len(os.listdir(os.path.join(cache_dir, "git"))) == 1
+
+
+def test_shallow_fetch_gets_only_the_pinned_commit(tmpdir):
+    """A shallow clone holds the pinned commit without its history"""
+    module, first = _fetch(tmpdir, ["--shallow"])
+    assert _git(["rev-parse", "HEAD"], module) == first
+    assert _git(["rev-list", "--count", "--all"], module) == "1"
+
+
+def test_sparse_fetch_checks_out_the_manifest_folders(tmpdir):
+    """A sparse clone only checks out the top folder and the folders its
+    manifest refers to"""
+    module, first = _fetch(tmpdir, ["--sparse"])
+    assert _git(["rev-parse", "HEAD"], module) == first
+    assert os.path.isfile(os.path.join(module, "Manifest.py"))
+    assert os.path.isfile(os.path.join(module, "rtl", "a.vhd"))
+    assert not os.path.exists(os.path.join(module, "tb"))
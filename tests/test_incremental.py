@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the incremental solve, which must give the dependencies the
+full solve gives after any change of the design"""
+
+from __future__ import absolute_import
+import os
+
+from hdlmake.util import stat_cache
+from hdlmake.srcfile import create_source_file, SourceFileSet
+from hdlmake.parse_cache import GraphState
+from hdlmake.new_dep_solver import solve, solve_incremental
+from hdlmake.vlog_parser import clear_include_cache
+
+_STANDARD_LIBS = ["ieee", "std"]
+
+_ENTITY = """library ieee;
+use ieee.std_logic_1164.all;
+{uses}
+entity {name} is
+end entity;
+architecture rtl of {name} is
+begin
+{instances}
+end architecture;
+"""
+
+_PACKAGE = """package {name} is
+end package;
+"""
+
+_VLOG_TOP = """`include "defs.vh"
+module vtop;
+  `SUBNAME u0 ();
+endmodule
+"""
+
+
+def _entity(name, instances=(), packages=()):
+    """Get the code of the entity name, using the packages and holding an
+    instance of each of the provided entities"""
+    return _ENTITY.format(
+        name=name,
+        uses="\n".join("use work.%s.all;" % pkg for pkg in packages),
+        instances="\n".join("  u_%s: entity work.%s;" % (inst, inst)
+                            for inst in instances))
+
+
+class _Design(object):
+
+    """Folder holding the files of a design, whose modification times are
+    always moved forward when they're written"""
+
+    def __init__(self, root):
+        self.root = root
+        self.cache_dir = os.path.join(root, "cache")
+        self._stamp = 1000
+        self.state = None
+
+    def write(self, name, text):
+        """Write the file name of the design"""
+        path = os.path.join(self.root, name)
+        with open(path, "w") as file_aux:
+            file_aux.write(text)
+        self._stamp += 10
+        os.utime(path, (self._stamp, self._stamp))
+
+    def remove(self, name):
+        """Remove the file name from the design"""
+        os.remove(os.path.join(self.root, name))
+
+    def _get_fileset(self):
+        """Get a fileset with fresh objects for the source files of the
+        design, as a new run would build it"""
+        stat_cache.clear()
+        clear_include_cache()
+        fileset = SourceFileSet()
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith((".vhd", ".v")):
+                fileset.add(create_source_file(
+                    path=os.path.join(self.root, name), module=None))
+        return fileset
+
+    def get_deps(self, incremental):
+        """Solve the design, incrementally or not, and get the names of the
+        files each file depends on"""
+        fileset = self._get_fileset()
+        if incremental:
+            self.state = GraphState(self.cache_dir)
+            solve_incremental(fileset, self.state, _STANDARD_LIBS)
+        else:
+            solve(fileset, _STANDARD_LIBS)
+        return dict((os.path.basename(dep_file.path),
+                     sorted(os.path.basename(dep.path)
+                            for dep in dep_file.depends_on))
+                    for dep_file in fileset)
+
+    def check(self):
+        """Check that the incremental solve gives the dependencies of the
+        full solve, and get them"""
+        deps = self.get_deps(incremental=False)
+        assert self.get_deps(incremental=True) == deps
+        return deps
+
+
+def _make_design(tmpdir):
+    """Create the design solved by the tests and solve it once"""
+    design = _Design(str(tmpdir))
+    design.write("pkg.vhd", _PACKAGE.format(name="pkg"))
+    design.write("top.vhd", _entity("top", ["a", "c"]))
+    design.write("a.vhd", _entity("a", ["b", "x"], ["pkg"]))
+    design.write("b.vhd", _entity("b"))
+    design.write("x1.vhd", _entity("x"))
+    design.write("defs.vh", "`define SUBNAME vsub_a\n")
+    design.write("vtop.v", _VLOG_TOP)
+    design.write("vsub_a.v", "module vsub_a;\nendmodule\n")
+    design.write("vsub_b.v", "module vsub_b;\nendmodule\n")
+    deps = design.check()
+    assert deps["top.vhd"] == ["a.vhd"]
+    assert deps["a.vhd"] == ["b.vhd", "pkg.vhd", "x1.vhd"]
+    assert deps["vtop.v"] == ["defs.vh", "vsub_a.v"]
+    return design
+
+
+def test_unchanged_design(tmpdir):
+    """Solving an unchanged design again gives the same dependencies,
+    without parsing any file"""
+    design = _make_design(tmpdir)
+    design.check()
+    assert (design.state.hits, design.state.misses) == (8, 0)
+
+
+def test_edited_files(tmpdir):
+    """A file whose instances change, and a header whose macros change,
+    get the dependencies of the full solve"""
+    design = _make_design(tmpdir)
+    design.write("a.vhd", _entity("a", ["x"]))
+    assert design.check()["a.vhd"] == ["x1.vhd"]
+    design.write("defs.vh", "`define SUBNAME vsub_b\n")
+    assert design.check()["vtop.v"] == ["defs.vh", "vsub_b.v"]
+
+
+def test_added_file(tmpdir):
+    """A file providing a unit used by an unchanged file, that wasn't
+    provided until then, is taken by that file"""
+    design = _make_design(tmpdir)
+    design.write("c.vhd", _entity("c"))
+    assert design.check()["top.vhd"] == ["a.vhd", "c.vhd"]
+
+
+def test_removed_file(tmpdir):
+    """The files depending on a removed file no longer depend on it"""
+    design = _make_design(tmpdir)
+    design.remove("b.vhd")
+    deps = design.check()
+    assert deps["a.vhd"] == ["pkg.vhd", "x1.vhd"]
+    assert "b.vhd" not in deps
+
+
+def test_renamed_entity(tmpdir):
+    """The files using an entity no longer depend on its file once it's
+    renamed, and do again when its name is restored"""
+    design = _make_design(tmpdir)
+    design.write("b.vhd", _entity("b_renamed"))
+    assert design.check()["a.vhd"] == ["pkg.vhd", "x1.vhd"]
+    design.write("b.vhd", _entity("b"))
+    assert design.check()["a.vhd"] == ["b.vhd", "pkg.vhd", "x1.vhd"]
+
+
+def test_swapped_provider(tmpdir):
+    """The files using a unit depend on its new file when it moves from a
+    file to another one, in one run or in two"""
+    design = _make_design(tmpdir)
+    design.write("x1.vhd", _entity("x_old"))
+    design.write("x2.vhd", _entity("x"))
+    assert design.check()["a.vhd"] == ["b.vhd", "pkg.vhd", "x2.vhd"]
+    design.remove("x2.vhd")
+    assert design.check()["a.vhd"] == ["b.vhd", "pkg.vhd"]
+    design.write("x1.vhd", _entity("x"))
+    assert design.check()["a.vhd"] == ["b.vhd", "pkg.vhd", "x1.vhd"]
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the persistent cache of the variables defined by the
+manifests, which must only spare the runs giving the same variables"""
+
+from __future__ import absolute_import
+import os
+import json
+
+from hdlmake.manifest_parser import ManifestParser
+from hdlmake.parse_cache import ManifestCache, MANIFEST_CACHE_FILE
+
+# Every run of the manifest appends a line to the log file
+_MANIFEST = """open({0!r}, "a").write("run\\n")
+files = ["a.vhd", "b.vhd"]
+library = "lib_a"
+syn_properties = [{{"name": "x", "value": 1}}]
+"""
+
+
+def _write_manifest(directory, log, extra=""):
+    """Write the Manifest.py in directory, logging its runs to log"""
+    with open(os.path.join(str(directory), "Manifest.py"), "w") as file_aux:
+        file_aux.write(_MANIFEST.format(log) + extra)
+
+
+def _parse(directory, cache_dir, extra_context=None, prefix_code=""):
+    """Parse the Manifest.py in directory with a fresh parser and cache, as
+    a new run would do, and get the variables it defines and the cache"""
+    manifest_parser = ManifestParser()
+    manifest_parser.add_prefix_code(prefix_code)
+    manifest_parser.add_sufix_code("")
+    manifest_parser.add_manifest(str(directory))
+    cache = ManifestCache(cache_dir)
+    options = manifest_parser.parse(extra_context=dict(extra_context or {}),
+                                    cache=cache)
+    cache.save()
+    return options, cache
+
+
+def _runs(log):
+    """Get how many times the manifest logging to log was run"""
+    if not os.path.exists(log):
+        return 0
+    with open(log) as log_file:
+        return len(log_file.readlines())
+
+
+def _stored_options(cache):
+    """Get the variables stored in the cache file for every manifest, None
+    for those that couldn't be cached"""
+    with open(cache.cache_file) as file_aux:
+        entries = json.load(file_aux)["entries"]
+    return [entry["options"] for entry in entries.values()]
+
+
+def test_variables_are_restored_from_json(tmpdir):
+    """The variables of an unchanged manifest are read back from the JSON
+    cache file without running it"""
+    log = str(tmpdir.join("log"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write_manifest(tmpdir, log)
+    options, cache = _parse(tmpdir, cache_dir)
+    assert (_runs(log), cache.misses) == (1, 1)
+    with open(os.path.join(cache_dir, MANIFEST_CACHE_FILE)) as file_aux:
+        entries = json.load(file_aux)["entries"]
+    assert list(entries) == [str(tmpdir.join("Manifest.py"))]
+    cached_options, cache = _parse(tmpdir, cache_dir)
+    assert (_runs(log), cache.hits) == (1, 1)
+    assert cached_options == options
+    assert options["files"] == ["a.vhd", "b.vhd"]
+    assert options["syn_properties"] == [{"name": "x", "value": 1}]
+
+
+def test_changes_of_the_run_are_detected(tmpdir):
+    """The manifest is run again if its code, the prefix code or the
+    inherited context change"""
+    log = str(tmpdir.join("log"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write_manifest(tmpdir, log)
+    _parse(tmpdir, cache_dir, {"sim_tool": "ghdl"})
+    _parse(tmpdir, cache_dir, {"sim_tool": "modelsim"})
+    assert _runs(log) == 2
+    _parse(tmpdir, cache_dir, {"sim_tool": "modelsim"}, "top = 'x'")
+    assert _runs(log) == 3
+    _write_manifest(tmpdir, log, "top_module = 'b'\n")
+    options = _parse(tmpdir, cache_dir, {"sim_tool": "modelsim"},
+                     "top = 'x'")[0]
+    assert _runs(log) == 4
+    assert options["top_module"] == "b"
+    _parse(tmpdir, cache_dir, {"sim_tool": "modelsim"}, "top = 'x'")
+    assert _runs(log) == 4
+
+
+def test_impure_manifest_is_always_run(tmpdir):
+    """A manifest declaring itself impure is run every time and its
+    variables are not stored in the cache file"""
+    log = str(tmpdir.join("log"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write_manifest(tmpdir, log, "__impure = True\n")
+    for runs in [1, 2]:
+        options, cache = _parse(tmpdir, cache_dir)
+        assert _runs(log) == runs
+        assert "__impure" not in options
+        assert _stored_options(cache) == [None]
+
+
+def test_manifest_defining_other_than_data_is_not_cached(tmpdir):
+    """A manifest defining values JSON can't hold as they are, like
+    imported modules or tuples, is run every time"""
+    log = str(tmpdir.join("log"))
+    cache_dir = str(tmpdir.join("cache"))
+    for runs, extra in [(2, "import os\n"), (4, "sizes = (1, 2)\n")]:
+        _write_manifest(tmpdir, log, extra)
+        _parse(tmpdir, cache_dir)
+        options, cache = _parse(tmpdir, cache_dir)
+        assert _runs(log) == runs
+        assert _stored_options(cache) == [None]
+    assert options["sizes"] == (1, 2)
+
+
+def test_cache_of_other_version_is_discarded(tmpdir):
+    """The entries written by another hdlmake version are not used"""
+    log = str(tmpdir.join("log"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write_manifest(tmpdir, log)
+    _parse(tmpdir, cache_dir)
+    cache_file = os.path.join(cache_dir, MANIFEST_CACHE_FILE)
+    with open(cache_file) as file_aux:
+        content = json.load(file_aux)
+    content["version"] = "0.0"
+    with open(cache_file, "w") as file_aux:
+        json.dump(content, file_aux)
+    _parse(tmpdir, cache_dir)
+    assert _runs(log) == 2
+    with open(cache_file) as file_aux:
+        assert json.load(file_aux)["version"] != "0.0"
+
+
+def test_sufix_code_runs_after_the_manifest(tmpdir):
+    """The sufix code overrides the variables set by the manifest, which
+    sees those set by the prefix code, and changing it runs the manifest
+    again"""
+    log = str(tmpdir.join("log"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write_manifest(tmpdir, log, "top_module = prefix_top\n")
+    manifest_parser = ManifestParser()
+    manifest_parser.add_prefix_code("prefix_top = 'a'")
+    manifest_parser.add_sufix_code("library = 'lib_b'")
+    manifest_parser.add_manifest(str(tmpdir))
+    options = manifest_parser.parse(extra_context={},
+                                    cache=ManifestCache(cache_dir))
+    assert (options["top_module"], options["library"]) == ("a", "lib_b")
+    _parse(tmpdir, cache_dir, prefix_code="prefix_top = 'a'")
+    assert _runs(log) == 2
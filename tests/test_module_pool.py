@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the module pool, which holds a single module for every
+repository (or local folder) the design requires"""
+
+from __future__ import absolute_import
+import os
+import sys
+
+import pytest
+
+from hdlmake.__main__ import _get_parser
+from hdlmake.module_pool import ModulePool
+
+_TOP_MANIFEST = """action = "simulation"
+sim_tool = "ghdl"
+sim_top = "a"
+modules = {"local": ["a", "b"]}
+"""
+
+_SHARED_MANIFEST = """open({0!r}, "a").write("run\\n")
+files = []
+"""
+
+
+# Every run of the manifest appends the id of the process running it to
+# its log file
+_LOGGED_MANIFEST = ("open({0!r}, 'a').write('%d\\n' % "
+                    "__import__('os').getpid())\n")
+
+
+def _write(path, text):
+    """Write the file at path, creating its folder if needed"""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as file_aux:
+        file_aux.write(text)
+
+
+def test_module_required_twice_is_shared(tmpdir, monkeypatch):
+    """A module required by two modules is the same object for both, keeps
+    the first module requiring it as its parent and its Manifest.py is run
+    once"""
+    design = str(tmpdir.join("design"))
+    log = str(tmpdir.join("log"))
+    _write(os.path.join(design, "Manifest.py"), _TOP_MANIFEST)
+    for name in ["a", "b"]:
+        _write(os.path.join(design, name, "Manifest.py"),
+               'modules = {"local": ["../shared"]}\n')
+    _write(os.path.join(design, "shared", "Manifest.py"),
+           _SHARED_MANIFEST.format(log))
+    monkeypatch.chdir(design)
+    pool = ModulePool(_get_parser().parse_args(["list-mods"]))
+    paths = sorted(os.path.relpath(mod.path, design) for mod in pool)
+    assert paths == [".", "a", "b", "shared"]
+    mod_a, mod_b = pool.top_module.local
+    assert mod_a.local[0] is mod_b.local[0]
+    assert mod_a.local[0].parent is mod_a
+    assert pool.get_module_by_url(
+        os.path.join(design, "b", "..", "shared"),
+        mod_a.local[0].source) is mod_a.local[0]
+    with open(log) as log_file:
+        assert log_file.read() == "run\n"
+
+
+def _get_runs(log):
+    """Get whether each run of the manifest logging to log was done by
+    this process or by another one"""
+    if not os.path.exists(log):
+        return []
+    with open(log) as log_file:
+        pids = [int(line) for line in log_file]
+    os.remove(log)
+    return ["main" if pid == os.getpid() else "worker" for pid in pids]
+
+
+@pytest.mark.skipif(sys.version_info[0] < 3,
+                    reason="the manifests only run in workers with Python 3")
+def test_side_effects_of_manifests_run_in_workers(tmpdir, monkeypatch):
+    """With several jobs, a manifest is run once by a worker process unless
+    it may be impure or its variables couldn't be cached the previous time,
+    in which case it's only run by hdlmake itself"""
+    design = str(tmpdir.join("design"))
+    logs = dict((name, str(tmpdir.join(name + ".log")))
+                for name in ["pure", "impure", "function"])
+    _write(os.path.join(design, "Manifest.py"),
+           _TOP_MANIFEST.replace('"a", "b"', '"pure", "impure", "function"'))
+    extra = {"pure": "", "impure": "__impure = True\n",
+             "function": "def helper():\n    pass\n"}
+    for name, log in logs.items():
+        _write(os.path.join(design, name, "Manifest.py"),
+               _LOGGED_MANIFEST.format(log) + extra[name])
+    monkeypatch.chdir(design)
+    options = _get_parser().parse_args(["list-mods"])
+    options.jobs = 2
+    pool = ModulePool(options)
+    pool.save_manifest_cache()
+    assert _get_runs(logs["pure"]) == ["worker"]
+    assert _get_runs(logs["impure"]) == ["main"]
+    # the variables of the first run can't be sent back to this process
+    assert _get_runs(logs["function"]) == ["worker", "main"]
+    ModulePool(options)
+    assert _get_runs(logs["pure"]) == []
+    assert _get_runs(logs["impure"]) == ["main"]
+    assert _get_runs(logs["function"]) == ["main"]
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the persistent parse cache and of its invalidation"""
+
+from __future__ import absolute_import
+import os
+import json
+
+from hdlmake.util import stat_cache
+from hdlmake.srcfile import create_source_file
+from hdlmake.parse_cache import ParseCache, CACHE_FILE
+from hdlmake.new_dep_solver import _parse_fileset
+from hdlmake.vlog_parser import clear_include_cache
+
+_ENTITY = """library ieee;
+use ieee.std_logic_1164.all;
+use work.{0}.all;
+entity a is
+end entity;
+architecture rtl of a is
+begin
+end architecture;
+"""
+
+_MODULE = """`include "defs.vh"
+module top;
+  `SUBNAME u0 ();
+endmodule
+"""
+
+
+def _write(path, text, stamp):
+    """Write the file at path with the given modification time"""
+    with open(path, "w") as file_aux:
+        file_aux.write(text)
+    os.utime(path, (stamp, stamp))
+
+
+def _parse(path, cache_dir, library=None):
+    """Parse the file at path with a fresh object and cache, as a new run
+    would do, and get the relations found along with the cache"""
+    stat_cache.clear()
+    clear_include_cache()
+    dep_file = create_source_file(path=path, module=None, library=library)
+    cache = ParseCache(cache_dir)
+    _parse_fileset([dep_file], cache)
+    return sorted(str(rel) for rel in dep_file.rels), cache
+
+
+def test_unchanged_file_is_not_parsed_again(tmpdir):
+    """The relations of an unchanged file are restored from the cache"""
+    path = str(tmpdir.join("a.vhd"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write(path, _ENTITY.format("pkg"), 1000)
+    rels, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert "Use package 'work.pkg'" in rels
+    cached_rels, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert cached_rels == rels
+
+
+def test_changed_file_is_parsed_again(tmpdir):
+    """A file whose content changed is parsed again"""
+    path = str(tmpdir.join("a.vhd"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write(path, _ENTITY.format("pkg"), 1000)
+    _parse(path, cache_dir)
+    _write(path, _ENTITY.format("other_pkg"), 2000)
+    rels, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert "Use package 'work.other_pkg'" in rels
+    assert "Use package 'work.pkg'" not in rels
+
+
+def test_same_size_change_is_detected(tmpdir):
+    """A change keeping the size of the file is found through its hash,
+    while a file that was only touched keeps its entry"""
+    path = str(tmpdir.join("a.vhd"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write(path, _ENTITY.format("pkg_a"), 1000)
+    _parse(path, cache_dir)
+    _write(path, _ENTITY.format("pkg_a"), 2000)
+    _, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (1, 0)
+    _write(path, _ENTITY.format("pkg_b"), 3000)
+    rels, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert "Use package 'work.pkg_b'" in rels
+
+
+def test_changed_include_invalidates_entry(tmpdir, monkeypatch):
+    """A Verilog file is parsed again if one of its includes changed"""
+    monkeypatch.chdir(str(tmpdir))
+    path = str(tmpdir.join("top.v"))
+    header = str(tmpdir.join("defs.vh"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write(path, _MODULE, 1000)
+    _write(header, "`define SUBNAME sub_a\n", 1000)
+    rels, _ = _parse(path, cache_dir)
+    assert "Use module 'work.sub_a'" in rels
+    _, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (1, 0)
+    _write(header, "`define SUBNAME sub_b\n", 2000)
+    rels, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert "Use module 'work.sub_b'" in rels
+
+
+def test_changed_context_invalidates_entry(tmpdir):
+    """A file parsed for another library is parsed again"""
+    path = str(tmpdir.join("a.vhd"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write(path, _ENTITY.format("pkg"), 1000)
+    _parse(path, cache_dir)
+    rels, cache = _parse(path, cache_dir, library="other_lib")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert "Use package 'other_lib.pkg'" in rels
+
+
+def test_cache_of_another_version_is_discarded(tmpdir):
+    """The entries written by a different hdlmake version are ignored"""
+    path = str(tmpdir.join("a.vhd"))
+    cache_dir = str(tmpdir.join("cache"))
+    _write(path, _ENTITY.format("pkg"), 1000)
+    _parse(path, cache_dir)
+    cache_file = os.path.join(cache_dir, CACHE_FILE)
+    with open(cache_file) as file_aux:
+        content = json.load(file_aux)
+    content["version"] = "0.0"
+    with open(cache_file, "w") as file_aux:
+        json.dump(content, file_aux)
+    _, cache = _parse(path, cache_dir)
+    assert (cache.hits, cache.misses) == (0, 1)
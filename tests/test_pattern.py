@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the walker resolving the glob patterns and the exclude
+patterns of the manifests"""
+
+from __future__ import absolute_import
+import os
+
+import pytest
+
+from hdlmake.util.pattern import PatternWalker, is_pattern
+
+_FILES = ["rtl/a.vhd", "rtl/b.v", "rtl/.e.vhd", "rtl/.hidden/h.vhd",
+          "rtl/sub/c.vhd", "rtl/sub/deep/d.vhd", "tb/tb.vhd"]
+
+
+@pytest.fixture
+def tree(tmpdir):
+    """Create the files of _FILES below tmpdir, along with a symbolic link
+    from rtl/sub/loop to rtl, and get the path of tmpdir"""
+    root = str(tmpdir)
+    for name in _FILES:
+        path = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "w").close()
+    if hasattr(os, "symlink"):
+        os.symlink(os.path.join(root, "rtl"),
+                   os.path.join(root, "rtl", "sub", "loop"))
+    return root
+
+
+def _glob(root, pattern, **kwargs):
+    """Get the paths, relative to root, of the files matching pattern"""
+    return [os.path.relpath(path, root).replace(os.sep, "/")
+            for path in PatternWalker(root, **kwargs).glob(pattern)]
+
+
+def test_is_pattern():
+    """Only the paths with wildcards are patterns"""
+    assert is_pattern("rtl/*.vhd")
+    assert is_pattern("rtl/file?.v")
+    assert is_pattern("rtl/[ab].vhd")
+    assert not is_pattern("rtl/a.vhd")
+
+
+def test_wildcards_match_a_single_name(tree):
+    """The wildcards match within a folder and skip the hidden names"""
+    assert _glob(tree, "rtl/*.vhd") == ["rtl/a.vhd"]
+    assert _glob(tree, "rtl/[ab].*") == ["rtl/a.vhd", "rtl/b.v"]
+    assert _glob(tree, "*/?.v") == ["rtl/b.v"]
+    assert _glob(tree, "rtl/.*.vhd") == ["rtl/.e.vhd"]
+    assert _glob(tree, "rtl/a.vhd") == ["rtl/a.vhd"]
+    assert _glob(tree, "rtl/missing.vhd") == []
+
+
+def test_recursive_component_matches_nested_folders(tree):
+    """A "**" component matches any number of folders, including none, and
+    a trailing one matches every file below the folder. The symbolic link
+    back to a folder being walked is not followed"""
+    assert _glob(tree, "**/*.vhd") == ["rtl/a.vhd", "rtl/sub/c.vhd",
+                                       "rtl/sub/deep/d.vhd", "tb/tb.vhd"]
+    assert _glob(tree, "rtl/**/d.vhd") == ["rtl/sub/deep/d.vhd"]
+    assert _glob(tree, "rtl/**/**/c.vhd") == ["rtl/sub/c.vhd"]
+    assert _glob(tree, "rtl/**") == ["rtl/a.vhd", "rtl/b.v", "rtl/sub/c.vhd",
+                                     "rtl/sub/deep/d.vhd"]
+
+
+def test_excluded_files_and_folders_are_pruned(tree):
+    """The files matching an exclude pattern, and those below a folder
+    matching one, are left out"""
+    excludes = ["rtl/sub/deep", "**/b.v"]
+    assert (_glob(tree, "**", excludes=excludes) ==
+            ["rtl/a.vhd", "rtl/sub/c.vhd", "tb/tb.vhd"])
+    walker = PatternWalker(tree, excludes=excludes)
+    assert walker.is_excluded(os.path.join(tree, "rtl", "sub", "deep",
+                                           "d.vhd"))
+    assert walker.is_excluded(os.path.join(tree, "tb", "b.v"))
+    assert not walker.is_excluded(os.path.join(tree, "rtl", "sub", "c.vhd"))
+
+
+def test_accept_filters_the_files(tree):
+    """Only the files the accept function takes are returned, and the
+    folders are listed once however many patterns are resolved"""
+    walker = PatternWalker(tree, accept=lambda path: path.endswith(".v"))
+    assert walker.glob("**") == [os.path.join(tree, "rtl", "b.v")]
+    visited = walker.visited
+    assert walker.glob("**/*") == walker.glob("**")
+    assert walker.visited == visited
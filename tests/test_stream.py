@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the sliding window scan of the huge HDL files, whose results
+must match the ones obtained with the whole file in memory"""
+
+from __future__ import absolute_import
+import os
+import re
+import glob
+
+import pytest
+
+from hdlmake.util import stream
+from hdlmake.srcfile import create_source_file
+
+_COUNTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "counter")
+_COUNTER_SOURCES = sorted(
+    glob.glob(os.path.join(_COUNTER_DIR, "*", "*", "vhdl", "*.vhd")) +
+    glob.glob(os.path.join(_COUNTER_DIR, "*", "*", "verilog", "*.v")))
+
+_COMMENT_PATTERN = re.compile(r"//.*?$|/\*.*?\*/", re.DOTALL | re.MULTILINE)
+
+# (chunk size, lookahead) pairs, including chunks shorter than the
+# lookahead, for which nothing can be processed until more text is read
+_WINDOWS = [(64, 2000), (64, 128), (1000, 200), (10 ** 6, 10 ** 6)]
+
+_VERILOG_SNIPPETS = {
+    # macros used before being defined, expanded by a later pass
+    "late_define": """`define OUTER `INNER
+module top;
+  `OUTER u0 ();
+endmodule
+`define INNER sub_b
+""",
+    "redefine": """`define SEL `CHOICE
+`define CHOICE sub_a
+module top;
+  `SEL u0 ();
+endmodule
+`undef CHOICE
+`define CHOICE sub_b
+""",
+    "ifdef_order": """`ifdef FOO
+module unused; sub_c u0 (); endmodule
+`endif
+`define FOO
+`ifdef FOO
+module top; sub_d u0 (); endmodule
+`else
+module other; sub_e u0 (); endmodule
+`endif
+""",
+}
+
+
+def _get_text():
+    """Get a text with comments spanning over any chunk boundary"""
+    lines = []
+    for index in range(300):
+        lines.append("line %d // comment %d" % (index, index))
+        if index % 7 == 0:
+            lines.append("/* a comment\n over %d\n lines */ code" % index)
+    return "\n".join(lines) + "\n"
+
+
+def _write(directory, name, text):
+    """Write the file name in directory and get its path"""
+    path = os.path.join(str(directory), name)
+    with open(path, "w") as file_aux:
+        file_aux.write(text)
+    return path
+
+
+@pytest.mark.parametrize("chunk_size,lookahead", _WINDOWS)
+def test_sub_chunks_matches_sub(chunk_size, lookahead, tmpdir):
+    """Substituting through the window gives the text re.sub gives"""
+    text = _get_text()
+    path = _write(tmpdir, "text.v", text)
+    result = "".join(stream.sub_chunks(
+        _COMMENT_PATTERN, lambda match: "",
+        stream.read_chunks(path, chunk_size), lookahead))
+    assert result == _COMMENT_PATTERN.sub("", text)
+
+
+@pytest.mark.parametrize("chunk_size,lookahead", _WINDOWS)
+def test_scan_chunks_matches_finditer(chunk_size, lookahead, tmpdir):
+    """Searching through the window finds the matches re.finditer finds"""
+    text = _get_text()
+    path = _write(tmpdir, "text.v", text)
+    found = []
+    stream.scan_chunks(
+        stream.read_chunks(path, chunk_size),
+        [stream.search_consumer(_COMMENT_PATTERN,
+                                lambda match: found.append(match.group(0)))],
+        lookahead)
+    assert found == [match.group(0)
+                     for match in _COMMENT_PATTERN.finditer(text)]
+
+
+@pytest.mark.parametrize("piece_size", [1, 3, 64, 10 ** 6])
+def test_split_lines_matches_splitlines(piece_size):
+    """Splitting the text provided in pieces gives the lines of the text"""
+    text = _get_text() + "\n\nlast line without end"
+    pieces = [text[pos:pos + piece_size]
+              for pos in range(0, len(text), piece_size)]
+    assert list(stream.split_lines(pieces)) == text.splitlines()
+
+
+def _get_rels(path, monkeypatch, streamed):
+    """Get the relations found in the HDL file at path, reading it in
+    memory or through a small sliding window"""
+    if streamed:
+        monkeypatch.setenv("HDLMAKE_STREAM_THRESHOLD", "0")
+        monkeypatch.setattr(stream, "CHUNK_SIZE", 64)
+        monkeypatch.setattr(stream, "LOOKAHEAD", 2000)
+    else:
+        monkeypatch.delenv("HDLMAKE_STREAM_THRESHOLD", raising=False)
+    dep_file = create_source_file(path=path, module=None)
+    dep_file.parser.parse(dep_file)
+    monkeypatch.undo()
+    return sorted(str(rel) for rel in dep_file.rels
+                  if "include" not in str(rel))
+
+
+@pytest.mark.parametrize("path", _COUNTER_SOURCES,
+                         ids=[os.path.basename(path)
+                              for path in _COUNTER_SOURCES])
+def test_stream_matches_memory_on_counter(path, monkeypatch):
+    """The HDL files read through the window give the same relations"""
+    rels = _get_rels(path, monkeypatch, streamed=True)
+    assert rels
+    assert rels == _get_rels(path, monkeypatch, streamed=False)
+
+
+@pytest.mark.parametrize("name", sorted(_VERILOG_SNIPPETS))
+def test_stream_matches_memory_on_preprocessor(name, tmpdir, monkeypatch):
+    """The Verilog preprocessor gives the same result for the streamed
+    files, which are also preprocessed again until nothing is expanded"""
+    path = _write(tmpdir, name + ".v", _VERILOG_SNIPPETS[name])
+    rels = _get_rels(path, monkeypatch, streamed=True)
+    assert rels == _get_rels(path, monkeypatch, streamed=False)
+
+
+def test_late_define_is_expanded(tmpdir, monkeypatch):
+    """A macro expanding to another one defined after its use is expanded
+    by the later passes, streamed or not"""
+    path = _write(tmpdir, "late.v", _VERILOG_SNIPPETS["late_define"])
+    for streamed in [True, False]:
+        assert ("Use module 'work.sub_b'" in
+                _get_rels(path, monkeypatch, streamed))
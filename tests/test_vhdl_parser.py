@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the single pass VHDL scanner, whose relations must match the
+ones found by the regular expression based parser"""
+
+from __future__ import absolute_import
+import os
+import glob
+
+import pytest
+
+from hdlmake.srcfile import create_source_file
+from hdlmake.vhdl_parser import VHDL_PARSER_VAR
+
+_COUNTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "counter")
+_COUNTER_SOURCES = sorted(glob.glob(
+    os.path.join(_COUNTER_DIR, "*", "*", "vhdl", "*.vhd")))
+
+_SNIPPETS = {
+    "package": """library ieee;
+use ieee.std_logic_1164.all;
+package pkg is
+  type rec_t is record
+    a : std_logic;
+  end record;
+  function f(x : integer) return integer;
+  component comp is
+    port (clk : in std_logic);
+  end component;
+end package;
+package body pkg is
+  function f(x : integer) return integer is
+  begin
+    return x;
+  end function;
+end package body;
+""",
+    "instances": """LIBRARY IEEE;
+USE IEEE.STD_LOGIC_1164.ALL;
+Use Work.Pkg.All;
+entity top is
+  port (clk : in std_logic);
+end top;
+architecture rtl of top is
+begin
+  u0 : comp port map (clk => clk);
+  u1: entity work.sub
+    generic map (N => 4)
+    port map (clk => clk);
+  u2 : entity other_lib.sub port map (clk);
+  u3 : sub;
+end rtl;
+""",
+    "comments": """-- entity commented is end commented;
+library ieee; -- use ieee.numeric_std.all;
+use ieee.std_logic_1164.all;
+entity e is
+  generic (S : string := "--");
+end e;
+architecture a of e is
+  constant C : character := '"';
+begin
+  -- u0 : commented port map (x);
+  u1 : real_one port map (x); -- u2 : other port map (y);
+end a;
+""",
+}
+
+
+def _get_rels(path, parser, monkeypatch, library=None):
+    """Get the relations found in the VHDL file at path by the parser"""
+    monkeypatch.setenv(VHDL_PARSER_VAR, parser)
+    dep_file = create_source_file(path=path, module=None, library=library)
+    dep_file.parser.parse(dep_file)
+    return sorted(str(rel) for rel in dep_file.rels)
+
+
+def test_counter_sources_exist():
+    """The example design provides the VHDL sources compared below"""
+    assert len(_COUNTER_SOURCES) > 5
+
+
+@pytest.mark.parametrize("path", _COUNTER_SOURCES,
+                         ids=[os.path.basename(path)
+                              for path in _COUNTER_SOURCES])
+def test_scanner_matches_regex_on_counter(path, monkeypatch):
+    """The scanner finds the same relations as the regex parser"""
+    rels = _get_rels(path, "scanner", monkeypatch)
+    assert rels
+    assert rels == _get_rels(path, "regex", monkeypatch)
+
+
+@pytest.mark.parametrize("name", sorted(_SNIPPETS))
+def test_scanner_matches_regex_on_snippets(name, tmpdir, monkeypatch):
+    """The scanner finds the same relations as the regex parser in code
+    using mixed case, several lines per construct, comments and strings"""
+    path = str(tmpdir.join(name + ".vhd"))
+    with open(path, "w") as file_aux:
+        file_aux.write(_SNIPPETS[name])
+    rels = _get_rels(path, "scanner", monkeypatch, library="lib")
+    assert rels
+    assert rels == _get_rels(path, "regex", monkeypatch, library="lib")
+
+
+def test_scanner_relations(tmpdir, monkeypatch):
+    """The scanner finds the instances and uses, but not those that are
+    commented out"""
+    path = str(tmpdir.join("comments.vhd"))
+    with open(path, "w") as file_aux:
+        file_aux.write(_SNIPPETS["comments"])
+    rels = _get_rels(path, "scanner", monkeypatch)
+    assert "Use package 'ieee.std_logic_1164'" in rels
+    assert "Use module 'work.real_one'" in rels
+    assert not any("commented" in rel or "numeric_std" in rel or
+                   "other" in rel for rel in rels)
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the cache of the preprocessed Verilog `include files, whose
+key must tell apart every state the included text depends on"""
+
+from __future__ import absolute_import
+import os
+
+from hdlmake.srcfile import create_source_file
+from hdlmake.vlog_parser import VerilogPreprocessor, clear_include_cache
+
+_SELECT_HEADER = """`ifdef USE_A
+`define SUBNAME sub_a
+`else
+`define SUBNAME sub_b
+`endif
+"""
+
+_GUARDED_HEADER = """`ifndef DEFS
+`define DEFS
+`include "more.vh"
+`define SUBNAME sub_c
+`endif
+"""
+
+
+def _write(directory, name, text):
+    """Write the file name in directory and get its path"""
+    path = os.path.join(str(directory), name)
+    with open(path, "w") as file_aux:
+        file_aux.write(text)
+    return path
+
+
+def _instance_source(header, define=None):
+    """Get the code of a module instancing `SUBNAME after including the
+    header, with the define macro set before it"""
+    lines = []
+    if define is not None:
+        lines.append("`define %s" % define)
+    lines.append('`include "%s"' % header)
+    lines.append("module top;\n  `SUBNAME u0 ();\nendmodule")
+    return "\n".join(lines) + "\n"
+
+
+def _parse(path, **kwargs):
+    """Parse the Verilog file at path and get the modules it uses and the
+    names of the files it includes"""
+    dep_file = create_source_file(path=path, module=None, **kwargs)
+    dep_file.parser.parse(dep_file)
+    return (sorted(str(rel) for rel in dep_file.rels
+                   if str(rel).startswith("Use module")),
+            sorted(os.path.basename(dep.path) for dep in dep_file.depends_on))
+
+
+def test_macros_defined_before_include_are_part_of_the_key(tmpdir):
+    """A header included with different macros defined is preprocessed
+    again, whatever the order in which the files are parsed"""
+    _write(tmpdir, "select.vh", _SELECT_HEADER)
+    path_a = _write(tmpdir, "a.v", _instance_source("select.vh", "USE_A"))
+    path_b = _write(tmpdir, "b.v", _instance_source("select.vh"))
+    for order in [(path_a, path_b), (path_b, path_a)]:
+        clear_include_cache()
+        results = dict((path, _parse(path)) for path in order)
+        assert results[path_a][0] == ["Use module 'work.sub_a'"]
+        assert results[path_b][0] == ["Use module 'work.sub_b'"]
+
+
+def test_cache_hit_matches_a_fresh_preprocess(tmpdir):
+    """A header taken from the cache gives the relations, the macros and
+    the whole include chain that preprocessing it again gives"""
+    _write(tmpdir, "defs.vh", _GUARDED_HEADER)
+    _write(tmpdir, "more.vh", "`define MORE\n")
+    path_a = _write(tmpdir, "a.v", _instance_source("defs.vh"))
+    path_b = _write(tmpdir, "b.v", _instance_source("defs.vh"))
+    clear_include_cache()
+    fresh = _parse(path_b)
+    clear_include_cache()
+    _parse(path_a)
+    assert VerilogPreprocessor.vpp_include_cache
+    cached = _parse(path_b)
+    assert cached == fresh
+    assert cached == (["Use module 'work.sub_c'"], ["defs.vh", "more.vh"])
+
+
+def test_include_dirs_are_part_of_the_key(tmpdir):
+    """A header whose own includes are found in other include directories
+    isn't taken from the cache"""
+    dir_a = tmpdir.mkdir("inc_a")
+    dir_b = tmpdir.mkdir("inc_b")
+    _write(dir_a, "inner.vh", "`define SUBNAME sub_a\n")
+    _write(dir_b, "inner.vh", "`define SUBNAME sub_b\n")
+    _write(tmpdir, "defs.vh", '`include "inner.vh"\n')
+    path = _write(tmpdir, "top.v", _instance_source("defs.vh"))
+    assert (_parse(path, include_dirs=[str(dir_a)])[0] ==
+            ["Use module 'work.sub_a'"])
+    assert (_parse(path, include_dirs=[str(dir_b)])[0] ==
+            ["Use module 'work.sub_b'"])
+
+
+def test_clear_include_cache_forgets_changed_headers(tmpdir):
+    """A header changed after being cached is read again once the cache
+    is cleared, as it's done before every parse of a fileset"""
+    _write(tmpdir, "defs.vh", "`define SUBNAME sub_a\n")
+    path = _write(tmpdir, "top.v", _instance_source("defs.vh"))
+    assert _parse(path)[0] == ["Use module 'work.sub_a'"]
+    _write(tmpdir, "defs.vh", "`define SUBNAME sub_b\n")
+    clear_include_cache()
+    assert _parse(path)[0] == ["Use module 'work.sub_b'"]
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the watch command, which writes the Makefile again as soon as
+the files of the design change"""
+
+from __future__ import absolute_import
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+
+import pytest
+
+from hdlmake.__main__ import _get_parser
+from hdlmake.module_pool import ModulePool
+from hdlmake.action.watch import WatchServer
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_MANIFEST = """action = "simulation"
+sim_tool = "modelsim"
+sim_top = "top"
+files = ["defs.vh", "top.v", "sub_a.v", "sub_b.v", "other.v"]
+"""
+
+_HEADER = """`ifndef DEFS
+`define DEFS
+`define SUBNAME {0}
+`endif
+"""
+
+_TOP = """`include "defs.vh"
+module top;
+  `SUBNAME u0 ();
+endmodule
+"""
+
+
+def _write(path, text, stamp=None):
+    """Write the file at path, setting its modification time to stamp so
+    that the polling watcher sees the change at once"""
+    with open(path, "w") as file_aux:
+        file_aux.write(text)
+    if stamp is not None:
+        os.utime(path, (stamp, stamp))
+
+
+def _get_top_deps(path):
+    """Get the dependencies of the rule compiling top.v in the Makefile at
+    path, or None if it doesn't exist yet"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as file_aux:
+        lines = file_aux.read().splitlines()
+    for index, line in enumerate(lines):
+        if line.startswith("work/top/.top_v:"):
+            deps = []
+            for dep_line in lines[index + 1:]:
+                if dep_line.startswith("\t"):
+                    break
+                deps.append(dep_line.rstrip(" \\"))
+            return deps
+    return None
+
+
+def _wait_for_top_dep(path, dep, timeout=60.0):
+    """Wait until top.v depends on dep in the Makefile at path, and return
+    its dependencies"""
+    deps = None
+    end = time.time() + timeout
+    while time.time() < end:
+        deps = _get_top_deps(path)
+        if deps is not None and dep in deps:
+            return deps
+        time.sleep(0.1)
+    raise AssertionError("top.v doesn't depend on %s: %s" % (dep, deps))
+
+
+def _write_design(design):
+    """Write the files of the design watched by the tests"""
+    _write(os.path.join(design, "Manifest.py"), _MANIFEST)
+    _write(os.path.join(design, "defs.vh"), _HEADER.format("sub_b"))
+    _write(os.path.join(design, "top.v"), _TOP)
+    for name in ["sub_a", "sub_b", "other"]:
+        _write(os.path.join(design, name + ".v"),
+               "module %s; endmodule\n" % name)
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    """Get a watch server for the design written in tmpdir, whose Makefile
+    is already written, without watching the files"""
+    design = str(tmpdir)
+    _write_design(design)
+    monkeypatch.chdir(design)
+    parser = _get_parser()
+    options = parser.parse_args(
+        ["watch", "--socket", os.path.join(design, "watch.sock")])
+    watch_server = WatchServer(ModulePool(options), parser)
+    watch_server._update()
+    yield watch_server
+    if watch_server._server is not None:
+        watch_server._server.close()
+        os.remove(watch_server._socket_file)
+
+
+def test_only_changed_files_are_reset(server):
+    """Only the changed files, and those including them, are parsed again
+    when the content of some files changes"""
+    files = dict((os.path.basename(file_aux.path), file_aux)
+                 for module in server.pool for file_aux in module.files)
+    parsers = dict((name, file_aux.parser)
+                   for name, file_aux in files.items())
+    header = files["defs.vh"].path
+    _write(header, _HEADER.format("sub_a"), time.time() + 10)
+    server._pending.add(header)
+    server._apply_changes()
+    assert "work/sub_a/.sub_a_v" in _get_top_deps("Makefile")
+    for name in ["defs.vh", "top.v"]:
+        assert files[name].parser is not parsers[name]
+    for name in ["sub_a.v", "sub_b.v", "other.v"]:
+        assert files[name].parser is parsers[name]
+        assert files[name].is_parsed
+    # top.v isn't parsed again, but it's solved again without sub_a.v
+    _write(files["sub_a.v"].path, "module sub_x; endmodule\n",
+           time.time() + 20)
+    server._pending.add(files["sub_a.v"].path)
+    server._apply_changes()
+    assert "work/sub_a/.sub_a_v" not in _get_top_deps("Makefile")
+    assert files["top.v"].is_parsed
+
+
+def _request(server, request):
+    """Send the request line to the server, let it answer and get the
+    reply"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(server._socket_file)
+        client.sendall(request.encode("utf-8") + b"\n")
+        server._serve()
+        reply = b""
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    finally:
+        client.close()
+    return reply.decode("utf-8")
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"),
+                    reason="Unix sockets are not available")
+def test_failed_requests_are_answered(server, monkeypatch):
+    """A request failing with an unexpected error gets the error as the
+    reply, and the server keeps serving the requests"""
+    server._open_socket()
+
+    def _fail():
+        raise RuntimeError("broken tool")
+    monkeypatch.setattr(server.pool, "makefile", _fail)
+    assert _request(server, "makefile") == ("error: RuntimeError: "
+                                            "broken tool\n")
+    assert _request(server, 'list-files "').startswith("error: ValueError")
+    assert "other.v" in _request(server, "list-files")
+
+
+def test_watch_guarded_header():
+    """Changing a macro defined in an include-guarded header must change
+    the dependencies of the file including it, every time"""
+    design = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_REPO_DIR] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    process = None
+    output = open(os.devnull, "w")
+    try:
+        _write_design(design)
+        makefile = os.path.join(design, "Makefile")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "hdlmake", "watch",
+             "--polling", "--interval", "0.1"],
+            cwd=design, env=env,
+            stdout=output, stderr=subprocess.STDOUT)
+        deps = _wait_for_top_dep(makefile, "work/sub_b/.sub_b_v")
+        assert "work/sub_a/.sub_a_v" not in deps
+        stamp = time.time() + 10
+        for name, other in [("sub_a", "sub_b"), ("sub_b", "sub_a")]:
+            _write(os.path.join(design, "defs.vh"), _HEADER.format(name),
+                   stamp)
+            stamp += 10
+            deps = _wait_for_top_dep(makefile,
+                                     "work/{0}/.{0}_v".format(name))
+            assert "work/{0}/.{0}_v".format(other) not in deps
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        output.close()
+        shutil.rmtree(design)